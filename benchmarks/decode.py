@@ -0,0 +1,84 @@
+"""
+Benchmarks decoding (and parsing) the responses of each collector, with each
+installed JSON decoder.
+
+Run from the repository root with:
+
+    python -m benchmarks.decode
+"""
+import json
+import time
+
+import click
+
+from prometheus_es_exporter import (ClusterHealthCollector, IndicesAliasesCollector,
+                                    IndicesMappingsCollector, IndicesStatsCollector,
+                                    NodesStatsCollector)
+from prometheus_es_exporter.metrics import group_metrics
+from prometheus_es_exporter.parser import parse_response
+from prometheus_es_exporter.serializer import JSON_DECODERS
+
+from . import fixtures
+
+
+class QueryParser(object):
+    def parse_metric_dict(self, response):
+        return group_metrics(parse_response(response, ['query']))
+
+
+def benchmark_cases(scale):
+    return (
+        ('cluster_health', ClusterHealthCollector(None, 10, 'shards'),
+         fixtures.cluster_health(indices=1000 * scale)),
+        ('nodes_stats', NodesStatsCollector(None, 10),
+         fixtures.nodes_stats(nodes=100 * scale)),
+        ('indices_aliases', IndicesAliasesCollector(None, 10),
+         fixtures.indices_aliases(indices=1000 * scale)),
+        ('indices_mappings', IndicesMappingsCollector(None, 10),
+         fixtures.indices_mappings(indices=1000 * scale)),
+        ('indices_stats', IndicesStatsCollector(None, 10, parse_indices=True),
+         fixtures.indices_stats(indices=1000 * scale)),
+        ('query', QueryParser(),
+         fixtures.search(buckets=1000 * scale)),
+    )
+
+
+def best_time(func, arg, repeat):
+    """
+    Returns the shortest duration of repeat calls to func(arg), in seconds.
+    """
+    durations = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func(arg)
+        durations.append(time.perf_counter() - start_time)
+    return min(durations)
+
+
+@click.command()
+@click.option('--scale', default=1, type=click.IntRange(min=1),
+              help='Factor to scale the size of the responses by. (default: 1)')
+@click.option('--repeat', default=5, type=click.IntRange(min=1),
+              help='Number of times to time each case. The best time is reported. (default: 5)')
+def main(scale, repeat):
+    decoder_names = list(JSON_DECODERS)
+    columns = ['collector', 'size (MB)'] + ['{} (ms)'.format(name) for name in decoder_names]
+    columns.append('parse (ms)')
+    click.echo(''.join('{:>18}'.format(column) for column in columns))
+
+    for name, collector, response in benchmark_cases(scale):
+        raw_response = json.dumps(response)
+        row = [name, '{:.2f}'.format(len(raw_response) / 1e6)]
+        for decoder_name in decoder_names:
+            duration = best_time(JSON_DECODERS[decoder_name], raw_response, repeat)
+            row.append('{:.1f}'.format(duration * 1000))
+
+        decoded = json.loads(raw_response)
+        duration = best_time(collector.parse_metric_dict, decoded, repeat)
+        row.append('{:.1f}'.format(duration * 1000))
+
+        click.echo(''.join('{:>18}'.format(value) for value in row))
+
+
+if __name__ == '__main__':
+    main()
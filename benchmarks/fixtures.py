@@ -0,0 +1,370 @@
+"""
+Synthetic Elasticsearch responses for benchmarking, scaled up to the sizes
+seen on large clusters.
+
+The responses follow the structure of real responses, but their values are
+made up, and only a representative subset of stats is included.
+"""
+
+
+def _stats(seed):
+    # A subset of the stats included in node and index level stats responses.
+    return {
+        'docs': {'count': seed * 1000, 'deleted': seed},
+        'store': {'size_in_bytes': seed * 123456, 'throttle_time_in_millis': 0},
+        'indexing': {
+            'index_total': seed * 1000,
+            'index_time_in_millis': seed * 10,
+            'index_current': 0,
+            'index_failed': 0,
+            'delete_total': seed,
+            'delete_time_in_millis': seed,
+            'delete_current': 0,
+            'noop_update_total': 0,
+            'is_throttled': False,
+            'throttle_time_in_millis': 0,
+        },
+        'get': {
+            'total': seed * 10,
+            'time_in_millis': seed,
+            'exists_total': seed * 9,
+            'exists_time_in_millis': seed,
+            'missing_total': seed,
+            'missing_time_in_millis': 0,
+            'current': 0,
+        },
+        'search': {
+            'open_contexts': 0,
+            'query_total': seed * 100,
+            'query_time_in_millis': seed * 20,
+            'query_current': 0,
+            'fetch_total': seed * 100,
+            'fetch_time_in_millis': seed * 5,
+            'fetch_current': 0,
+            'scroll_total': 0,
+            'scroll_time_in_millis': 0,
+            'scroll_current': 0,
+        },
+        'merges': {
+            'current': 0,
+            'current_docs': 0,
+            'current_size_in_bytes': 0,
+            'total': seed,
+            'total_time_in_millis': seed * 3,
+            'total_docs': seed * 100,
+            'total_size_in_bytes': seed * 4567,
+        },
+        'refresh': {'total': seed * 7, 'total_time_in_millis': seed * 2, 'listeners': 0},
+        'flush': {'total': seed, 'periodic': 0, 'total_time_in_millis': seed},
+        'query_cache': {
+            'memory_size_in_bytes': seed * 100,
+            'total_count': seed * 10,
+            'hit_count': seed * 5,
+            'miss_count': seed * 5,
+            'cache_size': seed,
+            'cache_count': seed,
+            'evictions': 0,
+        },
+        'fielddata': {'memory_size_in_bytes': seed * 50, 'evictions': 0},
+        'segments': {
+            'count': seed,
+            'memory_in_bytes': seed * 1000,
+            'terms_memory_in_bytes': seed * 600,
+            'stored_fields_memory_in_bytes': seed * 100,
+            'norms_memory_in_bytes': seed * 50,
+            'points_memory_in_bytes': seed * 150,
+            'doc_values_memory_in_bytes': seed * 100,
+            'index_writer_memory_in_bytes': 0,
+            'version_map_memory_in_bytes': 0,
+            'fixed_bit_set_memory_in_bytes': 0,
+            'max_unsafe_auto_id_timestamp': -1,
+        },
+        'translog': {
+            'operations': seed,
+            'size_in_bytes': seed * 55,
+            'uncommitted_operations': 0,
+            'uncommitted_size_in_bytes': 55,
+        },
+    }
+
+
+def index_name(i):
+    return 'logs-{:06d}'.format(i)
+
+
+def cluster_health(indices=1000, shards=5):
+    """
+    A /_cluster/health?level=shards response.
+    """
+    return {
+        'cluster_name': 'benchmark',
+        'status': 'green',
+        'timed_out': False,
+        'number_of_nodes': 10,
+        'number_of_data_nodes': 10,
+        'active_primary_shards': indices * shards,
+        'active_shards': indices * shards * 2,
+        'relocating_shards': 0,
+        'initializing_shards': 0,
+        'unassigned_shards': 0,
+        'delayed_unassigned_shards': 0,
+        'number_of_pending_tasks': 0,
+        'number_of_in_flight_fetch': 0,
+        'task_max_waiting_in_queue_millis': 0,
+        'active_shards_percent_as_number': 100.0,
+        'indices': {
+            index_name(i): {
+                'status': 'green',
+                'number_of_shards': shards,
+                'number_of_replicas': 1,
+                'active_primary_shards': shards,
+                'active_shards': shards * 2,
+                'relocating_shards': 0,
+                'initializing_shards': 0,
+                'unassigned_shards': 0,
+                'shards': {
+                    str(s): {
+                        'status': 'green',
+                        'primary_active': True,
+                        'active_shards': 2,
+                        'relocating_shards': 0,
+                        'initializing_shards': 0,
+                        'unassigned_shards': 0,
+                    }
+                    for s in range(shards)
+                },
+            }
+            for i in range(indices)
+        },
+    }
+
+
+def nodes_stats(nodes=100):
+    """
+    A /_nodes/stats response.
+    """
+    return {
+        '_nodes': {'total': nodes, 'successful': nodes, 'failed': 0},
+        'cluster_name': 'benchmark',
+        'nodes': {
+            'node{:04d}'.format(n): {
+                'timestamp': 1600000000000,
+                'name': 'node-{}'.format(n),
+                'transport_address': '10.0.{}.{}:9300'.format(n // 256, n % 256),
+                'host': '10.0.{}.{}'.format(n // 256, n % 256),
+                'ip': '10.0.{}.{}:9300'.format(n // 256, n % 256),
+                'roles': ['master', 'data', 'ingest'],
+                'indices': _stats(n + 1),
+                'jvm': {
+                    'timestamp': 1600000000000,
+                    'uptime_in_millis': 123456789,
+                    'mem': {
+                        'heap_used_in_bytes': n * 1000000,
+                        'heap_used_percent': n % 100,
+                        'heap_committed_in_bytes': 1073741824,
+                        'heap_max_in_bytes': 1073741824,
+                        'non_heap_used_in_bytes': 123456789,
+                        'non_heap_committed_in_bytes': 133456789,
+                        'pools': {
+                            pool: {
+                                'used_in_bytes': n * 1000,
+                                'max_in_bytes': 1073741824,
+                                'peak_used_in_bytes': n * 2000,
+                                'peak_max_in_bytes': 1073741824,
+                            }
+                            for pool in ('young', 'survivor', 'old')
+                        },
+                    },
+                    'threads': {'count': 100, 'peak_count': 120},
+                    'gc': {
+                        'collectors': {
+                            gc: {'collection_count': n * 10, 'collection_time_in_millis': n * 100}
+                            for gc in ('young', 'old')
+                        },
+                    },
+                },
+                'thread_pool': {
+                    pool: {
+                        'threads': 8,
+                        'queue': 0,
+                        'active': n % 8,
+                        'rejected': 0,
+                        'largest': 8,
+                        'completed': n * 1000,
+                    }
+                    for pool in ('search', 'write', 'get', 'management', 'refresh', 'flush')
+                },
+            }
+            for n in range(nodes)
+        },
+    }
+
+
+def indices_aliases(indices=1000, aliases=2):
+    """
+    A /_alias response.
+    """
+    return {
+        index_name(i): {
+            'aliases': {'alias-{}-{}'.format(i % 100, a): {} for a in range(aliases)},
+        }
+        for i in range(indices)
+    }
+
+
+def indices_mappings(indices=1000, fields=50):
+    """
+    A /_mappings response.
+    """
+    return {
+        index_name(i): {
+            'mappings': {
+                'properties': {
+                    'field{}'.format(f): {
+                        'type': 'text',
+                        'fields': {'keyword': {'type': 'keyword', 'ignore_above': 256}},
+                    } if f % 2 else {'type': 'long'}
+                    for f in range(fields)
+                },
+            },
+        }
+        for i in range(indices)
+    }
+
+
+def indices_stats(indices=1000):
+    """
+    An /_stats response.
+    """
+    return {
+        '_shards': {'total': indices * 10, 'successful': indices * 10, 'failed': 0},
+        '_all': {'primaries': _stats(indices), 'total': _stats(indices * 2)},
+        'indices': {
+            index_name(i): {
+                'uuid': 'uuid{:06d}'.format(i),
+                'primaries': _stats(i + 1),
+                'total': _stats((i + 1) * 2),
+            }
+            for i in range(indices)
+        },
+    }
+
+
+def search(buckets=1000, sub_buckets=10):
+    """
+    A search response with two levels of terms aggregations, with a value
+    metric aggregation in each bucket.
+    """
+    return {
+        'took': 123,
+        'timed_out': False,
+        '_shards': {'total': 5, 'successful': 5, 'skipped': 0, 'failed': 0},
+        'hits': {'total': {'value': 10000, 'relation': 'gte'}, 'max_score': None, 'hits': []},
+        'aggregations': {
+            'group1_term': {
+                'doc_count_error_upper_bound': 0,
+                'sum_other_doc_count': 0,
+                'buckets': [
+                    {
+                        'key': 'group-{}'.format(b),
+                        'doc_count': b * sub_buckets,
+                        'val_sum': {'value': b * 1.5},
+                        'group2_term': {
+                            'doc_count_error_upper_bound': 0,
+                            'sum_other_doc_count': 0,
+                            'buckets': [
+                                {
+                                    'key': 'sub-{}'.format(s),
+                                    'doc_count': b + s,
+                                    'val_sum': {'value': (b + s) * 1.5},
+                                }
+                                for s in range(sub_buckets)
+                            ],
+                        },
+                    }
+                    for b in range(buckets)
+                ],
+            },
+        },
+    }
+
+
+def deep_mappings(indices=1000, fields=10, depth=5):
+    """
+    A /_mappings response with deeply nested object fields. Each level has
+    fields leaf fields, and an object field containing the next level.
+    """
+    def level(d):
+        properties = {
+            'field{}'.format(f): {
+                'type': 'text',
+                'fields': {'keyword': {'type': 'keyword', 'ignore_above': 256}},
+            } if f % 2 else {'type': 'long'}
+            for f in range(fields)
+        }
+        if d < depth:
+            properties['object{}'.format(d)] = level(d + 1)
+        return {'properties': properties}
+
+    return {
+        index_name(i): {'mappings': level(0)}
+        for i in range(indices)
+    }
+
+
+def nested_search(buckets=100, histogram_buckets=24, sub_buckets=5):
+    """
+    A search response with a terms aggregation, containing a date histogram,
+    containing another terms aggregation, with stats and percentiles metric
+    aggregations in each leaf bucket.
+    """
+    def leaf(seed):
+        return {
+            'key': 'host-{}'.format(seed % sub_buckets),
+            'doc_count': seed,
+            'latency_stats': {
+                'count': seed,
+                'min': seed * 0.1,
+                'max': seed * 10.0,
+                'avg': seed * 1.5,
+                'sum': seed * seed * 1.5,
+            },
+            'latency_percentiles': {
+                'values': {'50.0': seed * 1.2, '95.0': seed * 4.5, '99.0': seed * 9.1},
+            },
+        }
+
+    return {
+        'took': 456,
+        'timed_out': False,
+        '_shards': {'total': 5, 'successful': 5, 'skipped': 0, 'failed': 0},
+        'hits': {'total': {'value': 10000, 'relation': 'gte'}, 'max_score': None, 'hits': []},
+        'aggregations': {
+            'service_term': {
+                'doc_count_error_upper_bound': 0,
+                'sum_other_doc_count': 0,
+                'buckets': [
+                    {
+                        'key': 'service-{}'.format(b),
+                        'doc_count': b * histogram_buckets * sub_buckets,
+                        'hour_histogram': {
+                            'buckets': [
+                                {
+                                    'key_as_string': '2020-01-01T{:02d}:00:00.000Z'.format(h % 24),
+                                    'key': 1577836800000 + h * 3600000,
+                                    'doc_count': b + h,
+                                    'host_term': {
+                                        'doc_count_error_upper_bound': 0,
+                                        'sum_other_doc_count': 0,
+                                        'buckets': [leaf(b + h + s) for s in range(sub_buckets)],
+                                    },
+                                }
+                                for h in range(histogram_buckets)
+                            ],
+                        },
+                    }
+                    for b in range(buckets)
+                ],
+            },
+        },
+    }
@@ -0,0 +1,259 @@
+"""
+Benchmarks each stage of turning a decoded response into served metrics, for
+the responses of each collector and for queries:
+
+* parse: the collector's (or query's) parse_response(),
+* group_metrics: grouping the parsed metrics into a metric dict,
+* merge_metric_dicts: merging the metric dict into the previous run's (as
+  queries do, with zero_missing set),
+* gauge_generator: generating the metric families and formatting them in the
+  Prometheus text format (as scrapes do).
+
+The best time of several repeats (with garbage collection paused while
+timing, as timeit does), and the peak memory allocated (measured with
+tracemalloc in a separate run), are reported for each stage. All the cases
+are run in several rounds, and the best time of any round is kept, so a busy
+patch on the machine only slows down some of a stage's timings.
+
+Run from the repository root with:
+
+    python -m benchmarks.parse
+
+Results can be saved as a baseline with --save-baseline, and later compared
+to it with --compare, e.g. before and after a change. Timings depend on the
+machine, so only compare against baselines saved on the same machine - the
+committed benchmarks/baseline.json is only a reference.
+"""
+import copy
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+from collections import OrderedDict
+
+import click
+
+from prometheus_es_exporter import (ClusterHealthCollector, IndicesAliasesCollector,
+                                    IndicesMappingsCollector, IndicesStatsCollector,
+                                    NodesStatsCollector)
+from prometheus_es_exporter.exposition import format_metric_family
+from prometheus_es_exporter.metrics import gauge_generator, group_metrics, merge_metric_dicts
+from prometheus_es_exporter.parser import parse_response
+
+from . import fixtures
+
+STAGES = ('parse', 'group_metrics', 'merge_metric_dicts', 'gauge_generator')
+
+# Shorter timings are too noisy to compare.
+MIN_COMPARED_TIME_MS = 5
+
+
+def parse_query(response):
+    return parse_response(response, ['query'])
+
+
+def benchmark_cases(scale):
+    """
+    Returns a dict of case name -> (parse function, response function).
+    """
+    return OrderedDict([
+        ('cluster_health', (ClusterHealthCollector(None, 10, 'shards').parse,
+                            lambda: fixtures.cluster_health(indices=2000 * scale))),
+        ('cluster_health_summary', (ClusterHealthCollector(None, 10, 'shards-summary').parse,
+                                    lambda: fixtures.cluster_health(indices=2000 * scale))),
+        ('nodes_stats', (NodesStatsCollector(None, 10).parse,
+                         lambda: fixtures.nodes_stats(nodes=300 * scale))),
+        ('indices_aliases', (IndicesAliasesCollector(None, 10).parse,
+                             lambda: fixtures.indices_aliases(indices=2000 * scale))),
+        ('indices_mappings', (IndicesMappingsCollector(None, 10).parse,
+                              lambda: fixtures.deep_mappings(indices=2000 * scale))),
+        ('indices_stats', (IndicesStatsCollector(None, 10, parse_indices=True).parse,
+                           lambda: fixtures.indices_stats(indices=2000 * scale))),
+        ('query', (parse_query,
+                   lambda: fixtures.nested_search(buckets=100 * scale))),
+    ])
+
+
+def stage_functions(parse, response):
+    """
+    Returns a list of (stage name, setup function, stage function) tuples for
+    a case.
+
+    The setup function returns the stage function's argument, so each call of
+    a stage gets a fresh argument (parsers can modify their response), and the
+    setup isn't included in the measurements.
+    """
+    metrics = parse(copy.deepcopy(response))
+    metric_dict = group_metrics(metrics)
+
+    def merge(metric_dicts):
+        return merge_metric_dicts(*metric_dicts, zero_missing=True)
+
+    def generate(metric_dict):
+        return ''.join(format_metric_family(family) for family in gauge_generator(metric_dict))
+
+    return [
+        ('parse', lambda: copy.deepcopy(response), parse),
+        ('group_metrics', lambda: metrics, group_metrics),
+        ('merge_metric_dicts', lambda: (metric_dict, metric_dict), merge),
+        ('gauge_generator', lambda: metric_dict, generate),
+    ]
+
+
+def best_time(setup, func, repeat):
+    """
+    Returns the shortest duration of repeat calls to func(setup()), in
+    seconds.
+
+    The shortest duration is the one least disturbed by other processes.
+    Garbage collections are paused while timing, as they'd otherwise land
+    in whichever call happens to trigger them.
+    """
+    durations = []
+    for _ in range(repeat):
+        arg = setup()
+        gc.collect()
+        gc.disable()
+        try:
+            start_time = time.perf_counter()
+            func(arg)
+            durations.append(time.perf_counter() - start_time)
+        finally:
+            gc.enable()
+    return min(durations)
+
+
+def peak_memory(setup, func):
+    """
+    Returns the peak memory allocated during a call to func(setup()), in
+    bytes.
+    """
+    arg = setup()
+    tracemalloc.start()
+    try:
+        func(arg)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmarks(cases, repeat, rounds=1):
+    """
+    Returns a dict of case name -> stage name -> dict of results.
+
+    Peak memory doesn't vary between rounds, so is only measured in the
+    first.
+    """
+    results = OrderedDict()
+    for _ in range(rounds):
+        for name, (parse, response_func) in cases.items():
+            stage_results = results.setdefault(name, OrderedDict())
+            for stage, setup, func in stage_functions(parse, response_func()):
+                time_ms = best_time(setup, func, repeat) * 1000
+                if stage in stage_results:
+                    stage_results[stage]['time_ms'] = min(stage_results[stage]['time_ms'], time_ms)
+                else:
+                    stage_results[stage] = {'time_ms': time_ms,
+                                            'peak_kb': peak_memory(setup, func) / 1024}
+    return results
+
+
+def format_change(value, baseline_value):
+    if not baseline_value:
+        return '-'
+    return '{:+.0%}'.format(value / baseline_value - 1)
+
+
+def print_results(results, baseline_results=None):
+    columns = ['case', 'stage', 'time (ms)', 'peak (KB)']
+    if baseline_results is not None:
+        columns += ['time change', 'peak change']
+    click.echo(''.join('{:>24}'.format(column) for column in columns))
+
+    for name, stage_results in results.items():
+        for stage in STAGES:
+            result = stage_results[stage]
+            row = [name, stage, '{:.1f}'.format(result['time_ms']), '{:.0f}'.format(result['peak_kb'])]
+            if baseline_results is not None:
+                baseline = baseline_results.get(name, {}).get(stage, {})
+                row += [format_change(result['time_ms'], baseline.get('time_ms')),
+                        format_change(result['peak_kb'], baseline.get('peak_kb'))]
+            click.echo(''.join('{:>24}'.format(value) for value in row))
+
+
+def regressions(results, baseline_results, tolerance, memory_tolerance):
+    """
+    Returns a list of (case, stage, measurement) tuples for measurements that
+    are worse than the baseline by more than tolerance (a fraction) for
+    times, or memory_tolerance for peak memory. Stages taking less than
+    MIN_COMPARED_TIME_MS in the baseline aren't compared on time.
+    """
+    tolerances = {'time_ms': tolerance, 'peak_kb': memory_tolerance}
+    regressed = []
+    for name, stage_results in results.items():
+        for stage, result in stage_results.items():
+            baseline = baseline_results.get(name, {}).get(stage, {})
+            for measurement, value in result.items():
+                baseline_value = baseline.get(measurement)
+                if measurement == 'time_ms' and (baseline_value or 0) < MIN_COMPARED_TIME_MS:
+                    continue
+                if baseline_value and value > baseline_value * (1 + tolerances[measurement]):
+                    regressed.append((name, stage, measurement))
+    return regressed
+
+
+@click.command()
+@click.option('--scale', default=1, type=click.IntRange(min=1),
+              help='Factor to scale the size of the responses by. (default: 1)')
+@click.option('--repeat', default=3, type=click.IntRange(min=1),
+              help='Number of times to time each stage in each round. The best time is '
+                   'reported. (default: 3)')
+@click.option('--rounds', default=3, type=click.IntRange(min=1),
+              help='Number of rounds to run all the cases in. (default: 3)')
+@click.option('--case', 'case_names', multiple=True, type=click.Choice(sorted(benchmark_cases(1))),
+              help='Only run this case. Can be given multiple times. (default: all cases)')
+@click.option('--save-baseline', type=click.Path(dir_okay=False),
+              help='Save the results as a baseline in this file.')
+@click.option('--compare', type=click.File('r'),
+              help='Compare the results to a baseline saved with --save-baseline. Exits with '
+                   'status 1 if any measurement regressed by more than --tolerance or '
+                   '--memory-tolerance.')
+@click.option('--tolerance', default=0.25, type=click.FloatRange(min=0),
+              help='Fraction a time may be worse than the baseline before it\'s a regression. '
+                   '(default: 0.25)')
+@click.option('--memory-tolerance', default=0.1, type=click.FloatRange(min=0),
+              help='Fraction a peak memory measurement may be worse than the baseline before '
+                   'it\'s a regression. (default: 0.1)')
+def main(scale, repeat, rounds, case_names, save_baseline, compare, tolerance, memory_tolerance):
+    baseline_results = None
+    if compare:
+        baseline = json.load(compare)
+        if baseline['scale'] != scale:
+            raise click.BadParameter('baseline was saved with --scale {}'.format(baseline['scale']),
+                                     param_hint='--compare')
+        baseline_results = baseline['results']
+
+    cases = benchmark_cases(scale)
+    if case_names:
+        cases = OrderedDict((name, case) for name, case in cases.items() if name in case_names)
+
+    results = run_benchmarks(cases, repeat, rounds)
+    print_results(results, baseline_results)
+
+    if save_baseline:
+        with open(save_baseline, 'w') as f:
+            json.dump({'scale': scale, 'results': results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if baseline_results is not None:
+        regressed = regressions(results, baseline_results, tolerance, memory_tolerance)
+        for name, stage, measurement in regressed:
+            click.echo('Regression: {} {} {}'.format(name, stage, measurement), err=True)
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
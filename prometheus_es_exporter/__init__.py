@@ -9,22 +9,43 @@ import os
 import sched
 import time
 
+from collections import OrderedDict, namedtuple
 from elasticsearch import Elasticsearch
 from elasticsearch.exceptions import ConnectionTimeout
 from jog import JogFormatter
-from prometheus_client import start_http_server
-from prometheus_client.core import GaugeMetricFamily, REGISTRY
+from prometheus_client import GC_COLLECTOR, PLATFORM_COLLECTOR, PROCESS_COLLECTOR
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 
 from . import cluster_health_parser
 from . import indices_aliases_parser
+from . import indices_cat_parser
 from . import indices_mappings_parser
 from . import indices_stats_parser
 from . import nodes_stats_parser
-from .metrics import (group_metrics, gauge_generator,
-                      format_metric_name, merge_metric_dicts)
-from .parser import parse_response
+from .circuit_breaker import CIRCUIT_BREAKER_METRICS, CircuitBreaker, CircuitOpenError
+from .compression import SNAPPY_INSTALLED
+from .connection import CONNECTION_METRICS, ExporterConnection, last_response_size
+from .hedging import HEDGING_METRICS
+from .metrics import (group_metrics, gauge_generator, format_metric_name,
+                      merge_metric_dicts, add_metric_dicts, subtract_metric_dicts)
+from .parser import (parse_response, add_range_filter, composite_after_keys,
+                     composite_next_page_query, relative_range_fields, remove_sliding_window,
+                     set_composite_page_size)
+from .probe import Prober
+from .query_stats import (QUERY_TOOK, QUERY_DURATION, QUERY_RESPONSE_SIZE,
+                          QUERY_PARSE_DURATION, QUERY_SERIES, QUERY_TIMEOUTS,
+                          QUERY_ERRORS, QUERY_SKIPS, QUERY_LAST_SUCCESS,
+                          QUERY_STATS_GENERATION, QueryStatsCollector, count_series)
 from .scheduler import schedule_job
-from .utils import log_exceptions, nice_shutdown
+from .server import start_http_server
+from .transport import ExporterTransport
+from .serializer import ExporterSerializer, JSON_DECODER_NAMES, json_decoder, raw_responses
+from .registry import ExporterRegistry
+from .request_budget import (HIGH_PRIORITY, NORMAL_PRIORITY, REQUEST_BUDGET_METRICS,
+                             RequestBudget)
+from .remote_write import REMOTE_WRITE_METRICS, RemoteWriter
+from .utils import Generation, log_exceptions, nice_shutdown
+from .workers import ParsePool, WorkerPool
 
 log = logging.getLogger(__name__)
 
@@ -33,6 +54,18 @@ CONTEXT_SETTINGS = {
 }
 
 METRICS_BY_QUERY = {}
+# Incremented whenever the metrics in METRICS_BY_QUERY change, overall and per
+# query.
+METRICS_BY_QUERY_GENERATION = Generation()
+METRICS_BY_QUERY_GENERATIONS = {}
+# Incremental queries map to a tuple containing:
+# * watermark - the end of the last time window queried, in epoch milliseconds,
+# * time of the last full reconciliation run, from time.monotonic().
+INCREMENTAL_STATE_BY_QUERY = {}
+
+# The result of run_search(). Times are in seconds, and sizes in bytes.
+SearchResult = namedtuple('SearchResult', ['metric_dict', 'timed_out', 'took',
+                                           'response_size', 'parse_duration'])
 
 
 def collector_up_gauge(name_list, description, succeeded=True):
@@ -41,49 +74,85 @@ def collector_up_gauge(name_list, description, succeeded=True):
     return GaugeMetricFamily(metric_name, description, value=int(succeeded))
 
 
-class ClusterHealthCollector(object):
-    def __init__(self, es_client, timeout, level):
-        self.metric_name_list = ['es', 'cluster_health']
-        self.description = 'Cluster Health'
+def collector_last_success_gauge(name_list, description, timestamp):
+    metric_name = format_metric_name(*name_list, 'last_success_timestamp_seconds')
+    description = 'When the {} metrics were last fetched successfully.'.format(description)
+    return GaugeMetricFamily(metric_name, description, value=timestamp)
 
-        self.es_client = es_client
-        self.timeout = timeout
-        self.level = level
 
-    def collect(self):
-        try:
-            response = self.es_client.cluster.health(level=self.level, request_timeout=self.timeout)
+class ElasticsearchCollector(object):
+    """
+    Base class for collectors that fetch a response from Elasticsearch and
+    parse it into metrics.
 
-            metrics = cluster_health_parser.parse_response(response, self.metric_name_list)
-            metric_dict = group_metrics(metrics)
-        except ConnectionTimeout:
-            log.warning('Timeout while fetching %(description)s (timeout %(timeout_s)ss).',
-                        {'description': self.description, 'timeout_s': self.timeout})
-            yield collector_up_gauge(self.metric_name_list, self.description, succeeded=False)
-        except Exception:
-            log.exception('Error while fetching %(description)s.',
-                          {'description': self.description})
-            yield collector_up_gauge(self.metric_name_list, self.description, succeeded=False)
-        else:
-            yield from gauge_generator(metric_dict)
-            yield collector_up_gauge(self.metric_name_list, self.description)
+    Subclasses set metric_name_list and description, and implement fetch()
+    and parse(). If a worker pool is given, the response is fetched and parsed
+    in a worker process, and only the resulting metric dict is sent back.
+    Otherwise, if a parse pool is given, the response is fetched undecoded and
+    sent to a worker process to be decoded and parsed.
 
+    If serve_stale is set, the last metrics fetched are kept, and served
+    while the circuit breaker is open.
 
-class NodesStatsCollector(object):
-    def __init__(self, es_client, timeout, metrics=None):
-        self.metric_name_list = ['es', 'nodes_stats']
-        self.description = 'Nodes Stats'
+    priority is the priority of the collector's requests in the request
+    budget, when they're made by a worker process.
+    """
+    metric_name_list = None
+    description = None
+    priority = NORMAL_PRIORITY
 
+    def __init__(self, es_client, timeout, worker_pool=None, parse_pool=None,
+                 serve_stale=False):
         self.es_client = es_client
         self.timeout = timeout
-        self.metrics = metrics
+        self.worker_pool = worker_pool
+        self.parse_pool = parse_pool
+        self.serve_stale = serve_stale
+        self.last_metric_dict = None
+        self.last_success_time = None
+
+    def __getstate__(self):
+        # Collectors are pickled to send them to worker processes, which use
+        # their own client.
+        state = self.__dict__.copy()
+        state['es_client'] = None
+        state['worker_pool'] = None
+        state['parse_pool'] = None
+        state['last_metric_dict'] = None
+        return state
+
+    def fetch(self):
+        raise NotImplementedError()
+
+    def parse(self, response):
+        raise NotImplementedError()
+
+    def parse_metric_dict(self, response):
+        metrics = self.parse(response)
+        return group_metrics(metrics)
+
+    def fetch_metric_dict(self):
+        if self.parse_pool is not None:
+            with raw_responses():
+                raw_response = self.fetch()
+            return self.parse_pool.parse(self, raw_response)
+
+        response = self.fetch()
+        return self.parse_metric_dict(response)
 
     def collect(self):
         try:
-            response = self.es_client.nodes.stats(metric=self.metrics, request_timeout=self.timeout)
-
-            metrics = nodes_stats_parser.parse_response(response, self.metric_name_list)
-            metric_dict = group_metrics(metrics)
+            if self.worker_pool is not None:
+                metric_dict = self.worker_pool.call(fetch_collector_metric_dict, self,
+                                                    priority=self.priority)
+            else:
+                metric_dict = self.fetch_metric_dict()
+        except CircuitOpenError:
+            log.warning('Circuit breaker open, not fetching %(description)s.',
+                        {'description': self.description})
+            if self.last_metric_dict is not None:
+                yield from gauge_generator(self.last_metric_dict)
+            yield collector_up_gauge(self.metric_name_list, self.description, succeeded=False)
         except ConnectionTimeout:
             log.warning('Timeout while fetching %(description)s (timeout %(timeout_s)ss).',
                         {'description': self.description, 'timeout_s': self.timeout})
@@ -93,104 +162,158 @@ class NodesStatsCollector(object):
                           {'description': self.description})
             yield collector_up_gauge(self.metric_name_list, self.description, succeeded=False)
         else:
+            self.last_success_time = time.time()
+            if self.serve_stale:
+                self.last_metric_dict = metric_dict
             yield from gauge_generator(metric_dict)
             yield collector_up_gauge(self.metric_name_list, self.description)
 
+        # Lets the age of stale metrics be tracked.
+        if self.last_success_time is not None:
+            yield collector_last_success_gauge(self.metric_name_list, self.description,
+                                               self.last_success_time)
 
-class IndicesAliasesCollector(object):
-    def __init__(self, es_client, timeout):
-        self.metric_name_list = ['es', 'indices_aliases']
-        self.description = 'Indices Aliases'
 
-        self.es_client = es_client
-        self.timeout = timeout
+def fetch_collector_metric_dict(es_client, collector):
+    """
+    Fetches a collector's metric dict using the given client.
 
-    def collect(self):
-        try:
-            response = self.es_client.indices.get_alias(request_timeout=self.timeout)
+    Used to run collectors in worker processes.
+    """
+    collector.es_client = es_client
+    return collector.fetch_metric_dict()
 
-            metrics = indices_aliases_parser.parse_response(response, self.metric_name_list)
-            metric_dict = group_metrics(metrics)
-        except ConnectionTimeout:
-            log.warning('Timeout while fetching %(description)s (timeout %(timeout_s)ss).',
-                        {'description': self.description, 'timeout_s': self.timeout})
-            yield collector_up_gauge(self.metric_name_list, self.description, succeeded=False)
-        except Exception:
-            log.exception('Error while fetching %(description)s.',
-                          {'description': self.description})
-            yield collector_up_gauge(self.metric_name_list, self.description, succeeded=False)
-        else:
-            yield from gauge_generator(metric_dict)
-            yield collector_up_gauge(self.metric_name_list, self.description)
 
+class ClusterHealthCollector(ElasticsearchCollector):
+    metric_name_list = ['es', 'cluster_health']
+    description = 'Cluster Health'
+    priority = HIGH_PRIORITY
 
-class IndicesMappingsCollector(object):
-    def __init__(self, es_client, timeout):
-        self.metric_name_list = ['es', 'indices_mappings']
-        self.description = 'Indices Mappings'
+    def __init__(self, es_client, timeout, level, **kwargs):
+        super().__init__(es_client, timeout, **kwargs)
+        self.level = level
 
-        self.es_client = es_client
-        self.timeout = timeout
+    def fetch(self):
+        # The shards summary level needs the shards level response, but only
+        # exports counts of the shards of each index.
+        level = 'shards' if self.level == 'shards-summary' else self.level
+        return self.es_client.cluster.health(level=level, request_timeout=self.timeout)
 
-    def collect(self):
-        try:
-            response = self.es_client.indices.get_mapping(request_timeout=self.timeout)
+    def parse(self, response):
+        return cluster_health_parser.parse_response(response, self.metric_name_list,
+                                                    aggregate_shards=self.level == 'shards-summary')
 
-            metrics = indices_mappings_parser.parse_response(response, self.metric_name_list)
-            metric_dict = group_metrics(metrics)
-        except ConnectionTimeout:
-            log.warning('Timeout while fetching %(description)s (timeout %(timeout_s)ss).',
-                        {'description': self.description, 'timeout_s': self.timeout})
-            yield collector_up_gauge(self.metric_name_list, self.description, succeeded=False)
-        except Exception:
-            log.exception('Error while fetching %(description)s.',
-                          {'description': self.description})
-            yield collector_up_gauge(self.metric_name_list, self.description, succeeded=False)
-        else:
-            yield from gauge_generator(metric_dict)
-            yield collector_up_gauge(self.metric_name_list, self.description)
 
+class NodesStatsCollector(ElasticsearchCollector):
+    metric_name_list = ['es', 'nodes_stats']
+    description = 'Nodes Stats'
 
-class IndicesStatsCollector(object):
-    def __init__(self, es_client, timeout, parse_indices=False,
-                 indices=None, metrics=None, fields=None):
-        self.metric_name_list = ['es', 'indices_stats']
-        self.description = 'Indices Stats'
+    def __init__(self, es_client, timeout, metrics=None, **kwargs):
+        super().__init__(es_client, timeout, **kwargs)
+        self.metrics = metrics
 
-        self.es_client = es_client
-        self.timeout = timeout
+    def fetch(self):
+        return self.es_client.nodes.stats(metric=self.metrics, request_timeout=self.timeout)
+
+    def parse(self, response):
+        return nodes_stats_parser.parse_response(response, self.metric_name_list)
+
+
+class IndicesAliasesCollector(ElasticsearchCollector):
+    metric_name_list = ['es', 'indices_aliases']
+    description = 'Indices Aliases'
+
+    def fetch(self):
+        return self.es_client.indices.get_alias(request_timeout=self.timeout)
+
+    def parse(self, response):
+        return indices_aliases_parser.parse_response(response, self.metric_name_list)
+
+
+class IndicesMappingsCollector(ElasticsearchCollector):
+    metric_name_list = ['es', 'indices_mappings']
+    description = 'Indices Mappings'
+
+    def fetch(self):
+        return self.es_client.indices.get_mapping(request_timeout=self.timeout)
+
+    def parse(self, response):
+        return indices_mappings_parser.parse_response(response, self.metric_name_list)
+
+
+class IndicesStatsCollector(ElasticsearchCollector):
+    metric_name_list = ['es', 'indices_stats']
+    description = 'Indices Stats'
+
+    def __init__(self, es_client, timeout, parse_indices=False,
+                 indices=None, metrics=None, fields=None, **kwargs):
+        super().__init__(es_client, timeout, **kwargs)
         self.parse_indices = parse_indices
         self.indices = indices
         self.metrics = metrics
         self.fields = fields
 
-    def collect(self):
-        try:
-            response = self.es_client.indices.stats(index=self.indices,
-                                                    metric=self.metrics,
-                                                    fields=self.fields,
-                                                    request_timeout=self.timeout)
-
-            metrics = indices_stats_parser.parse_response(response,
-                                                          self.parse_indices,
-                                                          self.metric_name_list)
-            metric_dict = group_metrics(metrics)
-        except ConnectionTimeout:
-            log.warning('Timeout while fetching %(description)s (timeout %(timeout_s)ss).',
-                        {'description': self.description, 'timeout_s': self.timeout})
-            yield collector_up_gauge(self.metric_name_list, self.description, succeeded=False)
-        except Exception:
-            log.exception('Error while fetching %(description)s.',
-                          {'description': self.description})
-            yield collector_up_gauge(self.metric_name_list, self.description, succeeded=False)
-        else:
-            yield from gauge_generator(metric_dict)
-            yield collector_up_gauge(self.metric_name_list, self.description)
+    def fetch(self):
+        return self.es_client.indices.stats(index=self.indices,
+                                            metric=self.metrics,
+                                            fields=self.fields,
+                                            request_timeout=self.timeout)
+
+    def parse(self, response):
+        return indices_stats_parser.parse_response(response,
+                                                   self.parse_indices,
+                                                   self.metric_name_list)
+
+
+class IndicesCatCollector(ElasticsearchCollector):
+    """
+    Collects a subset of indices stats from _cat/indices, which is much
+    cheaper than the full indices stats for clusters with many indices.
+
+    The metrics have the same names as the equivalent indices stats metrics.
+    """
+    metric_name_list = ['es', 'indices_stats']
+    description = 'Indices Stats'
+
+    def __init__(self, es_client, timeout, parse_indices=False,
+                 indices=None, metrics=None, **kwargs):
+        super().__init__(es_client, timeout, **kwargs)
+        self.parse_indices = parse_indices
+        self.indices = indices
+        self.columns = indices_cat_parser.column_paths(metrics)
+
+    def fetch(self):
+        return self.es_client.cat.indices(index=self.indices,
+                                          format='json',
+                                          h=['index'] + list(self.columns),
+                                          bytes='b',
+                                          time='ms',
+                                          pri=True,
+                                          request_timeout=self.timeout)
+
+    def parse(self, response):
+        return indices_cat_parser.parse_response(response,
+                                                 self.columns,
+                                                 self.parse_indices,
+                                                 self.metric_name_list)
 
 
 class QueryMetricCollector(object):
 
+    def __init__(self, query_name=None):
+        # Only collect the metrics for this query, if set.
+        self.query_name = query_name
+
+    def generation(self):
+        if self.query_name is not None:
+            return query_generation(self.query_name).value
+        return METRICS_BY_QUERY_GENERATION.value
+
     def collect(self):
+        if self.query_name is not None:
+            yield from gauge_generator(METRICS_BY_QUERY.get(self.query_name, {}))
+            return
+
         # Copy METRICS_BY_QUERY before iterating over it
         # as it may be updated by other threads.
         # (only first level - lower levels are replaced
@@ -200,19 +323,223 @@ class QueryMetricCollector(object):
             yield from gauge_generator(metric_dict)
 
 
-def run_query(es_client, query_name, indices, query,
-              timeout, on_error, on_missing):
+class ConnectionPoolCollector(object):
+    """
+    Collects metrics about the Elasticsearch client's connection pools, one
+    per node.
 
-    try:
+    The metrics are read from urllib3's connection pool internals, so nodes
+    whose pools don't have them (e.g. with an unsupported urllib3 version)
+    are skipped.
+    """
+
+    def __init__(self, es_client):
+        self.es_client = es_client
+
+    def collect(self):
+        maxsize = GaugeMetricFamily(
+            'es_client_pool_maxsize',
+            'Maximum number of connections kept open to the node.',
+            labels=['node'])
+        in_use = GaugeMetricFamily(
+            'es_client_pool_connections_in_use',
+            'Number of connections to the node currently in use by requests.',
+            labels=['node'])
+        idle = GaugeMetricFamily(
+            'es_client_pool_connections_idle',
+            'Number of open connections to the node available for requests.',
+            labels=['node'])
+        opened = CounterMetricFamily(
+            'es_client_pool_connections_opened',
+            'Number of connections opened to the node. Opened connections beyond the '
+            'pool size are closed after use, so this increasing quickly indicates the '
+            'pool is too small.',
+            labels=['node'])
+        requests = CounterMetricFamily(
+            'es_client_pool_requests',
+            'Number of requests made to the node.',
+            labels=['node'])
+
+        for connection in self.es_client.transport.connection_pool.connections:
+            # Only urllib3 based connections have a pool, and closed pools
+            # have no queue.
+            pool = getattr(connection, 'pool', None)
+            if getattr(pool, 'pool', None) is None:
+                continue
+
+            try:
+                # The pool's queue starts filled with placeholders, which are
+                # replaced with connections as they're returned after use.
+                # Slots missing from the queue are taken by connections in use.
+                queued = list(pool.pool.queue)
+                pool_maxsize = pool.pool.maxsize
+                num_connections = pool.num_connections
+                num_requests = pool.num_requests
+            except AttributeError:
+                log.debug('Connection pool of node %(node)s has no usage stats.',
+                          {'node': connection.host})
+                continue
+
+            node = connection.host
+            maxsize.add_metric([node], pool_maxsize)
+            in_use.add_metric([node], pool_maxsize - len(queued))
+            idle.add_metric([node], sum(1 for conn in queued if conn is not None))
+            opened.add_metric([node], num_connections)
+            requests.add_metric([node], num_requests)
+
+        yield from (maxsize, in_use, idle, opened, requests)
+
+
+def query_generation(query_name):
+    return METRICS_BY_QUERY_GENERATIONS.setdefault(query_name, Generation())
+
+
+def set_query_metrics(query_name, metric_dict):
+    """
+    Replaces a query's metric dict, incrementing its generation if its metrics
+    changed, so unchanged metrics can still be served with a 304 response.
+    """
+    changed = METRICS_BY_QUERY.get(query_name) != metric_dict
+    METRICS_BY_QUERY[query_name] = metric_dict
+    if changed:
+        query_generation(query_name).increment()
+        METRICS_BY_QUERY_GENERATION.increment()
+
+
+def run_search(es_client, query_name, indices, query, timeout,
+               composite_page_size=None, composite_max_pages=1):
+    """
+    Runs a search, returning a SearchResult containing the metric dict parsed
+    from the results, whether the search timed out, and stats about the search.
+
+    If the query contains top level composite aggregations, up to
+    composite_max_pages pages of their results are fetched by following
+    `after_key`. Each page is parsed and merged into the metric dict as it is
+    received, so only one page of results is held in memory at a time.
+    """
+    if composite_page_size is not None:
+        query = set_composite_page_size(query, composite_page_size)
+
+    metric_dict = {}
+    timed_out = False
+    took_ms = 0
+    response_size = 0
+    parse_duration = 0
+    after_keys = {}
+    for _ in range(composite_max_pages):
         response = es_client.search(index=indices, body=query, request_timeout=timeout)
+        response_size += last_response_size()
+        timed_out = timed_out or response['timed_out']
+        took_ms += response['took']
 
+        parse_start_time = time.monotonic()
         metrics = parse_response(response, [query_name])
-        metric_dict = group_metrics(metrics)
+        metric_dict = merge_metric_dicts(metric_dict, group_metrics(metrics))
+        parse_duration += time.monotonic() - parse_start_time
+
+        after_keys = composite_after_keys(query, response)
+        if not after_keys:
+            break
+
+        query = composite_next_page_query(query, after_keys)
+
+    else:
+        if after_keys:
+            log.warning('Query %(query_name)s has more than %(max_pages)s pages of composite '
+                        'aggregation results. Remaining pages were not fetched.',
+                        {'query_name': query_name, 'max_pages': composite_max_pages})
+
+    # Each page's took replaced the last in the merged metrics, so report the
+    # total time taken by all pages instead.
+    took_metric_name = format_metric_name(query_name, 'took', 'milliseconds')
+    if took_metric_name in metric_dict:
+        metric_doc, label_keys, _ = metric_dict[took_metric_name]
+        metric_dict[took_metric_name] = (metric_doc, label_keys, {(): took_ms})
+
+    return SearchResult(metric_dict, timed_out, took_ms / 1000, response_size, parse_duration)
+
+
+def run_query(es_client, query_name, indices, query,
+              timeout, on_error, on_missing,
+              composite_page_size=None, composite_max_pages=1,
+              incremental_field=None, incremental_delay=60,
+              incremental_reconcile_interval=3600, incremental_window_size=None,
+              worker_pool=None):
+
+    # Incremental queries only search the time window since the end of the
+    # window searched by their last run, adding the results to the values
+    # accumulated so far. A full run is required to start accumulating, and
+    # periodically to reconcile any drift (e.g. documents indexed late).
+    # Queries counting over a sliding window (of incremental_window_size
+    # milliseconds up to now) also search the time window that has left the
+    # sliding window since their last run, and subtract its results.
+    incremental_window = False
+    expired_query = None
+    if incremental_field is not None:
+        window_end = int((time.time() - incremental_delay) * 1000)
+        state = INCREMENTAL_STATE_BY_QUERY.get(query_name)
+
+        if state is not None and \
+           query_name in METRICS_BY_QUERY and \
+           time.monotonic() - state[1] < incremental_reconcile_interval:
+            watermark, reconciled_time = state
+            if incremental_window_size is not None:
+                expired_query = add_range_filter(query, incremental_field,
+                                                 gte=watermark - incremental_window_size,
+                                                 lt=window_end - incremental_window_size)
+            query = add_range_filter(query, incremental_field,
+                                     gte=watermark, lt=window_end)
+            incremental_window = True
 
-    except Exception:
+        else:
+            reconciled_time = time.monotonic()
+            window_start = None
+            if incremental_window_size is not None:
+                window_start = window_end - incremental_window_size
+            query = add_range_filter(query, incremental_field,
+                                     gte=window_start, lt=window_end)
+
+    def search(query):
+        search_kwargs = dict(composite_page_size=composite_page_size,
+                             composite_max_pages=composite_max_pages)
+        if worker_pool is not None:
+            return worker_pool.call(run_search, query_name, indices, query, timeout,
+                                    **search_kwargs)
+        return run_search(es_client, query_name, indices, query, timeout,
+                          **search_kwargs)
+
+    start_time = time.monotonic()
+    try:
+        result = search(query)
+        expired_result = None
+        if expired_query is not None and not result.timed_out:
+            expired_result = search(expired_query)
+            result = SearchResult(result.metric_dict,
+                                  result.timed_out or expired_result.timed_out,
+                                  result.took + expired_result.took,
+                                  result.response_size + expired_result.response_size,
+                                  result.parse_duration + expired_result.parse_duration)
+
+    except CircuitOpenError:
+        # The cluster is struggling, rather than anything being wrong with the
+        # query, so the last results (and any incremental state) are kept.
+        log.warning('Circuit breaker open, skipping query %(query_name)s.',
+                    {'query_name': query_name})
+        QUERY_SKIPS.labels(query_name).inc()
+
+    except Exception as e:
         log.exception('Error while querying indices %(indices)s, query %(query)s.',
                       {'indices': indices, 'query': query})
 
+        if isinstance(e, ConnectionTimeout):
+            QUERY_TIMEOUTS.labels(query_name).inc()
+        else:
+            QUERY_ERRORS.labels(query_name).inc()
+
+        # Incremental results can't be accumulated on top of dropped or zeroed
+        # metrics, so make the next run a full run.
+        INCREMENTAL_STATE_BY_QUERY.pop(query_name, None)
+
         # If this query has successfully run before, we need to handle any
         # metrics produced by that previous run.
         if query_name in METRICS_BY_QUERY:
@@ -231,12 +558,44 @@ def run_query(es_client, query_name, indices, query,
                 metric_dict = merge_metric_dicts(old_metric_dict, {},
                                                  zero_missing=True)
 
-            METRICS_BY_QUERY[query_name] = metric_dict
+            set_query_metrics(query_name, metric_dict)
 
     else:
+        metric_dict, timed_out = result.metric_dict, result.timed_out
+        QUERY_TOOK.labels(query_name).observe(result.took)
+        QUERY_RESPONSE_SIZE.labels(query_name).observe(result.response_size)
+        QUERY_PARSE_DURATION.labels(query_name).observe(result.parse_duration)
+
+        if timed_out:
+            QUERY_TIMEOUTS.labels(query_name).inc()
+
+        if incremental_field is not None and timed_out:
+            # Keep the accumulated values and watermark as they are, so the
+            # time window is searched again on the next run.
+            log.warning('Incremental query %(query_name)s timed out.',
+                        {'query_name': query_name})
+            return
+
+        if incremental_window:
+            # The results only cover documents in the new time window, so are
+            # added to the accumulated values. Metrics missing from the results
+            # just had no new documents, so on_missing doesn't apply.
+            took_metric_name = format_metric_name(query_name, 'took', 'milliseconds')
+            metric_dict = add_metric_dicts(METRICS_BY_QUERY[query_name], metric_dict,
+                                           replace_metric_names=(took_metric_name,))
+
+            if expired_result is not None:
+                metric_dict = subtract_metric_dicts(metric_dict, expired_result.metric_dict,
+                                                    keep_metric_names=(took_metric_name,))
+                # Report the time taken by both searches, as es_query_took_seconds does.
+                if took_metric_name in metric_dict:
+                    metric_doc, label_keys, _ = metric_dict[took_metric_name]
+                    metric_dict[took_metric_name] = (metric_doc, label_keys,
+                                                     {(): round(result.took * 1000)})
+
         # If this query has successfully run before, we need to handle any
         # missing metrics.
-        if query_name in METRICS_BY_QUERY:
+        elif query_name in METRICS_BY_QUERY:
             old_metric_dict = METRICS_BY_QUERY[query_name]
 
             if on_missing == 'preserve':
@@ -250,7 +609,156 @@ def run_query(es_client, query_name, indices, query,
                 metric_dict = merge_metric_dicts(old_metric_dict, metric_dict,
                                                  zero_missing=True)
 
-        METRICS_BY_QUERY[query_name] = metric_dict
+        set_query_metrics(query_name, metric_dict)
+        QUERY_SERIES.labels(query_name).observe(count_series(metric_dict))
+        QUERY_LAST_SUCCESS.labels(query_name).set_to_current_time()
+
+        if incremental_field is not None:
+            INCREMENTAL_STATE_BY_QUERY[query_name] = (window_end, reconciled_time)
+
+    finally:
+        QUERY_DURATION.labels(query_name).observe(time.monotonic() - start_time)
+        QUERY_STATS_GENERATION.increment()
+
+
+class ConfigError(Exception):
+    pass
+
+
+def parse_pools(config, default_threads):
+    """
+    Parses the worker pools defined in a query config.
+
+    Returns an OrderedDict of pool name -> number of threads. The default
+    pool is always included, with default_threads threads unless overridden
+    by a pool_default section.
+    """
+    pool_sizes = OrderedDict([('default', default_threads)])
+
+    # Pools are defined in sections beginning with 'pool_'.
+    # Each pool has its own worker threads and job queue, so slow queries
+    # in one pool can't delay queries in another.
+    pool_prefix = 'pool_'
+    for section in config.sections():
+        if section.startswith(pool_prefix):
+            pool_name = section[len(pool_prefix):]
+            pool_threads = config.getint(section, 'PoolThreads', fallback=1)
+            if pool_threads < 1:
+                raise ConfigError('Pool {} has {} threads, but needs at least 1.'.format(
+                    pool_name, pool_threads))
+            pool_sizes[pool_name] = pool_threads
+
+    return pool_sizes
+
+
+def parse_queries(config, pool_sizes):
+    """
+    Parses the queries defined in a query config.
+
+    Returns an OrderedDict of query name -> tuple containing:
+    * interval,
+    * pool name,
+    * timeout,
+    * indices,
+    * query,
+    * on error,
+    * on missing,
+    * dict of further run_query() options.
+
+    Raises ConfigError if a query is invalid, e.g. uses a pool not in
+    pool_sizes.
+    """
+    queries = OrderedDict()
+
+    query_prefix = 'query_'
+    for section in config.sections():
+        if section.startswith(query_prefix):
+            query_name = section[len(query_prefix):]
+            interval = config.getfloat(section, 'QueryIntervalSecs',
+                                       fallback=15)
+            timeout = config.getfloat(section, 'QueryTimeoutSecs',
+                                      fallback=10)
+            indices = config.get(section, 'QueryIndices',
+                                 fallback='_all')
+            query = json.loads(config.get(section, 'QueryJson'))
+            on_error = config.getenum(section, 'QueryOnError',
+                                      fallback='drop')
+            on_missing = config.getenum(section, 'QueryOnMissing',
+                                        fallback='drop')
+            pool = config.get(section, 'QueryPool', fallback='default')
+
+            if pool not in pool_sizes:
+                raise ConfigError('Query {} uses unknown pool {}. Pools are defined in '
+                                  'pool_<name> sections.'.format(query_name, pool))
+
+            incremental_field = config.get(section, 'QueryIncrementalField', fallback=None)
+            incremental_window_size = None
+            if incremental_field is not None:
+                # A sliding window on the incremental field is searched with
+                # fixed bounds by each run instead (see run_query()).
+                query, incremental_window_size = remove_sliding_window(query, incremental_field)
+
+                # Results are accumulated across runs, which only matches a full
+                # run if the query's other time ranges don't move.
+                relative_fields = relative_range_fields(query)
+                if relative_fields:
+                    raise ConfigError(
+                        'Query {} is incremental, but has time ranges relative to now on '
+                        'fields {}. Incremental queries must have fixed time ranges, apart '
+                        'from a sliding window on the incremental field (e.g. '
+                        '"gte": "now-1d").'.format(query_name, ', '.join(sorted(relative_fields))))
+
+            query_options = {
+                'composite_page_size': config.getint(section, 'QueryCompositePageSize',
+                                                     fallback=None),
+                'composite_max_pages': config.getint(section, 'QueryCompositeMaxPages',
+                                                     fallback=1),
+                'incremental_field': incremental_field,
+                'incremental_delay': config.getfloat(section, 'QueryIncrementalDelaySecs',
+                                                     fallback=60),
+                'incremental_reconcile_interval': config.getfloat(
+                    section, 'QueryIncrementalReconcileSecs', fallback=3600),
+                'incremental_window_size': incremental_window_size,
+            }
+
+            queries[query_name] = (interval, pool, timeout, indices, query,
+                                   on_error, on_missing, query_options)
+
+    return queries
+
+
+def create_pool_executors(pool_sizes):
+    """
+    Creates an executor for each worker pool, returning a dict of pool name ->
+    executor.
+
+    If there are no other pools, and the default pool has a single thread,
+    it has no executor, so its queries are run directly in the scheduler
+    thread. Otherwise a slow query in the default pool would hold up the
+    queries of the other pools.
+    """
+    executors = {}
+    for pool_name, pool_threads in pool_sizes.items():
+        if pool_name == 'default' and pool_threads == 1 and len(pool_sizes) == 1:
+            executors[pool_name] = None
+        else:
+            executors[pool_name] = concurrent.futures.ThreadPoolExecutor(
+                max_workers=pool_threads)
+    return executors
+
+
+def schedule_queries(scheduler, executors, queries, es_client, worker_pool=None,
+                     run_func=run_query):
+    """
+    Schedules each query to be run by run_func on its interval, in its pool's
+    executor.
+    """
+    for query_name, (interval, pool, timeout, indices, query,
+                     on_error, on_missing, query_options) in queries.items():
+        schedule_job(scheduler, executors[pool], interval,
+                     run_func, es_client, query_name, indices, query,
+                     timeout, on_error, on_missing, worker_pool=worker_pool,
+                     **query_options)
 
 
 # Based on click.Choice
@@ -329,6 +837,12 @@ class MultiChoice(click.ParamType):
         return 'MultiChoice(%r)' % list(self.choices)
 
 
+# Collectors that can be disabled, by their option name prefix.
+COLLECTOR_NAMES = ('cluster_health', 'nodes_stats', 'indices_aliases',
+                   'indices_mappings', 'indices_stats')
+# The Elasticsearch client's default connection pool size, per node.
+ES_POOL_DEFAULT_MAXSIZE = 10
+
 # https://www.elastic.co/guide/en/elasticsearch/reference/current/cluster-nodes-stats.html#_nodes_statistics
 NODES_STATS_METRICS_OPTIONS = [
     'indices', 'fs', 'http', 'jvm', 'os',
@@ -384,6 +898,23 @@ def http_headers_parser(ctx, param, headers):
     return dict(split_http_header(header_string) for header_string in headers)
 
 
+def remote_write_url_parser(ctx, param, url):
+    """Check python-snappy is installed if remote write is enabled"""
+    if url is not None and not SNAPPY_INSTALLED:
+        raise click.BadParameter('python-snappy must be installed to push metrics, '
+                                 'e.g. with pip3 install prometheus-es-exporter[snappy].')
+    return url
+
+
+def json_decoder_parser(ctx, param, name):
+    """Check the named JSON decoder is installed"""
+    try:
+        json_decoder(name)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    return name
+
+
 def configparser_enum_conv(enum):
     lower_enums = tuple(e.lower() for e in enum)
 
@@ -436,6 +967,62 @@ CONFIGPARSER_CONVERTERS = {
                    'Header name and value should be separated by colon, e.g. '
                    '"Authorization: Bearer xxxxx". Several headers can be added '
                    'by repeating the -H parameter.')
+@click.option('--es-http-compress', default=False, is_flag=True,
+              help='Request gzip compressed responses from Elasticsearch. Reduces network '
+                   'transfer for large responses, at the cost of some CPU to decompress them.')
+@click.option('--es-json-decoder', default='auto', type=click.Choice(JSON_DECODER_NAMES),
+              callback=json_decoder_parser,
+              help='JSON decoder to decode Elasticsearch responses with. '
+                   'orjson and simdjson are much faster than the standard library decoder for '
+                   'large responses, but must be installed separately. '
+                   '"auto" uses the fastest decoder installed. (default: auto)')
+@click.option('--es-circuit-breaker-enable', default=False, is_flag=True,
+              help='Stop making requests to the cluster while too many of them fail (with a '
+                   'connection error, timeout, server error or 429 response), to avoid adding to '
+                   'the load of a struggling cluster. Collectors serve their last metrics, and '
+                   'queries keep their last results, until the cluster recovers.')
+@click.option('--es-circuit-breaker-failure-rate', default=0.5, type=click.FloatRange(min=0, max=1),
+              help='Fraction of requests that must fail for the circuit breaker to open. '
+                   '(default: 0.5)')
+@click.option('--es-circuit-breaker-min-requests', default=10, type=click.IntRange(min=1),
+              help='Minimum number of requests in the window for the circuit breaker to open. '
+                   '(default: 10)')
+@click.option('--es-circuit-breaker-window', default=60.0, type=click.FloatRange(min=0),
+              help='Period of recent requests the failure rate is calculated over, in seconds. '
+                   '(default: 60)')
+@click.option('--es-circuit-breaker-open-duration', default=30.0, type=click.FloatRange(min=0),
+              help='Time the circuit breaker stays open before letting a probe request through, '
+                   'in seconds. (default: 30)')
+@click.option('--es-max-request-rate', type=click.FloatRange(min=0),
+              help='Maximum average rate of requests to the cluster, in requests per second, '
+                   'across all collectors and queries. Cluster health requests are made before '
+                   'other waiting requests. If not specified, the rate is not limited.')
+@click.option('--es-request-burst', type=click.IntRange(min=1),
+              help='Maximum number of requests that can be made at once at above the '
+                   '"--es-max-request-rate" rate, after a quiet period. '
+                   'If not specified, one second\'s worth of requests.')
+@click.option('--es-max-requests-in-flight', type=click.IntRange(min=1),
+              help='Maximum number of requests to the cluster in flight at once, '
+                   'across all collectors and queries. Cluster health requests are made before '
+                   'other waiting requests. If not specified, the number is not limited.')
+@click.option('--es-hedge-percentile', type=click.FloatRange(min=0, max=100),
+              help='Hedge read-only requests (searches, stats, health etc.) that take longer than '
+                   'this percentile of recent latencies of the same endpoint, by sending a duplicate '
+                   'request to another node and using whichever responds first. Only applies if '
+                   'several nodes are given in "--es-cluster". If not specified, requests are not '
+                   'hedged.')
+@click.option('--es-hedge-max-extra', default=0.05, type=click.FloatRange(min=0, max=1),
+              help='Maximum number of hedged requests, as a fraction of all requests. '
+                   '(default: 0.05)')
+@click.option('--es-pool-maxsize', type=click.IntRange(min=1),
+              help='Maximum number of connections to keep open to each node. '
+                   'If not specified, the pool is sized to fit a request from every query '
+                   'thread and collector at once (but no less than {}).'.format(
+                       ES_POOL_DEFAULT_MAXSIZE))
+@click.option('--record-dir', type=click.Path(file_okay=False),
+              help='Save the responses to requests made to the cluster in this directory, '
+                   'so they can be replayed with prometheus-es-replay. Only the latest response '
+                   'to each distinct request is kept. If not specified, responses are not saved.')
 @click.option('--port', '-p', default=9206,
               help='Port to serve the metrics endpoint on. (default: 9206)')
 @click.option('--query-disable', default=False, is_flag=True,
@@ -455,14 +1042,29 @@ CONFIGPARSER_CONVERTERS = {
                    '(default: ./config)')
 @click.option('--threads', type=click.IntRange(min=1), default=1,
               help='Enables concurrent query execution using the number of threads specified. '
+                   'Sets the size of the default query pool. Other pools can be defined in '
+                   'the query config file(s). '
                    '(default: 1)')
+@click.option('--processes', type=click.IntRange(min=0), default=0,
+              help='Number of worker processes to fetch and parse collector and query '
+                   'responses in, so parsing can use more than one CPU core. '
+                   'If 0, responses are fetched and parsed in the main process. '
+                   '(default: 0)')
+@click.option('--parse-processes', type=click.IntRange(min=0), default=0,
+              help='Number of worker processes to decode and parse collector responses in, '
+                   'so parsing large responses doesn\'t hold up other threads. Responses are '
+                   'still fetched in the main process. Has no effect if "--processes" is used. '
+                   'If 0, responses are decoded and parsed in the main process. '
+                   '(default: 0)')
 @click.option('--cluster-health-disable', default=False, is_flag=True,
               help='Disable cluster health monitoring.')
 @click.option('--cluster-health-timeout', default=10.0,
               help='Request timeout for cluster health monitoring, in seconds. (default: 10)')
 @click.option('--cluster-health-level', default='indices',
-              type=click.Choice(['cluster', 'indices', 'shards']),
-              help='Level of detail for cluster health monitoring.  (default: indices)')
+              type=click.Choice(['cluster', 'indices', 'shards', 'shards-summary']),
+              help='Level of detail for cluster health monitoring. "shards-summary" exports the '
+                   'number of shards of each index with each status, rather than metrics for '
+                   'every shard. (default: indices)')
 @click.option('--nodes-stats-disable', default=False, is_flag=True,
               help='Disable nodes stats monitoring.')
 @click.option('--nodes-stats-timeout', default=10.0,
@@ -486,6 +1088,11 @@ CONFIGPARSER_CONVERTERS = {
 @click.option('--indices-stats-mode', default='cluster',
               type=click.Choice(['cluster', 'indices']),
               help='Detail mode for indices stats monitoring. (default: cluster)')
+@click.option('--indices-stats-backend', default='stats',
+              type=click.Choice(['stats', 'cat']),
+              help='API to fetch indices stats from. '
+                   '"cat" uses _cat/indices, which is much cheaper for clusters with many indices, '
+                   'but only provides a subset of the metrics. (default: stats)')
 @click.option('--indices-stats-indices',
               callback=indices_stats_indices_parser,
               help='Limit indices stats to specific indices. '
@@ -500,6 +1107,53 @@ CONFIGPARSER_CONVERTERS = {
               help='Include fielddata info for specific fields. '
                    'Fields should be separated by commas e.g. field1,field2. '
                    'Use \'*\' for all.')
+@click.option('--probe-enable', default=False, is_flag=True,
+              help='Enable the /probe endpoint, which collects cluster health, nodes stats and '
+                   'indices stats metrics from the cluster given by the "target" URL parameter, '
+                   'e.g. /probe?target=https://es1:9200. Targets use the same SSL options as '
+                   'the main cluster, and must be allowed with --probe-target.')
+@click.option('--probe-target',
+              multiple=True,
+              help='Target the /probe endpoint is allowed to collect metrics from, in the same '
+                   'format as --es-cluster. Probes of other targets are rejected. Several '
+                   'targets can be allowed by repeating the parameter. At least one is required '
+                   'with --probe-enable.')
+@click.option('--probe-forward-auth', default=False, is_flag=True,
+              help='Send the main cluster\'s basic auth credentials, -H headers and client '
+                   'certificate to probe targets too. Only enable this if all the allowed '
+                   'targets should have those credentials.')
+@click.option('--probe-max-clients', type=click.IntRange(min=1), default=100,
+              help='Maximum number of probe target clients to keep open. '
+                   'The least recently probed targets\' clients are closed first. (default: 100)')
+@click.option('--probe-concurrency', type=click.IntRange(min=1), default=10,
+              help='Maximum number of probes to run concurrently, across all targets. '
+                   '(default: 10)')
+@click.option('--remote-write-url',
+              callback=remote_write_url_parser,
+              help='URL of a Prometheus remote write endpoint to push metrics to, e.g. '
+                   'https://prometheus:9090/api/v1/write. Requires the python-snappy package. '
+                   'If not specified, metrics are not pushed.')
+@click.option('--remote-write-header',
+              multiple=True,
+              callback=http_headers_parser,
+              help='HTTP header to include in remote write requests, e.g. '
+                   '"Authorization: Bearer xxxxx". Several headers can be added '
+                   'by repeating the parameter.')
+@click.option('--remote-write-interval', default=60.0,
+              help='Interval between pushes of the metrics, in seconds. (default: 60)')
+@click.option('--remote-write-batch-size', type=click.IntRange(min=1), default=5000,
+              help='Maximum number of samples per remote write request. (default: 5000)')
+@click.option('--remote-write-queue-size', type=click.IntRange(min=1), default=100,
+              help='Maximum number of requests to queue for sending. '
+                   'The oldest requests are dropped if the queue is full. (default: 100)')
+@click.option('--remote-write-timeout', default=30.0,
+              help='Request timeout for remote write requests, in seconds. (default: 30)')
+@click.option('--remote-write-max-retries', type=click.IntRange(min=0), default=5,
+              help='Maximum number of times to retry failed remote write requests. (default: 5)')
+@click.option('--debug-endpoints-enable', default=False, is_flag=True,
+              help='Enable the /debug endpoints, for profiling the exporter\'s memory allocations '
+                   'and CPU usage while it runs. Anyone who can reach the metrics port can use '
+                   'them, and profiling slows the exporter down, so only enable them when needed.')
 @click.option('--json-logging', '-j', default=False, is_flag=True,
               help='Turn on json logging.')
 @click.option('--log-level', default='INFO',
@@ -532,15 +1186,28 @@ def cli(**options):
         raise click.BadOptionUsage('client_key',
                                    '--client-cert must be provided when --client-key is used.')
 
+    if options['probe_enable'] and not options['probe_target']:
+        raise click.BadOptionUsage('probe_target',
+                                   '--probe-target must be provided when --probe-enable is used.')
+
     if options['indices_stats_indices'] and options['indices_stats_mode'] != 'indices':
         raise click.BadOptionUsage('indices_stats_indices',
                                    '--indices-stats-mode must be "indices" for '
                                    '--indices-stats-indices to be used.')
 
-    executor = None
-    num_threads = options['threads']
-    if num_threads > 1:
-        executor = concurrent.futures.ThreadPoolExecutor(max_workers=num_threads)
+    if options['es_max_request_rate'] == 0:
+        raise click.BadOptionUsage('es_max_request_rate',
+                                   '--es-max-request-rate must be greater than 0.')
+
+    if options['es_request_burst'] and not options['es_max_request_rate']:
+        raise click.BadOptionUsage('es_request_burst',
+                                   '--es-max-request-rate must be provided when '
+                                   '--es-request-burst is used.')
+
+    if options['indices_stats_fields'] and options['indices_stats_backend'] == 'cat':
+        raise click.BadOptionUsage('indices_stats_fields',
+                                   '--indices-stats-backend must be "stats" for '
+                                   '--indices-stats-fields to be used.')
 
     log_handler = logging.StreamHandler()
     log_format = '[%(asctime)s] %(name)s.%(levelname)s %(threadName)s %(message)s'
@@ -562,21 +1229,39 @@ def cli(**options):
     port = options['port']
     es_cluster = options['es_cluster'].split(',')
 
+    if options['record_dir']:
+        os.makedirs(options['record_dir'], exist_ok=True)
+
     if options['ca_certs']:
-        es_client = Elasticsearch(es_cluster,
-                                  verify_certs=True,
-                                  ca_certs=options['ca_certs'],
-                                  client_cert=options['client_cert'],
-                                  client_key=options['client_key'],
-                                  headers=options['header'],
-                                  http_auth=http_auth)
+        es_client_kwargs = dict(connection_class=ExporterConnection,
+                                http_compress=options['es_http_compress'],
+                                verify_certs=True,
+                                ca_certs=options['ca_certs'],
+                                client_cert=options['client_cert'],
+                                client_key=options['client_key'],
+                                headers=options['header'],
+                                http_auth=http_auth,
+                                serializer=ExporterSerializer(options['es_json_decoder']),
+                                record_dir=options['record_dir'],
+                                transport_class=ExporterTransport,
+                                hedge_percentile=options['es_hedge_percentile'],
+                                hedge_max_extra=options['es_hedge_max_extra'])
     else:
-        es_client = Elasticsearch(es_cluster,
-                                  verify_certs=False,
-                                  headers=options['header'],
-                                  http_auth=http_auth)
-
-    scheduler = None
+        es_client_kwargs = dict(connection_class=ExporterConnection,
+                                http_compress=options['es_http_compress'],
+                                verify_certs=False,
+                                headers=options['header'],
+                                http_auth=http_auth,
+                                serializer=ExporterSerializer(options['es_json_decoder']),
+                                record_dir=options['record_dir'],
+                                transport_class=ExporterTransport,
+                                hedge_percentile=options['es_hedge_percentile'],
+                                hedge_max_extra=options['es_hedge_max_extra'])
+
+    executors = {}
+    # Pool name -> number of threads.
+    pool_sizes = {}
+    queries = {}
 
     if not options['query_disable']:
         config = configparser.ConfigParser(converters=CONFIGPARSER_CONVERTERS)
@@ -586,70 +1271,215 @@ def cli(**options):
         config_dir_sorted_files = sorted(glob.glob(config_dir_file_pattern))
         config.read(config_dir_sorted_files)
 
-        query_prefix = 'query_'
-        queries = {}
-        for section in config.sections():
-            if section.startswith(query_prefix):
-                query_name = section[len(query_prefix):]
-                interval = config.getfloat(section, 'QueryIntervalSecs',
-                                           fallback=15)
-                timeout = config.getfloat(section, 'QueryTimeoutSecs',
-                                          fallback=10)
-                indices = config.get(section, 'QueryIndices',
-                                     fallback='_all')
-                query = json.loads(config.get(section, 'QueryJson'))
-                on_error = config.getenum(section, 'QueryOnError',
-                                          fallback='drop')
-                on_missing = config.getenum(section, 'QueryOnMissing',
-                                            fallback='drop')
-
-                queries[query_name] = (interval, timeout, indices, query,
-                                       on_error, on_missing)
+        try:
+            pool_sizes = parse_pools(config, options['threads'])
+            queries = parse_queries(config, pool_sizes)
+        except ConfigError as e:
+            raise click.ClickException('Invalid query config: {}'.format(e))
 
-        scheduler = sched.scheduler()
+        executors = create_pool_executors(pool_sizes)
 
-        if queries:
-            for query_name, (interval, timeout, indices, query,
-                             on_error, on_missing) in queries.items():
-                schedule_job(scheduler, executor, interval,
-                             run_query, es_client, query_name, indices, query,
-                             timeout, on_error, on_missing)
-        else:
+        if not queries:
             log.error('No queries found in config file(s)')
             return
 
+    # Each query thread and collector can have a request in progress at once,
+    # so the connection pool for each node is sized to fit them all. Otherwise
+    # connections beyond the pool size are closed after each request, and
+    # have to be reopened (with a new TLS handshake) for the next.
+    es_pool_maxsize = options['es_pool_maxsize']
+    if es_pool_maxsize is None:
+        num_collectors = sum(not options[collector + '_disable'] for collector in COLLECTOR_NAMES)
+        es_pool_maxsize = max(ES_POOL_DEFAULT_MAXSIZE,
+                              sum(pool_sizes.values()) + num_collectors)
+    es_client_kwargs['maxsize'] = es_pool_maxsize
+
+    circuit_breaker = None
+    if options['es_circuit_breaker_enable']:
+        circuit_breaker = CircuitBreaker(
+            failure_rate=options['es_circuit_breaker_failure_rate'],
+            min_requests=options['es_circuit_breaker_min_requests'],
+            window=options['es_circuit_breaker_window'],
+            open_duration=options['es_circuit_breaker_open_duration'])
+
+    request_budget = None
+    if options['es_max_request_rate'] is not None or options['es_max_requests_in_flight']:
+        request_budget = RequestBudget(rate=options['es_max_request_rate'],
+                                       burst=options['es_request_burst'],
+                                       max_in_flight=options['es_max_requests_in_flight'])
+
+    es_client = Elasticsearch(es_cluster, circuit_breaker=circuit_breaker,
+                              request_budget=request_budget, **es_client_kwargs)
+
+    worker_pool = None
+    if options['processes']:
+        worker_pool = WorkerPool(options['processes'], es_cluster, es_client_kwargs,
+                                 circuit_breaker=circuit_breaker,
+                                 request_budget=request_budget)
+
+    parse_pool = None
+    if options['parse_processes'] and not worker_pool:
+        parse_pool = ParsePool(options['parse_processes'], options['es_json_decoder'])
+
+    scheduler = None
+    if queries:
+        scheduler = sched.scheduler()
+
+        schedule_queries(scheduler, executors, queries, es_client, worker_pool=worker_pool)
+
+    # All collectors are served on /metrics, and each group of collectors is
+    # also served on its own /metrics/<name> path, so they can be scraped
+    # separately (e.g. expensive collectors less often). Groups can also be
+    # selected with collect[]=<name> parameters on /metrics.
+    registry = ExporterRegistry()
+    collector_registries = OrderedDict()
+
+    def register(name, *collectors):
+        collector_registry = collector_registries.setdefault(name, ExporterRegistry())
+        for collector in collectors:
+            registry.register(collector)
+            collector_registry.register(collector)
+
+    register('process', PROCESS_COLLECTOR, PLATFORM_COLLECTOR, GC_COLLECTOR)
+
+    # Worker processes make their requests with their own clients, so the
+    # client metrics they update aren't available in the main process.
+    if worker_pool is None:
+        register('connection_pool', ConnectionPoolCollector(es_client), *CONNECTION_METRICS)
+
+    if circuit_breaker is not None:
+        register('circuit_breaker', *CIRCUIT_BREAKER_METRICS)
+
+    if request_budget is not None:
+        register('request_budget', *REQUEST_BUDGET_METRICS)
+
+    if options['es_hedge_percentile'] is not None and worker_pool is None:
+        register('hedging', *HEDGING_METRICS)
+
+    # While the circuit breaker is open, collectors serve their last metrics.
+    serve_stale = circuit_breaker is not None
+
     if not options['cluster_health_disable']:
-        REGISTRY.register(ClusterHealthCollector(es_client,
-                                                 options['cluster_health_timeout'],
-                                                 options['cluster_health_level']))
+        register('cluster_health',
+                 ClusterHealthCollector(es_client,
+                                        options['cluster_health_timeout'],
+                                        options['cluster_health_level'],
+                                        worker_pool=worker_pool,
+                                        parse_pool=parse_pool,
+                                        serve_stale=serve_stale))
 
     if not options['nodes_stats_disable']:
-        REGISTRY.register(NodesStatsCollector(es_client,
-                                              options['nodes_stats_timeout'],
-                                              metrics=options['nodes_stats_metrics']))
+        register('nodes_stats',
+                 NodesStatsCollector(es_client,
+                                     options['nodes_stats_timeout'],
+                                     metrics=options['nodes_stats_metrics'],
+                                     worker_pool=worker_pool,
+                                     parse_pool=parse_pool,
+                                     serve_stale=serve_stale))
 
     if not options['indices_aliases_disable']:
-        REGISTRY.register(IndicesAliasesCollector(es_client,
-                                                  options['indices_aliases_timeout']))
+        register('indices_aliases',
+                 IndicesAliasesCollector(es_client,
+                                         options['indices_aliases_timeout'],
+                                         worker_pool=worker_pool,
+                                         parse_pool=parse_pool,
+                                         serve_stale=serve_stale))
 
     if not options['indices_mappings_disable']:
-        REGISTRY.register(IndicesMappingsCollector(es_client,
-                                                   options['indices_mappings_timeout']))
+        register('indices_mappings',
+                 IndicesMappingsCollector(es_client,
+                                          options['indices_mappings_timeout'],
+                                          worker_pool=worker_pool,
+                                          parse_pool=parse_pool,
+                                          serve_stale=serve_stale))
+
+    def indices_stats_collector(client, **kwargs):
+        parse_indices = options['indices_stats_mode'] == 'indices'
+        if options['indices_stats_backend'] == 'cat':
+            return IndicesCatCollector(client,
+                                       options['indices_stats_timeout'],
+                                       parse_indices=parse_indices,
+                                       indices=options['indices_stats_indices'],
+                                       metrics=options['indices_stats_metrics'],
+                                       **kwargs)
+
+        return IndicesStatsCollector(client,
+                                     options['indices_stats_timeout'],
+                                     parse_indices=parse_indices,
+                                     indices=options['indices_stats_indices'],
+                                     metrics=options['indices_stats_metrics'],
+                                     fields=options['indices_stats_fields'],
+                                     **kwargs)
 
     if not options['indices_stats_disable']:
-        parse_indices = options['indices_stats_mode'] == 'indices'
-        REGISTRY.register(IndicesStatsCollector(es_client,
-                                                options['indices_stats_timeout'],
-                                                parse_indices=parse_indices,
-                                                indices=options['indices_stats_indices'],
-                                                metrics=options['indices_stats_metrics'],
-                                                fields=options['indices_stats_fields']))
+        register('indices_stats',
+                 indices_stats_collector(es_client,
+                                         worker_pool=worker_pool,
+                                         parse_pool=parse_pool,
+                                         serve_stale=serve_stale))
 
     if scheduler:
-        REGISTRY.register(QueryMetricCollector())
+        # The query execution stats change with every run, so are served
+        # separately, and don't stop the query metrics getting 304 responses.
+        register('queries', QueryMetricCollector())
+        register('query_stats', QueryStatsCollector())
+
+        # Individual queries can be selected too, but aren't served separately
+        # on /metrics, as they're already covered by the queries collector.
+        for query_name in queries:
+            query_registry = ExporterRegistry()
+            query_registry.register(QueryMetricCollector(query_name))
+            collector_registries['query_' + query_name] = query_registry
+
+    if options['remote_write_url']:
+        register('remote_write', *REMOTE_WRITE_METRICS)
+
+        remote_writer = RemoteWriter(options['remote_write_url'], registry,
+                                     interval=options['remote_write_interval'],
+                                     batch_size=options['remote_write_batch_size'],
+                                     queue_size=options['remote_write_queue_size'],
+                                     timeout=options['remote_write_timeout'],
+                                     max_retries=options['remote_write_max_retries'],
+                                     headers=options['remote_write_header'])
+        remote_writer.start()
+        log.info('Pushing metrics to %(url)s', {'url': options['remote_write_url']})
+
+    prober = None
+    if options['probe_enable']:
+        # Responses from probe targets aren't recorded, as they'd be mixed up
+        # with the main cluster's.
+        probe_client_kwargs = dict(es_client_kwargs, record_dir=None)
+        # The main cluster's credentials aren't sent to targets unless asked.
+        if not options['probe_forward_auth']:
+            probe_client_kwargs.update(http_auth=None, headers=None)
+            if 'client_cert' in probe_client_kwargs:
+                probe_client_kwargs.update(client_cert=None, client_key=None)
+
+        def probe_client(target):
+            return Elasticsearch(target.split(','), **probe_client_kwargs)
+
+        # Probes use the same collector options as the main cluster, but
+        # ignore the options disabling collectors.
+        def probe_collectors(probe_es_client):
+            return [
+                ClusterHealthCollector(probe_es_client,
+                                       options['cluster_health_timeout'],
+                                       options['cluster_health_level'],
+                                       parse_pool=parse_pool),
+                NodesStatsCollector(probe_es_client,
+                                    options['nodes_stats_timeout'],
+                                    metrics=options['nodes_stats_metrics'],
+                                    parse_pool=parse_pool),
+                indices_stats_collector(probe_es_client, parse_pool=parse_pool),
+            ]
+
+        prober = Prober(probe_client, probe_collectors, options['probe_target'],
+                        max_clients=options['probe_max_clients'],
+                        concurrency=options['probe_concurrency'])
 
     log.info('Starting server...')
-    start_http_server(port)
+    start_http_server(port, registry=registry, collector_registries=collector_registries,
+                      prober=prober, debug=options['debug_endpoints_enable'])
     log.info('Server started on port %(port)s', {'port': port})
 
     if scheduler:
@@ -0,0 +1,175 @@
+import logging
+import threading
+import time
+
+from collections import deque
+from elasticsearch.exceptions import ConnectionError, TransportError
+from prometheus_client import Counter, Gauge
+
+log = logging.getLogger(__name__)
+
+CLOSED = 0
+OPEN = 1
+HALF_OPEN = 2
+
+STATE_NAMES = {
+    CLOSED: 'closed',
+    OPEN: 'open',
+    HALF_OPEN: 'half open',
+}
+
+# These metrics aren't registered on creation, so they are only exported if
+# the circuit breaker is enabled.
+CIRCUIT_BREAKER_STATE = Gauge(
+    'es_client_circuit_breaker_state',
+    'State of the circuit breaker: 0 = closed, 1 = open, 2 = half open.',
+    registry=None)
+CIRCUIT_BREAKER_OPENED = Counter(
+    'es_client_circuit_breaker_opened',
+    'Number of times the circuit breaker has opened.',
+    registry=None)
+CIRCUIT_BREAKER_REJECTED = Counter(
+    'es_client_circuit_breaker_rejected_requests',
+    'Number of requests rejected without being sent, due to the circuit breaker.',
+    registry=None)
+
+CIRCUIT_BREAKER_METRICS = (
+    CIRCUIT_BREAKER_STATE,
+    CIRCUIT_BREAKER_OPENED,
+    CIRCUIT_BREAKER_REJECTED,
+)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of making a request while the circuit breaker is open.
+    """
+    pass
+
+
+def is_failure(error):
+    """
+    Returns whether an error indicates the cluster is struggling, i.e. is a
+    connection error (including timeouts), a server error, or a 429 response.
+
+    Returns None for errors that don't come from a request.
+    """
+    if isinstance(error, ConnectionError):
+        return True
+    elif isinstance(error, TransportError):
+        status_code = error.status_code
+        return isinstance(status_code, int) and (status_code >= 500 or status_code == 429)
+    else:
+        return None
+
+
+class CircuitBreaker(object):
+    """
+    Stops requests to a struggling cluster, so the exporter doesn't add to its
+    load.
+
+    The outcomes of requests over the last window seconds are tracked. Once at
+    least min_requests have been made in the window, and at least
+    failure_rate of them failed, the breaker opens. While it's open, requests
+    are rejected with a CircuitOpenError without being sent.
+
+    After open_duration seconds, the breaker is half open, and lets a single
+    request through at a time to probe the cluster. If a probe succeeds the
+    breaker closes, and if it fails the breaker opens again.
+    """
+
+    def __init__(self, failure_rate=0.5, min_requests=10, window=60, open_duration=30):
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.window = window
+        self.open_duration = open_duration
+
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        # (time, failed) tuples of requests in the window, oldest first.
+        self.outcomes = deque()
+        self.opened_time = None
+        self.probing = False
+
+        CIRCUIT_BREAKER_STATE.set(CLOSED)
+
+    def set_state(self, state):
+        log.log(logging.INFO if state == CLOSED else logging.WARNING,
+                'Circuit breaker %(state)s.', {'state': STATE_NAMES[state]})
+        self.state = state
+        CIRCUIT_BREAKER_STATE.set(state)
+
+    def open(self):
+        self.set_state(OPEN)
+        self.opened_time = time.monotonic()
+        self.outcomes.clear()
+        CIRCUIT_BREAKER_OPENED.inc()
+
+    def before_request(self):
+        """
+        Checks whether a request can be made, raising a CircuitOpenError if not.
+
+        Returns whether the request is a half open probe.
+        """
+        with self.lock:
+            if self.state == OPEN and time.monotonic() - self.opened_time >= self.open_duration:
+                self.set_state(HALF_OPEN)
+
+            if self.state == CLOSED:
+                return False
+
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+
+        CIRCUIT_BREAKER_REJECTED.inc()
+        raise CircuitOpenError('Circuit breaker is {}.'.format(STATE_NAMES[self.state]))
+
+    def after_request(self, probe, failed):
+        """
+        Records the outcome of a request.
+
+        failed is None if the request's outcome says nothing about the
+        cluster's health.
+        """
+        with self.lock:
+            if probe:
+                self.probing = False
+
+            if failed is None:
+                return
+
+            if self.state == HALF_OPEN:
+                # Only the probe's outcome counts. Other requests were started
+                # before the breaker opened.
+                if probe:
+                    if failed:
+                        self.open()
+                    else:
+                        self.set_state(CLOSED)
+
+            elif self.state == CLOSED:
+                now = time.monotonic()
+                self.outcomes.append((now, failed))
+                while self.outcomes[0][0] < now - self.window:
+                    self.outcomes.popleft()
+
+                failures = sum(1 for _, outcome_failed in self.outcomes if outcome_failed)
+                if len(self.outcomes) >= self.min_requests and \
+                   failures >= self.failure_rate * len(self.outcomes):
+                    self.open()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls func, which makes requests to the cluster, if the breaker allows
+        it, and records the outcome.
+        """
+        probe = self.before_request()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.after_request(probe, is_failure(e))
+            raise
+
+        self.after_request(probe, False)
+        return result
@@ -8,8 +8,31 @@ singular_forms = {
     'shards': 'shard'
 }
 
+STATUS_COLOURS = ('green', 'yellow', 'red')
 
-def parse_block(block, metric=None, labels=None):
+
+def parse_shard_statuses(shards, metric=None, labels=None):
+    """
+    Counts the shards of an index with each status, rather than producing
+    metrics for each shard.
+    """
+    if metric is None:
+        metric = []
+    if labels is None:
+        labels = OrderedDict()
+
+    counts = OrderedDict((colour, 0) for colour in STATUS_COLOURS)
+    for shard in shards.values():
+        status = shard['status']
+        counts[status] = counts.get(status, 0) + 1
+
+    return [
+        (metric + ['status', 'count'], '', merge_dicts_ordered(labels, status=[status]), count)
+        for status, count in counts.items()
+    ]
+
+
+def parse_block(block, metric=None, labels=None, aggregate_shards=False):
     if metric is None:
         metric = []
     if labels is None:
@@ -29,7 +52,7 @@ def parse_block(block, metric=None, labels=None):
     elif status == 'red':
         status_int = 2
     metrics.append((metric + ['status'], '', labels, status_int))
-    for colour in ['green', 'yellow', 'red']:
+    for colour in STATUS_COLOURS:
         metrics.append((metric + ['status', colour], '', labels,
                         1 if status == colour else 0))
 
@@ -38,18 +61,29 @@ def parse_block(block, metric=None, labels=None):
             metrics.append((metric + [key], '', labels, int(value)))
         elif isinstance(value, (int, float)):
             metrics.append((metric + [key], '', labels, value))
+        elif isinstance(value, dict) and key == 'shards' and aggregate_shards:
+            metrics.extend(parse_shard_statuses(value, metric=metric + [key], labels=labels))
         elif isinstance(value, dict):
             if key in singular_forms:
                 singular_key = singular_forms[key]
             else:
                 singular_key = key
             for n_key, n_value in value.items():
-                metrics.extend(parse_block(n_value, metric=metric + [key], labels=merge_dicts_ordered(labels, {singular_key: [n_key]})))
+                n_labels = merge_dicts_ordered(labels, {singular_key: [n_key]})
+                metrics.extend(parse_block(n_value, metric=metric + [key], labels=n_labels,
+                                           aggregate_shards=aggregate_shards))
 
     return metrics
 
 
-def parse_response(response, metric=None):
+def parse_response(response, metric=None, aggregate_shards=False):
+    """
+    Parses a cluster health response.
+
+    If aggregate_shards is set, the shards of each index in a shards level
+    response are counted by status, rather than producing metrics for each
+    shard.
+    """
     if metric is None:
         metric = []
 
@@ -62,7 +96,7 @@ def parse_response(response, metric=None):
         # Delete this field as we don't want to parse it as metric
         del response['timed_out']
 
-        metrics.extend(parse_block(response, metric=metric))
+        metrics.extend(parse_block(response, metric=metric, aggregate_shards=aggregate_shards))
 
     return [
         (format_metric_name(*metric_name),
@@ -0,0 +1,275 @@
+import collections
+import struct
+import threading
+import zlib
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+IDENTITY = 'identity'
+GZIP = 'gzip'
+ZSTD = 'zstd'
+
+# Supported encodings, in order of preference when a client accepts several
+# with the same quality value.
+if zstandard is not None:
+    ENCODINGS = (ZSTD, GZIP)
+else:
+    ENCODINGS = (GZIP,)
+
+
+def parse_accept_encoding(header):
+    """
+    Parses an Accept-Encoding header into a dict of encoding -> quality value.
+    """
+    qualities = {}
+    for item in header.split(','):
+        encoding, _, params = item.partition(';')
+        encoding = encoding.strip().lower()
+        if not encoding:
+            continue
+
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+
+        qualities[encoding] = quality
+
+    return qualities
+
+
+def choose_encoding(accept_encoding):
+    """
+    Chooses the content encoding to use for a response, given the request's
+    Accept-Encoding header.
+    """
+    qualities = parse_accept_encoding(accept_encoding)
+
+    best_encoding = IDENTITY
+    best_quality = 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best_encoding = encoding
+            best_quality = quality
+
+    return best_encoding
+
+
+# Raw deflate streams are used for gzip segments, so they can be joined together
+# and wrapped in a single gzip member.
+DEFLATE_WBITS = -zlib.MAX_WBITS
+# A gzip header with no file name or modification time.
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+# An empty, final deflate block, to end a deflate stream.
+DEFLATE_FINAL_BLOCK = zlib.compressobj(6, zlib.DEFLATED, DEFLATE_WBITS).flush()
+
+# A compressed segment of output, along with the CRC-32 and length of the
+# uncompressed data (only used for gzip).
+Segment = collections.namedtuple('Segment', ['data', 'crc', 'length'])
+
+
+def _gf2_matrix_times(matrix, vector):
+    total = 0
+    i = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[i]
+        vector >>= 1
+        i += 1
+    return total
+
+
+def _gf2_matrix_square(matrix):
+    return [_gf2_matrix_times(matrix, matrix[n]) for n in range(32)]
+
+
+def crc32_combine(crc1, crc2, length2):
+    """
+    Combines the CRC-32s of two pieces of data into the CRC-32 of the data
+    joined together, given the length of the second piece.
+
+    A port of zlib's crc32_combine(), which Python's zlib module doesn't expose.
+    """
+    if length2 == 0:
+        return crc1
+
+    # Operator for one zero bit.
+    odd = [0xedb88320] + [1 << n for n in range(31)]
+    # Operators for two, then four, zero bits.
+    even = _gf2_matrix_square(odd)
+    odd = _gf2_matrix_square(even)
+
+    # Apply length2 zeros to crc1 (the first squaring puts the operator for one
+    # zero byte, eight zero bits, in even).
+    while True:
+        even = _gf2_matrix_square(odd)
+        if length2 & 1:
+            crc1 = _gf2_matrix_times(even, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+
+        odd = _gf2_matrix_square(even)
+        if length2 & 1:
+            crc1 = _gf2_matrix_times(odd, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+
+    return crc1 ^ crc2
+
+
+def segment_compressor(encoding):
+    if encoding == GZIP:
+        return zlib.compressobj(6, zlib.DEFLATED, DEFLATE_WBITS)
+    elif encoding == ZSTD:
+        return zstandard.ZstdCompressor().compressobj()
+    else:
+        raise ValueError('Unsupported encoding {}.'.format(encoding))
+
+
+def end_segment(encoding, comp):
+    if encoding == GZIP:
+        # Sync flushing ends the segment on a byte boundary without marking the
+        # deflate stream as finished, so further segments can follow it.
+        return comp.flush(zlib.Z_SYNC_FLUSH)
+    else:
+        # Each zstd segment is a complete frame. Consecutive frames are
+        # decompressed as a single stream.
+        return comp.flush()
+
+
+def compress_segment(chunks, encoding):
+    """
+    Compresses an iterator of bytes chunks into a segment that can be added to
+    the output of an Encoder.
+    """
+    comp = segment_compressor(encoding)
+    data = []
+    crc = 0
+    length = 0
+    for chunk in chunks:
+        data.append(comp.compress(chunk))
+        crc = zlib.crc32(chunk, crc)
+        length += len(chunk)
+    data.append(end_segment(encoding, comp))
+
+    return Segment(b''.join(data), crc, length)
+
+
+class Encoder(object):
+    """
+    Compresses a stream of data, which can include previously compressed
+    segments.
+
+    Call start(), then compress() and add_segment() as required, then finish(),
+    concatenating their output.
+    """
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self._comp = None
+        self._crc = 0
+        self._length = 0
+        self._empty = True
+
+    def _end_segment(self):
+        if self._comp is None:
+            return b''
+
+        data = end_segment(self.encoding, self._comp)
+        self._comp = None
+        return data
+
+    def start(self):
+        if self.encoding == GZIP:
+            return GZIP_HEADER
+        else:
+            return b''
+
+    def compress(self, data):
+        if self._comp is None:
+            self._comp = segment_compressor(self.encoding)
+
+        self._crc = zlib.crc32(data, self._crc)
+        self._length += len(data)
+        self._empty = False
+        return self._comp.compress(data)
+
+    def add_segment(self, segment):
+        data = self._end_segment()
+
+        self._crc = crc32_combine(self._crc, segment.crc, segment.length)
+        self._length += segment.length
+        self._empty = False
+        return data + segment.data
+
+    def finish(self):
+        data = self._end_segment()
+
+        if self.encoding == GZIP:
+            data += DEFLATE_FINAL_BLOCK
+            data += struct.pack('<II', self._crc & 0xffffffff, self._length & 0xffffffff)
+        elif self._empty:
+            # Even an empty body must be valid compressed data.
+            data += end_segment(self.encoding, segment_compressor(self.encoding))
+
+        return data
+
+
+class CompressedCache(object):
+    """
+    A cache of compressed segments, keyed on the generation of the data they
+    were produced from.
+
+    Only the latest generation of each segment is kept for each key and
+    encoding. Concurrent requests for the same uncached segment wait for a
+    single copy to be produced, rather than each compressing it themselves.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._key_locks = {}
+
+    def get(self, key, encoding, generation, chunks_func):
+        """
+        Returns the compressed segment for a key and encoding.
+
+        If the cached segment isn't from the given generation, chunks_func is
+        called to produce the uncompressed data (an iterator of bytes chunks),
+        which is compressed and cached.
+        """
+        cache_key = (key, encoding)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(cache_key, threading.Lock())
+
+        with key_lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[0] == generation:
+                return entry[1]
+
+            segment = compress_segment(chunks_func(), encoding)
+            self._entries[cache_key] = (generation, segment)
+            return segment
+
+
+# Snappy (block format) is used by the Prometheus remote write protocol, and
+# requires the python-snappy package (see SNAPPY_INSTALLED).
+SNAPPY_INSTALLED = snappy is not None
+
+
+def snappy_compress(data):
+    return snappy.compress(data)
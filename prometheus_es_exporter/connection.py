@@ -0,0 +1,92 @@
+import logging
+import threading
+
+from elasticsearch.connection import Urllib3HttpConnection
+from prometheus_client import Counter
+
+from .recording import record_response
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+
+# These metrics aren't registered on creation, so they are only exported if
+# a registry is set up to export them.
+RESPONSE_BYTES_RECEIVED = Counter(
+    'es_client_response_bytes_received',
+    'Size of response bodies received from the node, before decompression.',
+    ['node'], registry=None)
+RESPONSE_BYTES_DECODED = Counter(
+    'es_client_response_bytes_decoded',
+    'Size of response bodies received from the node, after decompression.',
+    ['node'], registry=None)
+
+CONNECTION_METRICS = (
+    RESPONSE_BYTES_RECEIVED,
+    RESPONSE_BYTES_DECODED,
+)
+
+
+def last_response_size():
+    """
+    Returns the size in bytes (after decompression) of the last response body
+    received by an ExporterConnection in the current thread.
+    """
+    return getattr(_local, 'last_response_size', 0)
+
+
+def set_last_response_size(size):
+    """
+    Sets the size returned by last_response_size() in the current thread,
+    e.g. for a response received in another thread on its behalf.
+    """
+    _local.last_response_size = size
+
+
+class ExporterConnection(Urllib3HttpConnection):
+    """
+    Urllib3 based connection that records the size of response bodies, both
+    as received and once decompressed.
+
+    Client requests are performed in the calling thread, so the size of the
+    last response is also recorded per thread, and can be read with
+    last_response_size() after a request.
+
+    If http_compress is set, compressed responses are requested from the node.
+    urllib3 decompresses them as they're read.
+
+    If record_dir is set, successful responses are saved in it, so they can be
+    replayed later (see the replay module).
+    """
+
+    def __init__(self, *args, record_dir=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.record_dir = record_dir
+
+        urlopen = self.pool.urlopen
+
+        def metered_urlopen(*args, **kwargs):
+            response = urlopen(*args, **kwargs)
+            # The response body has been read (and decompressed) by now.
+            # tell() is the number of bytes read from the connection.
+            RESPONSE_BYTES_RECEIVED.labels(self.host).inc(response.tell())
+            RESPONSE_BYTES_DECODED.labels(self.host).inc(len(response.data))
+            set_last_response_size(len(response.data))
+            return response
+
+        self.pool.urlopen = metered_urlopen
+
+    def perform_request(self, method, url, params=None, body=None, timeout=None,
+                        ignore=(), headers=None):
+        status, response_headers, data = super().perform_request(
+            method, url, params=params, body=body, timeout=timeout,
+            ignore=ignore, headers=headers)
+
+        if self.record_dir is not None:
+            try:
+                record_response(self.record_dir, method, url, params, body, status, data)
+            except Exception:
+                log.exception('Error while recording response to %(method)s %(url)s.',
+                              {'method': method, 'url': url})
+
+        return status, response_headers, data
@@ -0,0 +1,466 @@
+from collections import OrderedDict
+
+from prometheus_client.exposition import CONTENT_TYPE_LATEST
+from prometheus_client.utils import floatToGoString
+
+from . import protobuf
+from .compression import Encoder
+from .metrics import MetricDictGaugeFamily
+from .registry import registry_collectors
+
+TEXT = 'text'
+OPENMETRICS = 'openmetrics'
+PROTOBUF = 'protobuf'
+
+CONTENT_TYPE_OPENMETRICS = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+CONTENT_TYPE_PROTOBUF = ('application/vnd.google.protobuf; '
+                         'proto=io.prometheus.client.MetricFamily; encoding=delimited')
+
+# io.prometheus.client.MetricType values.
+PROTOBUF_COUNTER = 0
+PROTOBUF_GAUGE = 1
+PROTOBUF_SUMMARY = 2
+PROTOBUF_UNTYPED = 3
+PROTOBUF_HISTOGRAM = 4
+
+# Suffixes of OpenMetrics specific samples, which are exposed as separate gauges
+# in the Prometheus text format.
+OPENMETRICS_SUFFIXES = ('_created', '_gsum', '_gcount')
+
+
+def escape_doc(doc):
+    return doc.replace('\\', r'\\').replace('\n', r'\n')
+
+
+def escape_label_value(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def format_label_str(labels):
+    if labels:
+        return '{' + ','.join(
+            '{}="{}"'.format(key, escape_label_value(value))
+            for key, value in sorted(labels.items())
+        ) + '}'
+    else:
+        return ''
+
+
+def format_sample(sample):
+    if sample.timestamp is not None:
+        # Convert to milliseconds.
+        timestamp_str = ' {:d}'.format(int(float(sample.timestamp) * 1000))
+    else:
+        timestamp_str = ''
+
+    return '{}{} {}{}\n'.format(sample.name, format_label_str(sample.labels),
+                                floatToGoString(sample.value), timestamp_str)
+
+
+def format_metric_dict_samples(metric):
+    """
+    Formats the samples of a MetricDictGaugeFamily straight from its value
+    dict, as format_sample() would format them.
+    """
+    # Labels are output sorted by key.
+    label_order = sorted(range(len(metric.label_keys)), key=lambda i: metric.label_keys[i])
+    label_templates = ['{}="{{}}"'.format(metric.label_keys[i]) for i in label_order]
+
+    lines = []
+    for label_values, value in metric.values():
+        if label_values:
+            label_str = '{' + ','.join(
+                template.format(escape_label_value(label_values[i]))
+                for template, i in zip(label_templates, label_order)
+            ) + '}'
+        else:
+            label_str = ''
+
+        lines.append('{}{} {}\n'.format(metric.name, label_str, floatToGoString(value)))
+
+    return lines
+
+
+def format_metric_family(metric):
+    """
+    Formats a single metric family in the Prometheus text format.
+
+    Produces the same output as prometheus_client's generate_latest() does for
+    the metric family, so families can be formatted (and sent) one at a time.
+    """
+    name = metric.name
+    metric_type = metric.type
+    # Munging from OpenMetrics into Prometheus format.
+    if metric_type == 'counter':
+        name = name + '_total'
+    elif metric_type == 'info':
+        name = name + '_info'
+        metric_type = 'gauge'
+    elif metric_type == 'stateset':
+        metric_type = 'gauge'
+    elif metric_type == 'gaugehistogram':
+        # A gauge histogram is really a gauge,
+        # but this captures the structure better.
+        metric_type = 'histogram'
+    elif metric_type == 'unknown':
+        metric_type = 'untyped'
+
+    output = [
+        '# HELP {} {}\n'.format(name, escape_doc(metric.documentation)),
+        '# TYPE {} {}\n'.format(name, metric_type),
+    ]
+
+    if isinstance(metric, MetricDictGaugeFamily):
+        output.extend(format_metric_dict_samples(metric))
+        return ''.join(output)
+
+    om_samples = {}
+    for sample in metric.samples:
+        for suffix in OPENMETRICS_SUFFIXES:
+            if sample.name == metric.name + suffix:
+                # OpenMetrics specific sample, put in a gauge at the end.
+                om_samples.setdefault(suffix, []).append(format_sample(sample))
+                break
+        else:
+            output.append(format_sample(sample))
+
+    for suffix, lines in sorted(om_samples.items()):
+        output.append('# HELP {} {}\n'.format(metric.name + suffix,
+                                              escape_doc(metric.documentation)))
+        output.append('# TYPE {} gauge\n'.format(metric.name + suffix))
+        output.extend(lines)
+
+    return ''.join(output)
+
+
+def format_metric_family_openmetrics(metric):
+    """
+    Formats a single metric family in the OpenMetrics text format.
+
+    Produces the same output as prometheus_client's OpenMetrics
+    generate_latest() does for the metric family (exemplars aside).
+    """
+    output = [
+        '# HELP {} {}\n'.format(metric.name,
+                                escape_doc(metric.documentation).replace('"', r'\"')),
+        '# TYPE {} {}\n'.format(metric.name, metric.type),
+    ]
+    if metric.unit:
+        output.append('# UNIT {} {}\n'.format(metric.name, metric.unit))
+
+    if isinstance(metric, MetricDictGaugeFamily):
+        output.extend(format_metric_dict_samples(metric))
+        return ''.join(output)
+
+    for sample in metric.samples:
+        if sample.timestamp is not None:
+            timestamp_str = ' {}'.format(sample.timestamp)
+        else:
+            timestamp_str = ''
+
+        output.append('{}{} {}{}\n'.format(sample.name, format_label_str(sample.labels),
+                                           floatToGoString(sample.value), timestamp_str))
+
+    return ''.join(output)
+
+
+def encode_metric(labels, value_field, timestamp=None):
+    """
+    Encodes an io.prometheus.client.Metric message.
+
+    value_field is the already encoded gauge, counter, summary, untyped or
+    histogram field of the message.
+    """
+    message = b''.join(
+        protobuf.bytes_field(1, protobuf.string_field(1, key) + protobuf.string_field(2, value))
+        for key, value in sorted(labels.items())
+    )
+    message += value_field
+    if timestamp is not None:
+        message += protobuf.varint_field(6, int(float(timestamp) * 1000))
+    return message
+
+
+def encode_metric_family(name, documentation, metric_type, metrics):
+    """
+    Encodes a length delimited io.prometheus.client.MetricFamily message.
+    """
+    message = (protobuf.string_field(1, name) +
+               protobuf.string_field(2, documentation) +
+               protobuf.varint_field(3, metric_type))
+    message += b''.join(protobuf.bytes_field(4, metric) for metric in metrics)
+    return protobuf.delimited(message)
+
+
+def group_samples(samples, excluded_label):
+    """
+    Groups the samples of a histogram or summary by their labels, excluding
+    the bucket or quantile label.
+    """
+    groups = OrderedDict()
+    for sample in samples:
+        labels = tuple(sorted((k, v) for k, v in sample.labels.items() if k != excluded_label))
+        groups.setdefault(labels, []).append(sample)
+    return groups
+
+
+def encode_histogram(metric, samples):
+    metrics = []
+    for labels, samples in group_samples(samples, 'le').items():
+        count, total, buckets = 0, 0.0, b''
+        for sample in samples:
+            if sample.name == metric.name + '_count':
+                count = sample.value
+            elif sample.name == metric.name + '_sum':
+                total = sample.value
+            # The +Inf bucket is implied by the sample count.
+            elif sample.name == metric.name + '_bucket' and sample.labels['le'] != '+Inf':
+                buckets += protobuf.bytes_field(
+                    3, protobuf.varint_field(1, int(sample.value)) +
+                    protobuf.double_field(2, float(sample.labels['le'])))
+
+        histogram = protobuf.varint_field(1, int(count)) + protobuf.double_field(2, total) + buckets
+        metrics.append(encode_metric(dict(labels), protobuf.bytes_field(7, histogram)))
+
+    return encode_metric_family(metric.name, metric.documentation, PROTOBUF_HISTOGRAM, metrics)
+
+
+def encode_summary(metric, samples):
+    metrics = []
+    for labels, samples in group_samples(samples, 'quantile').items():
+        count, total, quantiles = 0, 0.0, b''
+        for sample in samples:
+            if sample.name == metric.name + '_count':
+                count = sample.value
+            elif sample.name == metric.name + '_sum':
+                total = sample.value
+            elif sample.name == metric.name:
+                quantiles += protobuf.bytes_field(
+                    3, protobuf.double_field(1, float(sample.labels['quantile'])) +
+                    protobuf.double_field(2, sample.value))
+
+        summary = protobuf.varint_field(1, int(count)) + protobuf.double_field(2, total) + quantiles
+        metrics.append(encode_metric(dict(labels), protobuf.bytes_field(4, summary)))
+
+    return encode_metric_family(metric.name, metric.documentation, PROTOBUF_SUMMARY, metrics)
+
+
+def encode_metric_family_protobuf(metric):
+    """
+    Encodes a single metric family in the Prometheus protobuf format, as
+    length delimited io.prometheus.client.MetricFamily messages.
+
+    Metric types without a protobuf equivalent, and samples without a place
+    in the protobuf histogram and summary messages (e.g. OpenMetrics created
+    timestamps), are encoded as an untyped family for each sample name.
+    """
+    if isinstance(metric, MetricDictGaugeFamily):
+        label_keys = metric.label_keys
+        metrics = [
+            encode_metric(dict(zip(label_keys, label_values)),
+                          protobuf.bytes_field(2, protobuf.double_field(1, value)))
+            for label_values, value in metric.values()
+        ]
+        return encode_metric_family(metric.name, metric.documentation, PROTOBUF_GAUGE, metrics)
+
+    output = []
+    samples = metric.samples
+
+    if metric.type in ('histogram', 'summary'):
+        if metric.type == 'histogram':
+            encode_func, sample_names = encode_histogram, (metric.name + '_bucket',)
+        else:
+            encode_func, sample_names = encode_summary, (metric.name,)
+        sample_names += (metric.name + '_count', metric.name + '_sum')
+
+        output.append(encode_func(metric, [s for s in samples if s.name in sample_names]))
+        samples = [s for s in samples if s.name not in sample_names]
+
+    if metric.type == 'gauge':
+        family_types = {metric.name: (PROTOBUF_GAUGE, 2)}
+    elif metric.type == 'counter':
+        family_types = {metric.name + '_total': (PROTOBUF_COUNTER, 3)}
+    else:
+        family_types = {}
+
+    samples_by_name = OrderedDict()
+    for sample in samples:
+        samples_by_name.setdefault(sample.name, []).append(sample)
+
+    for sample_name, samples in samples_by_name.items():
+        metric_type, field_number = family_types.get(sample_name, (PROTOBUF_UNTYPED, 5))
+        metrics = [
+            encode_metric(sample.labels,
+                          protobuf.bytes_field(field_number,
+                                               protobuf.double_field(1, sample.value)),
+                          sample.timestamp)
+            for sample in samples
+        ]
+        output.append(encode_metric_family(sample_name, metric.documentation, metric_type, metrics))
+
+    return b''.join(output)
+
+
+# Format name -> (content type, metric family formatter, trailer).
+FORMATS = {
+    TEXT: (CONTENT_TYPE_LATEST,
+           lambda metric: format_metric_family(metric).encode('utf-8'),
+           b''),
+    OPENMETRICS: (CONTENT_TYPE_OPENMETRICS,
+                  lambda metric: format_metric_family_openmetrics(metric).encode('utf-8'),
+                  b'# EOF\n'),
+    PROTOBUF: (CONTENT_TYPE_PROTOBUF,
+               encode_metric_family_protobuf,
+               b''),
+}
+
+# Formats in order of preference, for when a client accepts several equally.
+FORMAT_PREFERENCE = (PROTOBUF, OPENMETRICS, TEXT)
+
+
+def content_type(fmt):
+    return FORMATS[fmt][0]
+
+
+def parse_accept(header):
+    """
+    Parses an Accept header into a list of (media type, params dict, quality)
+    tuples.
+    """
+    media_ranges = []
+    for item in header.split(','):
+        media_type, *params = item.split(';')
+        media_type = media_type.strip().lower()
+        if not media_type:
+            continue
+
+        param_dict = {}
+        for param in params:
+            key, _, value = param.partition('=')
+            param_dict[key.strip().lower()] = value.strip().strip('"')
+
+        try:
+            quality = float(param_dict.pop('q', 1))
+        except ValueError:
+            quality = 0.0
+
+        media_ranges.append((media_type, param_dict, quality))
+
+    return media_ranges
+
+
+def choose_format(accept):
+    """
+    Chooses the exposition format to use for a response, given the request's
+    Accept header.
+
+    Falls back to the Prometheus text format if the client doesn't accept any
+    of the supported formats.
+    """
+    qualities = {}
+    for media_type, params, quality in parse_accept(accept):
+        if media_type == 'application/vnd.google.protobuf':
+            if params.get('proto') != 'io.prometheus.client.MetricFamily' or \
+               params.get('encoding') != 'delimited':
+                continue
+            fmt = PROTOBUF
+        elif media_type == 'application/openmetrics-text':
+            if params.get('version', '1.0.0') not in ('0.0.1', '1.0.0'):
+                continue
+            fmt = OPENMETRICS
+        elif media_type in ('text/plain', 'text/*', '*/*'):
+            fmt = TEXT
+        else:
+            continue
+
+        qualities[fmt] = max(quality, qualities.get(fmt, 0.0))
+
+    best_format = TEXT
+    best_quality = 0.0
+    for fmt in FORMAT_PREFERENCE:
+        quality = qualities.get(fmt, 0.0)
+        if quality > best_quality:
+            best_format = fmt
+            best_quality = quality
+
+    return best_format
+
+
+def generate(registry, fmt=TEXT):
+    """
+    Generates an exposition format for a registry, one metric family at a time.
+
+    Yields bytes for each metric family.
+    """
+    _, format_family, trailer = FORMATS[fmt]
+    for metric in registry.collect():
+        yield format_family(metric)
+
+    if trailer:
+        yield trailer
+
+
+def generate_text(registry):
+    """
+    Generates the Prometheus text format for a registry, one metric family at
+    a time.
+
+    Yields UTF-8 encoded bytes for each metric family.
+    """
+    return generate(registry, TEXT)
+
+
+def generate_collector(collector, fmt):
+    _, format_family, _ = FORMATS[fmt]
+    for metric in collector.collect():
+        yield format_family(metric)
+
+
+def generate_compressed(registry, encoding, cache, fmt=TEXT):
+    """
+    Generates an exposition format for a registry, compressed with the given
+    encoding.
+
+    Output from snapshot collectors (those with a generation() method) is
+    compressed separately and cached until their generation changes. Output
+    from other collectors is compressed as it's generated.
+    """
+    _, _, trailer = FORMATS[fmt]
+    encoder = Encoder(encoding)
+    yield encoder.start()
+
+    for collector in registry_collectors(registry):
+        generation_func = getattr(collector, 'generation', None)
+
+        if generation_func is None:
+            for chunk in generate_collector(collector, fmt):
+                yield encoder.compress(chunk)
+
+        else:
+            yield encoder.add_segment(
+                cache.get((collector, fmt), encoding, generation_func(),
+                          lambda: generate_collector(collector, fmt)))
+
+    if trailer:
+        yield encoder.compress(trailer)
+    yield encoder.finish()
+
+
+def buffer_chunks(chunks, buffer_size=64 * 1024):
+    """
+    Joins small chunks of bytes together, yielding chunks of at least
+    buffer_size bytes (apart from the last).
+    """
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+
+        if buffered >= buffer_size:
+            yield b''.join(buffer)
+            buffer = []
+            buffered = 0
+
+    if buffer:
+        yield b''.join(buffer)
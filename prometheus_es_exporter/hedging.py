@@ -0,0 +1,109 @@
+import threading
+
+from collections import deque
+from prometheus_client import Counter
+
+# These metrics aren't registered on creation, so they are only exported if
+# hedging is enabled.
+HEDGED_REQUESTS = Counter(
+    'es_client_hedged_requests',
+    'Number of hedged requests sent, i.e. duplicate requests sent to another node '
+    'after the original request was slow to respond.',
+    registry=None)
+HEDGED_REQUESTS_WON = Counter(
+    'es_client_hedged_requests_won',
+    'Number of hedged requests that responded before the original request.',
+    registry=None)
+HEDGE_BUDGET_EXHAUSTED = Counter(
+    'es_client_hedge_budget_exhausted',
+    'Number of slow requests that were not hedged because the hedging budget was used up.',
+    registry=None)
+
+HEDGES_THROTTLED = Counter(
+    'es_client_hedges_throttled',
+    'Number of slow requests that were not hedged because the request budget had no '
+    'room for another request.',
+    registry=None)
+
+HEDGING_METRICS = (
+    HEDGED_REQUESTS,
+    HEDGED_REQUESTS_WON,
+    HEDGE_BUDGET_EXHAUSTED,
+    HEDGES_THROTTLED,
+)
+
+# Endpoints that are searches, despite being requested with POST.
+READ_ONLY_POST_ENDPOINTS = ('_search', '_msearch', '_count')
+
+
+def is_read_only(method, url):
+    """
+    Returns whether a request is read-only, and so safe to send twice.
+    """
+    if method in ('GET', 'HEAD'):
+        return True
+    return method == 'POST' and url.rstrip('/').rsplit('/', 1)[-1] in READ_ONLY_POST_ENDPOINTS
+
+
+class Hedger(object):
+    """
+    Decides when requests are hedged.
+
+    The latencies of the last window requests to each endpoint are tracked.
+    Once there are at least min_samples of them, requests to the endpoint are
+    hedged if they take longer than the given percentile of its latencies.
+
+    Each request earns max_extra of a hedge, and each hedge uses up a whole
+    one, so at most max_extra extra requests are made per request on average.
+    Up to max_saved hedges can be saved up for bursts of slow requests.
+    """
+
+    def __init__(self, percentile=95, max_extra=0.05, window=100, min_samples=20, max_saved=10):
+        self.percentile = percentile
+        self.max_extra = max_extra
+        self.window = window
+        self.min_samples = min_samples
+        self.max_saved = max_saved
+
+        self.lock = threading.Lock()
+        # Endpoint -> deque of recent latencies, in seconds.
+        self.latencies = {}
+        self.saved = 0.0
+
+    def delay(self, endpoint):
+        """
+        Returns how long to wait for a response from a request to an endpoint
+        before hedging it, or None if it shouldn't be hedged.
+
+        Counts the request towards the hedging budget.
+        """
+        with self.lock:
+            self.saved = min(self.max_saved, self.saved + self.max_extra)
+
+            latencies = self.latencies.get(endpoint)
+            if latencies is None or len(latencies) < self.min_samples:
+                return None
+
+            latencies = sorted(latencies)
+            index = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))
+            return latencies[index]
+
+    def record(self, endpoint, latency):
+        with self.lock:
+            latencies = self.latencies.get(endpoint)
+            if latencies is None:
+                latencies = self.latencies[endpoint] = deque(maxlen=self.window)
+            latencies.append(latency)
+
+    def spend(self):
+        """
+        Uses up a hedge from the budget, returning False if there are none.
+        """
+        with self.lock:
+            if self.saved < 1:
+                HEDGE_BUDGET_EXHAUSTED.inc()
+                return False
+
+            self.saved -= 1
+            HEDGED_REQUESTS.inc()
+            return True
@@ -0,0 +1,143 @@
+from collections import OrderedDict
+
+from .metrics import format_metric_name, format_labels
+
+# _cat/indices columns, mapped to the indices stats metric group they belong
+# to, and the path of the equivalent value in an indices stats response.
+# These columns are based on primary shards only.
+PRIMARIES_COLUMNS = OrderedDict([
+    ('docs.count', ('docs', ['docs', 'count'])),
+    ('docs.deleted', ('docs', ['docs', 'deleted'])),
+])
+# These columns are based on all shards, and are also available based on
+# primary shards only, prefixed with "pri.".
+TOTAL_COLUMNS = OrderedDict([
+    ('store.size', ('store', ['store', 'size_in_bytes'])),
+    ('indexing.index_total', ('indexing', ['indexing', 'index_total'])),
+    ('indexing.index_time', ('indexing', ['indexing', 'index_time_in_millis'])),
+    ('indexing.index_current', ('indexing', ['indexing', 'index_current'])),
+    ('indexing.index_failed', ('indexing', ['indexing', 'index_failed'])),
+    ('indexing.delete_total', ('indexing', ['indexing', 'delete_total'])),
+    ('indexing.delete_time', ('indexing', ['indexing', 'delete_time_in_millis'])),
+    ('indexing.delete_current', ('indexing', ['indexing', 'delete_current'])),
+    ('get.total', ('get', ['get', 'total'])),
+    ('get.time', ('get', ['get', 'time_in_millis'])),
+    ('get.current', ('get', ['get', 'current'])),
+    ('get.exists_total', ('get', ['get', 'exists_total'])),
+    ('get.exists_time', ('get', ['get', 'exists_time_in_millis'])),
+    ('get.missing_total', ('get', ['get', 'missing_total'])),
+    ('get.missing_time', ('get', ['get', 'missing_time_in_millis'])),
+    ('search.open_contexts', ('search', ['search', 'open_contexts'])),
+    ('search.query_total', ('search', ['search', 'query_total'])),
+    ('search.query_time', ('search', ['search', 'query_time_in_millis'])),
+    ('search.query_current', ('search', ['search', 'query_current'])),
+    ('search.fetch_total', ('search', ['search', 'fetch_total'])),
+    ('search.fetch_time', ('search', ['search', 'fetch_time_in_millis'])),
+    ('search.fetch_current', ('search', ['search', 'fetch_current'])),
+    ('search.scroll_total', ('search', ['search', 'scroll_total'])),
+    ('search.scroll_time', ('search', ['search', 'scroll_time_in_millis'])),
+    ('search.scroll_current', ('search', ['search', 'scroll_current'])),
+    ('merges.current', ('merge', ['merges', 'current'])),
+    ('merges.current_docs', ('merge', ['merges', 'current_docs'])),
+    ('merges.current_size', ('merge', ['merges', 'current_size_in_bytes'])),
+    ('merges.total', ('merge', ['merges', 'total'])),
+    ('merges.total_docs', ('merge', ['merges', 'total_docs'])),
+    ('merges.total_size', ('merge', ['merges', 'total_size_in_bytes'])),
+    ('merges.total_time', ('merge', ['merges', 'total_time_in_millis'])),
+    ('refresh.total', ('refresh', ['refresh', 'total'])),
+    ('refresh.time', ('refresh', ['refresh', 'total_time_in_millis'])),
+    ('flush.total', ('flush', ['flush', 'total'])),
+    ('flush.total_time', ('flush', ['flush', 'total_time_in_millis'])),
+    ('fielddata.memory_size', ('fielddata', ['fielddata', 'memory_size_in_bytes'])),
+    ('fielddata.evictions', ('fielddata', ['fielddata', 'evictions'])),
+    ('query_cache.memory_size', ('query_cache', ['query_cache', 'memory_size_in_bytes'])),
+    ('query_cache.evictions', ('query_cache', ['query_cache', 'evictions'])),
+    ('request_cache.memory_size', ('request_cache', ['request_cache', 'memory_size_in_bytes'])),
+    ('request_cache.evictions', ('request_cache', ['request_cache', 'evictions'])),
+    ('request_cache.hit_count', ('request_cache', ['request_cache', 'hit_count'])),
+    ('request_cache.miss_count', ('request_cache', ['request_cache', 'miss_count'])),
+    ('segments.count', ('segments', ['segments', 'count'])),
+    ('segments.memory', ('segments', ['segments', 'memory_in_bytes'])),
+    ('warmer.current', ('warmer', ['warmer', 'current'])),
+    ('warmer.total', ('warmer', ['warmer', 'total'])),
+    ('warmer.total_time', ('warmer', ['warmer', 'total_time_in_millis'])),
+])
+
+
+def column_paths(metrics=None):
+    """
+    Returns an OrderedDict of the _cat/indices columns needed for the given
+    indices stats metric groups (or all groups, if None), mapped to the paths
+    of their metrics.
+    """
+    columns = OrderedDict()
+
+    for column, (group, path) in PRIMARIES_COLUMNS.items():
+        if metrics is None or group in metrics:
+            columns[column] = ['primaries'] + path
+
+    for column, (group, path) in TOTAL_COLUMNS.items():
+        if metrics is None or group in metrics:
+            columns[column] = ['total'] + path
+            columns['pri.' + column] = ['primaries'] + path
+
+    return columns
+
+
+def parse_value(value):
+    # Values are returned as strings, and are null for closed indices.
+    if value is None or isinstance(value, (int, float)):
+        return value
+
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def parse_row(row, columns):
+    values = OrderedDict()
+    for column, path in columns.items():
+        value = parse_value(row.get(column))
+        if value is not None:
+            values[tuple(path)] = value
+    return values
+
+
+def parse_response(response, columns, parse_indices=False, metric=None):
+    """
+    Parses a _cat/indices response, with format=json, bytes=b and time=ms,
+    into the same metrics as indices_stats_parser.parse_response().
+
+    columns maps the requested columns to the paths of their metrics (see
+    column_paths()). If parse_indices is False, values are summed across
+    indices, like the _all values of an indices stats response.
+    """
+    if metric is None:
+        metric = []
+
+    metrics = []
+
+    if parse_indices:
+        for row in response:
+            labels = OrderedDict({'index': [row['index']]})
+            for path, value in parse_row(row, columns).items():
+                metrics.append((metric + list(path), '', labels, value))
+    else:
+        totals = OrderedDict()
+        for row in response:
+            for path, value in parse_row(row, columns).items():
+                totals[path] = totals.get(path, 0) + value
+
+        labels = OrderedDict({'index': ['_all']})
+        for path, value in totals.items():
+            metrics.append((metric + list(path), '', labels, value))
+
+    return [
+        (format_metric_name(*metric_name),
+         metric_doc,
+         format_labels(label_dict),
+         value)
+        for metric_name, metric_doc, label_dict, value
+        in metrics
+    ]
@@ -1,7 +1,7 @@
 import re
 
 from collections import OrderedDict
-from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.core import Sample
 
 
 METRIC_INVALID_CHARS = re.compile(r'[^a-zA-Z0-9_:]')
@@ -166,33 +166,122 @@ def merge_metric_dicts(old_metric_dict, new_metric_dict, zero_missing=False):
     return metric_dict
 
 
-def gauge_generator(metric_dict):
+def add_metric_dicts(old_metric_dict, new_metric_dict, replace_metric_names=()):
     """
-    Generates GaugeMetricFamily instances for a list of metrics.
+    Add an old and new metric dict together, returning the summed metric dict.
 
-    Takes metrics as a dict keyed by metric name. Each metric name maps to a
-    tuple containing:
+    Metric dicts are keyed by metric name. Each metric name maps to a tuple
+    containing:
     * metric documentation
     * label keys tuple,
     * dict of label values tuple -> metric value.
 
-    Yields a GaugeMetricFamily instance for each unique metric name, containing
-    children for the various label combinations. Suitable for use in a collect()
-    method of a Prometheus collector.
+    Values for label values tuples present in both metric dicts are summed.
+    Values present in only one of the metric dicts are kept as is. Values for
+    metric names in replace_metric_names are taken from the new metric dict
+    rather than being summed, as with merge_metric_dicts().
     """
+    metric_dict = old_metric_dict.copy()
+    for metric_name, (metric_doc, label_keys, new_value_dict) in new_metric_dict.items():
+        if metric_name in replace_metric_names or metric_name not in old_metric_dict:
+            old_value_dict = {}
+        else:
+            old_value_dict = old_metric_dict[metric_name][2]
 
-    for metric_name, (metric_doc, label_keys, value_dict) in metric_dict.items():
+        value_dict = old_value_dict.copy()
+        for label_values, value in new_value_dict.items():
+            value_dict[label_values] = value_dict.get(label_values, 0) + value
+
+        metric_dict[metric_name] = (metric_doc, label_keys, value_dict)
+
+    return metric_dict
+
+
+def subtract_metric_dicts(old_metric_dict, new_metric_dict, keep_metric_names=()):
+    """
+    Subtract a new metric dict from an old metric dict, returning the
+    resulting metric dict.
+
+    Metric dicts are keyed by metric name. Each metric name maps to a tuple
+    containing:
+    * metric documentation
+    * label keys tuple,
+    * dict of label values tuple -> metric value.
+
+    Values for label values tuples present in both metric dicts are
+    subtracted. Values present only in the new metric dict are ignored, and
+    values present only in the old metric dict are kept as is. Values for
+    metric names in keep_metric_names are kept from the old metric dict.
+    """
+    metric_dict = old_metric_dict.copy()
+    for metric_name, (_, _, new_value_dict) in new_metric_dict.items():
+        if metric_name in keep_metric_names or metric_name not in old_metric_dict:
+            continue
+
+        metric_doc, label_keys, old_value_dict = old_metric_dict[metric_name]
+        value_dict = old_value_dict.copy()
+        for label_values, value in new_value_dict.items():
+            if label_values in value_dict:
+                value_dict[label_values] -= value
+
+        metric_dict[metric_name] = (metric_doc, label_keys, value_dict)
+
+    return metric_dict
+
+
+class MetricDictGaugeFamily(object):
+    """
+    A gauge metric family backed by a metric from a metric dict.
+
+    Can be used in place of a prometheus_client GaugeMetricFamily, but its
+    samples are only built if they're accessed. The exporter's exposition
+    formats render these families straight from the value dict instead,
+    avoiding building a sample for every value.
+    """
+    type = 'gauge'
+    unit = ''
+
+    def __init__(self, name, documentation, label_keys, value_dict):
+        self.name = name
+        self.documentation = documentation
+        self.label_keys = label_keys
+        self.value_dict = value_dict
+
+    def values(self):
+        """
+        Returns a list of (label values tuple, value) tuples for the family.
+        """
         # If we have label keys we may have multiple different values,
         # each with their own label values.
-        if label_keys:
-            gauge = GaugeMetricFamily(metric_name, metric_doc, labels=label_keys)
-
-            for label_values in sorted(value_dict.keys()):
-                value = value_dict[label_values]
-                gauge.add_metric(label_values, value)
+        if self.label_keys:
+            return sorted(self.value_dict.items())
 
         # No label keys, so we must have only a single value.
         else:
-            gauge = GaugeMetricFamily(metric_name, metric_doc, value=list(value_dict.values())[0])
+            return list(self.value_dict.items())[:1]
+
+    @property
+    def samples(self):
+        return [
+            Sample(self.name, dict(zip(self.label_keys, label_values)), value)
+            for label_values, value in self.values()
+        ]
+
+
+def gauge_generator(metric_dict):
+    """
+    Generates gauge metric families for a list of metrics.
 
-        yield gauge
+    Takes metrics as a dict keyed by metric name. Each metric name maps to a
+    tuple containing:
+    * metric documentation
+    * label keys tuple,
+    * dict of label values tuple -> metric value.
+
+    Yields a MetricDictGaugeFamily instance for each unique metric name,
+    containing the values for the various label combinations. Suitable for use
+    in a collect() method of a Prometheus collector.
+    """
+
+    for metric_name, (metric_doc, label_keys, value_dict) in metric_dict.items():
+        yield MetricDictGaugeFamily(metric_name, metric_doc, label_keys, value_dict)
@@ -1,4 +1,7 @@
+import re
+
 from collections import OrderedDict
+from copy import deepcopy
 
 from .metrics import format_metric_name, format_labels
 
@@ -118,3 +121,215 @@ def parse_response(response, metric=None):
         for metric_name, metric_doc, label_dict, value
         in metrics
     ]
+
+
+# Elasticsearch accepts both `aggs` and `aggregations` as the key for query aggregations.
+AGGS_KEYS = ('aggs', 'aggregations')
+
+# The page size used for composite aggregations that don't specify one.
+# https://www.elastic.co/guide/en/elasticsearch/reference/current/search-aggregations-bucket-composite-aggregation.html#_size
+COMPOSITE_DEFAULT_SIZE = 10
+
+
+def get_query_aggs(query):
+    for aggs_key in AGGS_KEYS:
+        if aggs_key in query:
+            return aggs_key, query[aggs_key]
+
+    return None, {}
+
+
+def composite_aggs(query):
+    """
+    Finds the top level composite aggregations in a query.
+
+    Returns a dict of aggregation name -> composite aggregation settings.
+    """
+    _, aggs = get_query_aggs(query)
+    return {
+        agg_name: agg['composite']
+        for agg_name, agg in aggs.items()
+        if 'composite' in agg
+    }
+
+
+def set_composite_page_size(query, page_size):
+    """
+    Returns a copy of a query with the page size of all its top level
+    composite aggregations set to page_size.
+    """
+    query = deepcopy(query)
+
+    for composite in composite_aggs(query).values():
+        composite['size'] = page_size
+
+    return query
+
+
+def composite_after_keys(query, response):
+    """
+    Finds the `after_key` for the next page of any composite aggregations in
+    a response that have more pages to fetch.
+
+    An aggregation is considered complete if it returned fewer buckets than
+    its page size, so an extra request for an empty last page is avoided
+    where possible.
+
+    Returns a dict of aggregation name -> after key.
+    """
+    if response['timed_out'] or 'aggregations' not in response:
+        return {}
+
+    after_keys = {}
+    for agg_name, composite in composite_aggs(query).items():
+        agg = response['aggregations'].get(agg_name, {})
+        page_size = composite.get('size', COMPOSITE_DEFAULT_SIZE)
+
+        if 'after_key' in agg and len(agg.get('buckets', [])) >= page_size:
+            after_keys[agg_name] = agg['after_key']
+
+    return after_keys
+
+
+def composite_next_page_query(query, after_keys):
+    """
+    Builds a query to fetch the next page of composite aggregations.
+
+    Only the composite aggregations with more pages to fetch are included in
+    the new query - other aggregations have already been returned in full by
+    the first page. Hits aren't needed either, so the query size is set to 0.
+    """
+    query = deepcopy(query)
+    aggs_key, aggs = get_query_aggs(query)
+
+    query[aggs_key] = {
+        agg_name: agg
+        for agg_name, agg in aggs.items()
+        if agg_name in after_keys
+    }
+    for agg_name, agg in query[aggs_key].items():
+        agg['composite']['after'] = after_keys[agg_name]
+
+    query['size'] = 0
+
+    return query
+
+
+RANGE_BOUND_KEYS = ('gt', 'gte', 'lt', 'lte', 'from', 'to')
+
+
+def relative_range_fields(query):
+    """
+    Returns the set of fields with range clauses in a query that use date math
+    relative to now, e.g. `"gte": "now-1d"`.
+    """
+    fields = set()
+
+    if isinstance(query, dict):
+        for key, value in query.items():
+            if key == 'range' and isinstance(value, dict):
+                for field, bounds in value.items():
+                    if isinstance(bounds, dict) and any(
+                            isinstance(bounds.get(bound_key), str) and 'now' in bounds[bound_key]
+                            for bound_key in RANGE_BOUND_KEYS):
+                        fields.add(field)
+            else:
+                fields.update(relative_range_fields(value))
+
+    elif isinstance(query, list):
+        for value in query:
+            fields.update(relative_range_fields(value))
+
+    return fields
+
+
+# Date math units with a fixed length, in milliseconds.
+DATE_MATH_UNITS_MS = {
+    's': 1000,
+    'm': 60 * 1000,
+    'h': 60 * 60 * 1000,
+    'H': 60 * 60 * 1000,
+    'd': 24 * 60 * 60 * 1000,
+    'w': 7 * 24 * 60 * 60 * 1000,
+}
+SLIDING_WINDOW_START_RE = re.compile(r'^now-(\d+)([{}])$'.format(''.join(DATE_MATH_UNITS_MS)))
+
+
+def sliding_window_size(bounds):
+    """
+    Returns the size in milliseconds of the sliding window covered by a range
+    clause's bounds, if they cover the window from a fixed duration before now
+    up to now, e.g. `{"gte": "now-1d"}`. Otherwise returns None.
+    """
+    if set(bounds) - {'gte', 'lt', 'lte', 'format'} or bounds.get('lt', 'now') != 'now' or \
+       bounds.get('lte', 'now') != 'now' or not isinstance(bounds.get('gte'), str):
+        return None
+
+    match = SLIDING_WINDOW_START_RE.match(bounds['gte'])
+    if match is None:
+        return None
+
+    return int(match.group(1)) * DATE_MATH_UNITS_MS[match.group(2)]
+
+
+def remove_sliding_window(query, field):
+    """
+    Finds a sliding window on a field in a query, i.e. a range clause on the
+    field covering a fixed duration up to now (see sliding_window_size()),
+    that documents must match. Only the query itself, and the `must` and
+    `filter` clauses of bool queries in it, are searched.
+
+    Returns a tuple of a copy of the query with the window's range clause
+    removed, and the window size in milliseconds. If the query has no sliding
+    window on the field, the query is returned as is, with a size of None.
+    """
+    def remove(clause):
+        if not isinstance(clause, dict):
+            return None
+
+        if list(clause) == ['range'] and isinstance(clause['range'], dict) and \
+           list(clause['range']) == [field] and isinstance(clause['range'][field], dict):
+            size = sliding_window_size(clause['range'][field])
+            if size is not None:
+                clause.clear()
+                clause['match_all'] = {}
+            return size
+
+        if list(clause) == ['bool'] and isinstance(clause['bool'], dict):
+            for key in ('must', 'filter'):
+                clauses = clause['bool'].get(key, [])
+                for sub_clause in clauses if isinstance(clauses, list) else [clauses]:
+                    size = remove(sub_clause)
+                    if size is not None:
+                        return size
+
+        return None
+
+    window_query = deepcopy(query)
+    size = remove(window_query.get('query'))
+    if size is None:
+        return query, None
+
+    return window_query, size
+
+
+def add_range_filter(query, field, gte=None, lt=None):
+    """
+    Returns a copy of a query with its results restricted to documents with
+    a field value in the range [gte, lt). Range bounds are epoch milliseconds.
+    """
+    field_range = {'format': 'epoch_millis'}
+    if gte is not None:
+        field_range['gte'] = gte
+    if lt is not None:
+        field_range['lt'] = lt
+
+    query = query.copy()
+    query['query'] = {
+        'bool': {
+            'must': [query.get('query', {'match_all': {}})],
+            'filter': [{'range': {field: field_range}}],
+        }
+    }
+
+    return query
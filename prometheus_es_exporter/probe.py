@@ -0,0 +1,77 @@
+import concurrent.futures
+import logging
+import threading
+
+from collections import OrderedDict
+
+from .registry import ExporterRegistry
+
+log = logging.getLogger(__name__)
+
+
+class ProbeTargetError(Exception):
+    pass
+
+
+class Prober(object):
+    """
+    Collects metrics from Elasticsearch clusters chosen at request time.
+
+    Only the targets in allowed_targets can be probed, so the exporter can't
+    be used to send requests to arbitrary hosts.
+
+    An Elasticsearch client is created for each target by client_func, and
+    cached for reuse by later probes of the target. The least recently used
+    clients are closed once there are more than max_clients targets.
+
+    collectors_func is called with a target's client to create the collectors
+    for a probe. Probes are run in a dedicated thread pool, bounding the total
+    number of concurrent probes across all targets.
+    """
+
+    def __init__(self, client_func, collectors_func, allowed_targets, max_clients=100,
+                 concurrency=10):
+        self.client_func = client_func
+        self.collectors_func = collectors_func
+        self.allowed_targets = frozenset(allowed_targets)
+        self.max_clients = max_clients
+        self.executor = concurrent.futures.ThreadPoolExecutor(concurrency)
+
+        self._lock = threading.Lock()
+        self._clients = OrderedDict()
+
+    def client(self, target):
+        """
+        Returns the Elasticsearch client for a target, creating it if needed.
+
+        Raises ProbeTargetError if the target isn't allowed.
+        """
+        if target not in self.allowed_targets:
+            raise ProbeTargetError('Target not allowed: {}'.format(target))
+
+        with self._lock:
+            client = self._clients.get(target)
+            if client is not None:
+                self._clients.move_to_end(target)
+                return client
+
+            # Creating a client doesn't connect to the cluster, so this is
+            # cheap enough to do while holding the lock.
+            client = self.client_func(target)
+            self._clients[target] = client
+
+            while len(self._clients) > self.max_clients:
+                evicted_target, evicted_client = self._clients.popitem(last=False)
+                log.debug('Closing client for target %(target)s.', {'target': evicted_target})
+                evicted_client.transport.close()
+
+            return client
+
+    def registry(self, target):
+        """
+        Returns a registry of collectors for a probe of the target.
+        """
+        registry = ExporterRegistry()
+        for collector in self.collectors_func(self.client(target)):
+            registry.register(collector)
+        return registry
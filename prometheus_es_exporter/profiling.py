@@ -0,0 +1,196 @@
+import collections
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+# Functions threads sit in while waiting for work, as (file name, function
+# name). Samples of idle threads are left out of CPU profiles by default.
+IDLE_FUNCTIONS = {
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    # Thread pool workers waiting for a work item.
+    ('thread.py', '_worker'),
+    # The scheduler sleeping until its next event.
+    ('sched.py', 'run'),
+    ('selectors.py', 'select'),
+    ('socket.py', 'readinto'),
+    ('socket.py', 'accept'),
+}
+
+
+class ProfilingError(Exception):
+    pass
+
+
+class MemoryProfiler(object):
+    """
+    Compares snapshots of memory allocations traced with tracemalloc, to find
+    where memory is being allocated (and not freed) while the exporter runs.
+
+    Tracing slows the exporter down and uses extra memory, so it's only
+    enabled between start() and stop().
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_snapshot = None
+        self.started_tracing = False
+
+    def start(self, frames=1):
+        """
+        Starts tracing allocations (if they aren't already traced), keeping
+        frames frames of traceback for each allocation, and takes the snapshot
+        later snapshots are compared to.
+        """
+        with self.lock:
+            if self.start_snapshot is not None:
+                raise ProfilingError('Memory profiling already started.')
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+                self.started_tracing = True
+            self.start_snapshot = self.take_snapshot()
+
+    def stop(self):
+        """
+        Stops tracing allocations, unless they were already traced when
+        start() was called (e.g. with PYTHONTRACEMALLOC set).
+        """
+        with self.lock:
+            if self.start_snapshot is None:
+                raise ProfilingError('Memory profiling not started.')
+
+            self.start_snapshot = None
+            if self.started_tracing:
+                tracemalloc.stop()
+                self.started_tracing = False
+
+    def take_snapshot(self):
+        # Allocations made by tracemalloc itself, and by imports, aren't of
+        # interest.
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        ))
+
+    def report(self, limit=20):
+        """
+        Returns a report of the allocation sites whose allocated memory has
+        grown the most since start() was called.
+        """
+        with self.lock:
+            if self.start_snapshot is None:
+                raise ProfilingError('Memory profiling not started.')
+
+            snapshot = self.take_snapshot()
+            key_type = 'traceback' if tracemalloc.get_traceback_limit() > 1 else 'lineno'
+            stats = snapshot.compare_to(self.start_snapshot, key_type)
+
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [
+            'Traced memory: {:.1f} KiB (peak {:.1f} KiB), {:+.1f} KiB since start.'.format(
+                current / 1024, peak / 1024, sum(stat.size_diff for stat in stats) / 1024),
+            '',
+            'Top {} allocation sites by growth since start:'.format(limit),
+        ]
+        for stat in stats[:limit]:
+            lines.append('')
+            lines.append('{:+.1f} KiB ({:+d} blocks), {:.1f} KiB total'.format(
+                stat.size_diff / 1024, stat.count_diff, stat.size / 1024))
+            lines.extend('    ' + line for line in stat.traceback.format())
+
+        return '\n'.join(lines) + '\n'
+
+
+def function_key(frame):
+    code = frame.f_code
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+
+def is_idle(frame):
+    return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FUNCTIONS
+
+
+def sample_cpu(seconds, interval=0.01, include_idle=False):
+    """
+    Samples the stacks of all threads (apart from the calling thread) every
+    interval seconds, for seconds seconds.
+
+    Returns a tuple containing:
+    * the number of thread stacks sampled,
+    * a Counter of function key -> samples with the function running,
+    * a Counter of function key -> samples with the function on the stack.
+
+    Function keys are (file name, first line number, function name) tuples.
+    Threads waiting for work are skipped unless include_idle is set.
+    """
+    self_counts = collections.Counter()
+    total_counts = collections.Counter()
+    samples = 0
+
+    own_thread_id = threading.get_ident()
+    end_time = time.monotonic() + seconds
+    while time.monotonic() < end_time:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread_id:
+                continue
+            if not include_idle and is_idle(frame):
+                continue
+
+            samples += 1
+            self_counts[function_key(frame)] += 1
+
+            # Recursive functions are only counted once per sample.
+            stack_keys = set()
+            while frame is not None:
+                stack_keys.add(function_key(frame))
+                frame = frame.f_back
+            total_counts.update(stack_keys)
+
+        time.sleep(interval)
+
+    return samples, self_counts, total_counts
+
+
+class CpuProfiler(object):
+    """
+    A sampling CPU profiler, for finding the functions the exporter spends
+    its time in.
+
+    Only one profile can be taken at a time.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lock = threading.Lock()
+
+    def report(self, seconds, limit=20, include_idle=False):
+        """
+        Profiles the exporter for seconds seconds, and returns a report of the
+        limit hottest functions.
+        """
+        if not self.lock.acquire(blocking=False):
+            raise ProfilingError('CPU profiling already in progress.')
+        try:
+            samples, self_counts, total_counts = sample_cpu(seconds, self.interval,
+                                                            include_idle=include_idle)
+        finally:
+            self.lock.release()
+
+        lines = [
+            '{} thread stacks sampled over {}s (every {}s).'.format(samples, seconds, self.interval),
+            '',
+            'Top {} functions by samples running the function (self), with samples with '
+            'the function on the stack (total):'.format(limit),
+            '',
+            '{:>8} {:>8}  {}'.format('self%', 'total%', 'function'),
+        ]
+        for key, count in self_counts.most_common(limit):
+            filename, lineno, name = key
+            lines.append('{:>8.1f} {:>8.1f}  {} ({}:{})'.format(
+                100 * count / samples, 100 * total_counts[key] / samples, name, filename, lineno))
+
+        return '\n'.join(lines) + '\n'
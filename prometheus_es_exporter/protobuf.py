@@ -0,0 +1,68 @@
+import struct
+
+# Minimal protocol buffers encoding, for the handful of messages the exporter
+# produces. Messages are built up as bytes with the field encoding functions,
+# with nested messages encoded first and added as length delimited fields.
+
+# Wire types.
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+
+
+def encode_varint(value):
+    # Negative numbers are encoded as their 64 bit two's complement.
+    if value < 0:
+        value += 1 << 64
+
+    parts = []
+    while value > 0x7f:
+        parts.append((value & 0x7f) | 0x80)
+        value >>= 7
+    parts.append(value)
+
+    return bytes(parts)
+
+
+def encode_key(field_number, wire_type):
+    return encode_varint((field_number << 3) | wire_type)
+
+
+def varint_field(field_number, value):
+    return encode_key(field_number, VARINT) + encode_varint(value)
+
+
+def double_field(field_number, value):
+    return encode_key(field_number, FIXED64) + struct.pack('<d', value)
+
+
+def bytes_field(field_number, value):
+    return encode_key(field_number, LENGTH_DELIMITED) + encode_varint(len(value)) + value
+
+
+def string_field(field_number, value):
+    return bytes_field(field_number, value.encode('utf-8'))
+
+
+def delimited(message):
+    """
+    Prefixes a message with its length, so a stream of messages can be split.
+    """
+    return encode_varint(len(message)) + message
+
+
+def decode_varint(data, pos):
+    """
+    Decodes a varint from data starting at pos.
+
+    Returns the value and the position after the varint.
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
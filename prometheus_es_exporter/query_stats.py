@@ -0,0 +1,81 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+from .utils import Generation
+
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9)
+SERIES_BUCKETS = (1, 10, 100, 1e3, 1e4, 1e5, 1e6)
+
+# These metrics aren't registered on creation, so they are only exported if
+# query monitoring is enabled.
+QUERY_TOOK = Histogram(
+    'es_query_took_seconds',
+    'Time Elasticsearch reported spending on the query.',
+    ['query'], buckets=DURATION_BUCKETS, registry=None)
+QUERY_DURATION = Histogram(
+    'es_query_duration_seconds',
+    'Time taken to run the query, including requests and parsing.',
+    ['query'], buckets=DURATION_BUCKETS, registry=None)
+QUERY_RESPONSE_SIZE = Histogram(
+    'es_query_response_size_bytes',
+    'Size of the query response body in bytes, after decompression.',
+    ['query'], buckets=SIZE_BUCKETS, registry=None)
+QUERY_PARSE_DURATION = Histogram(
+    'es_query_parse_duration_seconds',
+    'Time taken to parse the query response into metrics.',
+    ['query'], buckets=DURATION_BUCKETS, registry=None)
+QUERY_SERIES = Histogram(
+    'es_query_series',
+    'Number of series produced by the query.',
+    ['query'], buckets=SERIES_BUCKETS, registry=None)
+QUERY_TIMEOUTS = Counter(
+    'es_query_timeouts',
+    'Number of query runs that timed out.',
+    ['query'], registry=None)
+QUERY_ERRORS = Counter(
+    'es_query_errors',
+    'Number of query runs that failed with an error.',
+    ['query'], registry=None)
+QUERY_SKIPS = Counter(
+    'es_query_skips',
+    'Number of query runs skipped because the circuit breaker was open.',
+    ['query'], registry=None)
+QUERY_LAST_SUCCESS = Gauge(
+    'es_query_last_success_timestamp_seconds',
+    'When the query last ran successfully.',
+    ['query'], registry=None)
+
+QUERY_STATS_METRICS = (
+    QUERY_TOOK,
+    QUERY_DURATION,
+    QUERY_RESPONSE_SIZE,
+    QUERY_PARSE_DURATION,
+    QUERY_SERIES,
+    QUERY_TIMEOUTS,
+    QUERY_ERRORS,
+    QUERY_SKIPS,
+    QUERY_LAST_SUCCESS,
+)
+
+# Incremented after each query run, once its stats have been recorded.
+QUERY_STATS_GENERATION = Generation()
+
+
+class QueryStatsCollector(object):
+    """
+    Collects the query execution metrics.
+
+    The metrics only change while queries run, so they're treated as a
+    snapshot that changes after each run.
+    """
+
+    def generation(self):
+        return QUERY_STATS_GENERATION.value
+
+    def collect(self):
+        for metric in QUERY_STATS_METRICS:
+            yield from metric.collect()
+
+
+def count_series(metric_dict):
+    return sum(len(value_dict) for _, _, value_dict in metric_dict.values())
@@ -0,0 +1,78 @@
+import glob
+import hashlib
+import json
+import os
+import re
+
+
+def canonical_body(body):
+    """
+    Returns a request body as a string, with JSON bodies in a canonical form,
+    so equivalent bodies are equal.
+    """
+    if body is None:
+        return None
+
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+
+    try:
+        return json.dumps(json.loads(body), sort_keys=True)
+    except ValueError:
+        return body
+
+
+def canonical_params(params):
+    """
+    Returns request parameters as a dict of strings, as the client may encode
+    them as bytes.
+    """
+    return {
+        key: value.decode('utf-8') if isinstance(value, bytes) else str(value)
+        for key, value in (params or {}).items()
+    }
+
+
+def request_key(method, path, params, body):
+    """
+    Returns a key identifying a request, used to name its recording.
+    """
+    request = json.dumps([method, path, sorted(canonical_params(params).items()), canonical_body(body)])
+    request_hash = hashlib.sha1(request.encode('utf-8')).hexdigest()[:12]
+
+    path_name = re.sub(r'[^A-Za-z0-9_.,-]+', '_', path.strip('/')) or 'root'
+    return '{}_{}_{}'.format(method, path_name, request_hash)
+
+
+def record_response(record_dir, method, path, params, body, status, response):
+    """
+    Saves a response to a request in record_dir, replacing any previous
+    recording of the same request.
+    """
+    if isinstance(response, bytes):
+        response = response.decode('utf-8')
+
+    recording = {
+        'method': method,
+        'path': path,
+        'params': canonical_params(params),
+        'body': canonical_body(body),
+        'status': status,
+        'response': response,
+    }
+
+    file_path = os.path.join(record_dir, request_key(method, path, params, body) + '.json')
+    # Written to a temporary file first, so a recording is never read half written.
+    temp_file_path = '{}.{}.tmp'.format(file_path, os.getpid())
+    with open(temp_file_path, 'w', encoding='utf-8') as f:
+        json.dump(recording, f)
+    os.replace(temp_file_path, file_path)
+
+
+def load_recordings(record_dir):
+    """
+    Generates the recordings saved in record_dir.
+    """
+    for file_path in sorted(glob.glob(os.path.join(record_dir, '*.json'))):
+        with open(file_path, encoding='utf-8') as f:
+            yield json.load(f)
@@ -0,0 +1,68 @@
+from prometheus_client.core import CollectorRegistry
+
+
+class ExporterRegistry(CollectorRegistry):
+    """
+    A collector registry that keeps track of the collectors registered with it,
+    in registration order.
+
+    This allows the output of each collector to be handled separately, e.g. so
+    that snapshot collectors can have their output cached.
+    """
+
+    def __init__(self, auto_describe=False):
+        super().__init__(auto_describe=auto_describe)
+        self.collectors = []
+
+    def register(self, collector):
+        super().register(collector)
+        self.collectors.append(collector)
+
+    def unregister(self, collector):
+        super().unregister(collector)
+        self.collectors.remove(collector)
+
+
+def combine_registries(registries):
+    """
+    Returns an ExporterRegistry containing the collectors from several
+    registries.
+
+    Collectors in more than one of the registries are only included once.
+    """
+    combined = ExporterRegistry()
+    for registry in registries:
+        for collector in registry_collectors(registry):
+            if collector not in combined.collectors:
+                combined.register(collector)
+    return combined
+
+
+def registry_generations(registry):
+    """
+    Returns a tuple of the generations of the collectors in a registry.
+
+    Returns None if any of the collectors aren't snapshot collectors (those
+    with a generation() method), as the registry's output can then change at
+    any time.
+    """
+    generations = []
+    for collector in registry_collectors(registry):
+        generation_func = getattr(collector, 'generation', None)
+        if generation_func is None:
+            return None
+        generations.append(generation_func())
+    return tuple(generations)
+
+
+def registry_collectors(registry):
+    """
+    Returns the collectors in a registry.
+
+    Registries that don't track their collectors are treated as a single
+    collector.
+    """
+    if isinstance(registry, ExporterRegistry):
+        return list(registry.collectors)
+    else:
+        return [registry]
@@ -0,0 +1,240 @@
+import logging
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from prometheus_client import Counter
+
+from . import protobuf
+from .compression import snappy_compress
+from .metrics import MetricDictGaugeFamily
+
+log = logging.getLogger(__name__)
+
+USER_AGENT = 'prometheus-es-exporter'
+
+# These metrics aren't registered on creation, so they are only exported if
+# remote write is enabled.
+REMOTE_WRITE_SAMPLES_SENT = Counter(
+    'es_remote_write_samples_sent',
+    'Number of samples sent to the remote write endpoint.',
+    registry=None)
+REMOTE_WRITE_SAMPLES_DROPPED = Counter(
+    'es_remote_write_samples_dropped',
+    'Number of samples dropped due to a full queue or failed requests.',
+    registry=None)
+REMOTE_WRITE_REQUEST_FAILURES = Counter(
+    'es_remote_write_request_failures',
+    'Number of failed requests to the remote write endpoint, including retried requests.',
+    registry=None)
+
+REMOTE_WRITE_METRICS = (
+    REMOTE_WRITE_SAMPLES_SENT,
+    REMOTE_WRITE_SAMPLES_DROPPED,
+    REMOTE_WRITE_REQUEST_FAILURES,
+)
+
+
+class RetryableError(Exception):
+    pass
+
+
+def encode_series(name, labels, value, timestamp_ms):
+    """
+    Encodes a prometheus.TimeSeries message with a single sample.
+
+    labels is an iterable of (label name, label value) pairs.
+    """
+    # Labels must be sorted by name, including the metric name label.
+    labels = sorted([('__name__', name)] + list(labels))
+    message = b''.join(
+        protobuf.bytes_field(1, protobuf.string_field(1, key) + protobuf.string_field(2, value))
+        for key, value in labels
+    )
+    sample = protobuf.double_field(1, value) + protobuf.varint_field(2, timestamp_ms)
+    return message + protobuf.bytes_field(2, sample)
+
+
+def generate_series(registry, timestamp_ms):
+    """
+    Generates encoded prometheus.TimeSeries messages for the samples in a
+    registry.
+
+    Samples without a timestamp of their own are given timestamp_ms.
+    """
+    for metric in registry.collect():
+        if isinstance(metric, MetricDictGaugeFamily):
+            label_keys = metric.label_keys
+            for label_values, value in metric.values():
+                yield encode_series(metric.name, zip(label_keys, label_values),
+                                    value, timestamp_ms)
+
+        else:
+            for sample in metric.samples:
+                if sample.timestamp is not None:
+                    sample_timestamp_ms = int(float(sample.timestamp) * 1000)
+                else:
+                    sample_timestamp_ms = timestamp_ms
+
+                yield encode_series(sample.name, sample.labels.items(),
+                                    sample.value, sample_timestamp_ms)
+
+
+def generate_batches(registry, timestamp_ms, batch_size):
+    """
+    Generates snappy compressed prometheus.WriteRequest messages for the
+    samples in a registry, with up to batch_size samples per message.
+
+    Yields (message, sample count) tuples.
+    """
+    batch = []
+    for series in generate_series(registry, timestamp_ms):
+        batch.append(protobuf.bytes_field(1, series))
+
+        if len(batch) >= batch_size:
+            yield snappy_compress(b''.join(batch)), len(batch)
+            batch = []
+
+    if batch:
+        yield snappy_compress(b''.join(batch)), len(batch)
+
+
+class RemoteWriter(object):
+    """
+    Pushes the metrics in a registry to a Prometheus remote write endpoint.
+
+    Every interval seconds the registry is collected, and the samples are
+    batched into remote write requests and added to a bounded queue. If the
+    queue is full, the oldest batches are dropped to make room.
+
+    Batches are sent from the queue one at a time, in order. Requests that
+    fail with a server error, a 429 response or a connection error are
+    retried with exponential backoff, up to max_retries times, before the
+    batch is dropped. Other failed requests are dropped without retrying.
+    """
+
+    def __init__(self, url, registry, interval=60, batch_size=5000, queue_size=100,
+                 timeout=30, max_retries=5, min_backoff=1, max_backoff=30, headers=None):
+        self.url = url
+        self.registry = registry
+        self.interval = interval
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.headers = headers or {}
+
+        self.queue = queue.Queue(maxsize=queue_size)
+
+    def start(self):
+        """
+        Starts pushing metrics in background threads.
+        """
+        threading.Thread(target=self.run_collect, name='RemoteWriteCollect', daemon=True).start()
+        threading.Thread(target=self.run_send, name='RemoteWriteSend', daemon=True).start()
+
+    def run_collect(self):
+        next_time = time.monotonic()
+        while True:
+            try:
+                self.collect()
+            except Exception:
+                log.exception('Error while collecting metrics for remote write.')
+
+            current_time = time.monotonic()
+            next_time += self.interval
+            while next_time < current_time:
+                next_time += self.interval
+            time.sleep(next_time - current_time)
+
+    def run_send(self):
+        while True:
+            batch = self.queue.get()
+            try:
+                self.send(batch)
+            except Exception:
+                log.exception('Error while sending remote write request.')
+
+    def collect(self):
+        """
+        Collects the registry, adding batches of its samples to the queue.
+        """
+        timestamp_ms = int(time.time() * 1000)
+        for batch in generate_batches(self.registry, timestamp_ms, self.batch_size):
+            self.enqueue(batch)
+
+    def enqueue(self, batch):
+        while True:
+            try:
+                self.queue.put_nowait(batch)
+                return
+            except queue.Full:
+                pass
+
+            try:
+                _, dropped_count = self.queue.get_nowait()
+            except queue.Empty:
+                continue
+
+            log.warning('Remote write queue full, dropping %(count)s samples.',
+                        {'count': dropped_count})
+            REMOTE_WRITE_SAMPLES_DROPPED.inc(dropped_count)
+
+    def send(self, batch):
+        """
+        Sends a batch, retrying failed requests as appropriate.
+
+        Returns whether the batch was sent successfully.
+        """
+        body, sample_count = batch
+        backoff = self.min_backoff
+
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+            try:
+                self.post(body)
+            except RetryableError as e:
+                REMOTE_WRITE_REQUEST_FAILURES.inc()
+                log.warning('Remote write request failed, attempt %(attempt)s: %(error)s',
+                            {'attempt': attempt + 1, 'error': e})
+                continue
+            except Exception as e:
+                REMOTE_WRITE_REQUEST_FAILURES.inc()
+                log.error('Remote write request failed, dropping %(count)s samples: %(error)s',
+                          {'count': sample_count, 'error': e})
+                REMOTE_WRITE_SAMPLES_DROPPED.inc(sample_count)
+                return False
+
+            REMOTE_WRITE_SAMPLES_SENT.inc(sample_count)
+            return True
+
+        log.error('Remote write request retries exhausted, dropping %(count)s samples.',
+                  {'count': sample_count})
+        REMOTE_WRITE_SAMPLES_DROPPED.inc(sample_count)
+        return False
+
+    def post(self, body):
+        headers = dict(self.headers)
+        headers.update({
+            'Content-Encoding': 'snappy',
+            'Content-Type': 'application/x-protobuf',
+            'User-Agent': USER_AGENT,
+            'X-Prometheus-Remote-Write-Version': '0.1.0',
+        })
+        request = urllib.request.Request(self.url, data=body, headers=headers, method='POST')
+
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            if e.code >= 500 or e.code == 429:
+                raise RetryableError('HTTP {}'.format(e.code))
+            raise
+        except (urllib.error.URLError, OSError) as e:
+            raise RetryableError(str(e))
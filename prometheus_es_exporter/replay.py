@@ -0,0 +1,196 @@
+import click
+import json
+import logging
+import socketserver
+
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from .recording import load_recordings, request_key
+from .utils import log_exceptions, nice_shutdown
+
+log = logging.getLogger(__name__)
+
+CONTEXT_SETTINGS = {
+    'help_option_names': ['-h', '--help']
+}
+
+
+def scale_dict(d, size, copy_value):
+    """
+    Adds copies of the entries of a dict until it has size entries.
+
+    Copies are keyed "<original key>-<n>", and their values are created with
+    copy_value(original value, new key).
+    """
+    if not d or len(d) >= size:
+        return d
+
+    items = list(d.items())
+    scaled = OrderedDict(items)
+    n = 0
+    while len(scaled) < size:
+        key, value = items[n % len(items)]
+        new_key = '{}-{}'.format(key, n)
+        scaled[new_key] = copy_value(value, new_key)
+        n += 1
+
+    return scaled
+
+
+def scale_response(path, response, indices=None, nodes=None):
+    """
+    Synthetically scales up a decoded response, by copying its indices up to
+    indices indices, and its nodes up to nodes nodes.
+
+    Only the per-index and per-node parts of responses are scaled. Cluster
+    wide totals are left as they are.
+    """
+    def same(value, key):
+        return value
+
+    endpoint = path.rstrip('/').rsplit('/', 1)[-1]
+
+    if nodes and path.startswith('/_nodes') and isinstance(response.get('nodes'), dict):
+        def copy_node(node, node_id):
+            return dict(node, name=node_id) if 'name' in node else node
+
+        response = dict(response, nodes=scale_dict(response['nodes'], nodes, copy_node))
+
+    if indices:
+        # Empty responses have nothing to copy, so are left as they are.
+        if path.startswith('/_cat/indices') and isinstance(response, list) and response:
+            rows = list(response)
+            for n in range(max(0, indices - len(rows))):
+                row = response[n % len(response)]
+                rows.append(dict(row, index='{}-{}'.format(row['index'], n)))
+            response = rows
+
+        elif isinstance(response, dict) and isinstance(response.get('indices'), dict) and \
+                (path.startswith('/_cluster/health') or endpoint == '_stats' or '/_stats/' in path):
+            response = dict(response, indices=scale_dict(response['indices'], indices, same))
+
+        elif isinstance(response, dict) and endpoint in ('_mapping', '_mappings', '_alias', '_aliases'):
+            response = scale_dict(response, indices, same)
+
+    return response
+
+
+class ReplayServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    A fake Elasticsearch server, that serves responses recorded with the
+    exporter's --record-dir option, so the exporter can be run (and load
+    tested) without a cluster. Responses can be scaled up (see
+    scale_response()).
+
+    Requests are matched to recordings of the same request (method, path,
+    parameters and body). Failing that, they're matched to a recording of a
+    request to the same path, so e.g. searches with different time ranges
+    still get a response.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, record_dir, indices=None, nodes=None):
+        super().__init__(address, ReplayHandler)
+
+        # Request key -> (status, encoded response).
+        self.responses = {}
+        # (method, path) -> (status, encoded response).
+        self.path_responses = {}
+
+        for recording in load_recordings(record_dir):
+            method, path = recording['method'], recording['path']
+            response = recording['response']
+
+            if indices or nodes:
+                try:
+                    response = json.dumps(scale_response(path, json.loads(response),
+                                                         indices=indices, nodes=nodes))
+                except ValueError:
+                    pass
+
+            status_response = (recording['status'], response.encode('utf-8'))
+            key = request_key(method, path, recording['params'], recording['body'])
+            self.responses[key] = status_response
+            self.path_responses.setdefault((method, path), status_response)
+
+        log.info('Loaded %(count)s recordings from %(record_dir)s.',
+                 {'count': len(self.responses), 'record_dir': record_dir})
+
+    def find_response(self, method, path, params, body):
+        key = request_key(method, path, params, body)
+        if key in self.responses:
+            return self.responses[key]
+        return self.path_responses.get((method, path))
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def handle_request(self, send_body=True):
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query, keep_blank_values=True))
+
+        body = None
+        content_length = int(self.headers.get('Content-Length') or 0)
+        if content_length:
+            body = self.rfile.read(content_length)
+
+        status_response = self.server.find_response(self.command, url.path, params, body)
+        if status_response is None:
+            log.warning('No recording for %(method)s %(path)s.',
+                        {'method': self.command, 'path': self.path})
+            status, response = 404, json.dumps({'error': 'No recording.', 'status': 404}).encode('utf-8')
+        else:
+            status, response = status_response
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(response)
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.option('--record-dir', required=True, type=click.Path(exists=True, file_okay=False),
+              help='Directory of responses recorded with the exporter\'s "--record-dir" option.')
+@click.option('--port', '-p', default=9200,
+              help='Port to serve on. (default: 9200)')
+@click.option('--scale-indices', type=click.IntRange(min=1),
+              help='Scale up responses to this many indices, by copying the recorded indices.')
+@click.option('--scale-nodes', type=click.IntRange(min=1),
+              help='Scale up responses to this many nodes, by copying the recorded nodes.')
+@click.option('--verbose', '-v', default=False, is_flag=True,
+              help='Turn on verbose (DEBUG) logging.')
+def cli(**options):
+    """Replay recorded Elasticsearch responses."""
+    logging.basicConfig(
+        format='[%(asctime)s] %(name)s.%(levelname)s %(threadName)s %(message)s',
+        level=logging.DEBUG if options['verbose'] else logging.INFO
+    )
+
+    server = ReplayServer(('', options['port']), options['record_dir'],
+                          indices=options['scale_indices'],
+                          nodes=options['scale_nodes'])
+    log.info('Replaying on port %(port)s', {'port': options['port']})
+    server.serve_forever()
+
+
+@log_exceptions(exit_on_exception=True)
+@nice_shutdown()
+def main():
+    cli(auto_envvar_prefix='ES_REPLAY')
@@ -0,0 +1,159 @@
+import threading
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from .query_stats import DURATION_BUCKETS
+
+HIGH_PRIORITY = 'high'
+NORMAL_PRIORITY = 'normal'
+
+# These metrics aren't registered on creation, so they are only exported if
+# the request budget is enabled.
+REQUESTS_IN_FLIGHT = Gauge(
+    'es_client_requests_in_flight',
+    'Number of requests to the cluster in flight.',
+    registry=None)
+THROTTLED_REQUESTS = Counter(
+    'es_client_throttled_requests',
+    'Number of requests that had to wait for the request budget.',
+    ['priority'], registry=None)
+THROTTLED_WAIT = Histogram(
+    'es_client_throttled_wait_seconds',
+    'Time requests waited for the request budget, for requests that had to wait.',
+    ['priority'], buckets=DURATION_BUCKETS, registry=None)
+
+REQUEST_BUDGET_METRICS = (
+    REQUESTS_IN_FLIGHT,
+    THROTTLED_REQUESTS,
+    THROTTLED_WAIT,
+)
+
+
+def request_priority(url):
+    """
+    Returns the priority of a request to the given URL path.
+
+    Cluster health requests are cheap, and are the most important signal
+    while the cluster is struggling, so have high priority.
+    """
+    if url.startswith('/_cluster/health'):
+        return HIGH_PRIORITY
+    return NORMAL_PRIORITY
+
+
+class RequestBudget(object):
+    """
+    Limits the load requests put on the cluster.
+
+    Requests are limited to rate per second on average (if set), with bursts
+    of up to burst requests, using a token bucket. At most max_in_flight
+    requests (if set) are made at once. Requests wait until they're within
+    the budget.
+
+    Normal priority requests also wait while any high priority requests are
+    waiting, so high priority requests are made first.
+    """
+
+    def __init__(self, rate=None, burst=None, max_in_flight=None):
+        self.rate = rate
+        if burst is None and rate is not None:
+            burst = max(1, rate)
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+
+        self.condition = threading.Condition()
+        self.tokens = burst
+        self.last_refill_time = time.monotonic()
+        self.in_flight = 0
+        self.waiting = {HIGH_PRIORITY: 0, NORMAL_PRIORITY: 0}
+
+    def wait_time(self, priority):
+        """
+        Returns how long a request must wait before it can be made: 0 if it
+        can be made now, None if it must wait for another request to finish
+        or start, or the time until the next token is available.
+        """
+        if priority != HIGH_PRIORITY and self.waiting[HIGH_PRIORITY]:
+            return None
+
+        if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+            return None
+
+        if self.rate is not None:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last_refill_time) * self.rate)
+            self.last_refill_time = now
+
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+
+        return 0
+
+    def admit(self):
+        """
+        Uses up the budget for a request that can be made now.
+        """
+        if self.rate is not None:
+            self.tokens -= 1
+        self.in_flight += 1
+        REQUESTS_IN_FLIGHT.set(self.in_flight)
+        # Normal priority requests may have been waiting for this request.
+        self.condition.notify_all()
+
+    def acquire(self, priority=NORMAL_PRIORITY):
+        start_time = time.monotonic()
+        throttled = False
+
+        with self.condition:
+            self.waiting[priority] += 1
+            try:
+                wait_time = self.wait_time(priority)
+                while wait_time != 0:
+                    throttled = True
+                    self.condition.wait(wait_time)
+                    wait_time = self.wait_time(priority)
+            finally:
+                self.waiting[priority] -= 1
+
+            self.admit()
+
+        if throttled:
+            THROTTLED_REQUESTS.labels(priority).inc()
+            THROTTLED_WAIT.labels(priority).observe(time.monotonic() - start_time)
+
+    def try_acquire(self, priority=NORMAL_PRIORITY):
+        """
+        Acquires the budget for a request if it can be made now, without
+        waiting. Returns whether it was acquired.
+        """
+        with self.condition:
+            if self.wait_time(priority) != 0:
+                return False
+
+            self.admit()
+            return True
+
+    def release(self, refund=False):
+        """
+        Releases the budget acquired for a request once it's finished. If
+        refund is set, the request wasn't made after all, so its token is
+        returned too.
+        """
+        with self.condition:
+            if refund and self.rate is not None:
+                self.tokens = min(self.burst, self.tokens + 1)
+            self.in_flight -= 1
+            REQUESTS_IN_FLIGHT.set(self.in_flight)
+            self.condition.notify_all()
+
+    def call(self, func, *args, priority=NORMAL_PRIORITY, **kwargs):
+        """
+        Calls func, which makes a request to the cluster, once it's within the
+        budget.
+        """
+        self.acquire(priority)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.release()
@@ -0,0 +1,110 @@
+import json
+import threading
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from elasticsearch.exceptions import SerializationError
+from elasticsearch.serializer import JSONSerializer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+_local = threading.local()
+
+
+def _fallback_loads(fast_loads):
+    # Fast decoders don't support everything the stdlib decoder does (e.g.
+    # integers beyond 64 bits), so anything they fail to decode is retried
+    # with the stdlib decoder, which raises an error if it's really invalid.
+    def loads(s):
+        try:
+            return fast_loads(s)
+        except ValueError:
+            return json.loads(s)
+
+    return loads
+
+
+# Available JSON decoders, in order of preference.
+JSON_DECODERS = OrderedDict()
+if orjson is not None:
+    JSON_DECODERS['orjson'] = _fallback_loads(orjson.loads)
+if simdjson is not None:
+    JSON_DECODERS['simdjson'] = _fallback_loads(simdjson.loads)
+JSON_DECODERS['json'] = json.loads
+
+JSON_DECODER_NAMES = ('auto', 'orjson', 'simdjson', 'json')
+
+
+def json_decoder(name='auto'):
+    """
+    Returns the loads function of the named JSON decoder.
+
+    'auto' chooses the fastest decoder installed.
+    """
+    if name == 'auto':
+        return next(iter(JSON_DECODERS.values()))
+
+    if name not in JSON_DECODERS:
+        raise ValueError('JSON decoder {} is not installed.'.format(name))
+    return JSON_DECODERS[name]
+
+
+class ExporterSerializer(JSONSerializer):
+    """
+    JSON serializer that decodes responses with the named JSON decoder (see
+    json_decoder()).
+
+    Responses can also be left undecoded (see raw_responses()).
+
+    Elasticsearch client requests are performed (and their responses decoded)
+    in the calling thread, so this is set per thread.
+    """
+
+    def __init__(self, decoder='auto'):
+        self.decoder = decoder
+        self._loads = json_decoder(decoder)
+
+    def __getstate__(self):
+        # Decoder functions can't be pickled, so only their name is.
+        return {'decoder': self.decoder}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def loads(self, s):
+        if raw_responses_requested():
+            return s
+
+        try:
+            return self._loads(s)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(s, e)
+
+
+def raw_responses_requested():
+    """
+    Returns whether responses are left undecoded in the current thread (see
+    raw_responses()).
+    """
+    return getattr(_local, 'raw_responses', False)
+
+
+@contextmanager
+def raw_responses():
+    """
+    Makes ExporterSerializers return response bodies undecoded, for requests
+    made in the current thread within the context.
+    """
+    _local.raw_responses = True
+    try:
+        yield
+    finally:
+        _local.raw_responses = False
@@ -0,0 +1,524 @@
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import os
+import threading
+
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from prometheus_client.core import REGISTRY
+
+from .compression import CompressedCache, IDENTITY, choose_encoding
+from .exposition import buffer_chunks, choose_format, content_type, generate, generate_compressed
+from .probe import ProbeTargetError
+from .profiling import CpuProfiler, MemoryProfiler, ProfilingError
+from .registry import combine_registries, registry_generations
+
+log = logging.getLogger(__name__)
+
+# How long to wait for the next request on a keep-alive connection.
+KEEP_ALIVE_TIMEOUT_SECS = 60
+MAX_HEADERS = 100
+# Collector registries are served on sub-paths of this path.
+METRICS_PATH = '/metrics'
+PROBE_PATH = '/probe'
+# Debug endpoints are served on sub-paths of this path, if enabled.
+DEBUG_PATH = '/debug'
+# Debug endpoints that change the exporter's state, so only accept POST.
+DEBUG_POST_PATHS = (DEBUG_PATH + '/memory/start', DEBUG_PATH + '/memory/stop')
+# The longest CPU profile that can be requested.
+MAX_CPU_PROFILE_SECS = 300
+# The number of body chunks that can be queued for writing to a connection
+# before the thread generating them waits for the connection to catch up.
+MAX_QUEUED_CHUNKS = 4
+# How long writing a response may wait for a client to read it, before the
+# connection is closed.
+WRITE_TIMEOUT_SECS = 30
+# The number of threads generating metrics responses. Other work (e.g. for
+# debug endpoints) isn't held up while they're all busy.
+GENERATE_THREADS = 8
+
+
+class BadRequest(Exception):
+    pass
+
+
+def int_param(request, name, default, min_value, max_value):
+    """
+    Returns the value of an integer query parameter of a request, raising
+    BadRequest if it's invalid.
+    """
+    values = request.query.get(name)
+    if not values:
+        return default
+
+    try:
+        value = int(values[0])
+    except ValueError:
+        raise BadRequest('Invalid {} parameter.'.format(name))
+    if not min_value <= value <= max_value:
+        raise BadRequest('The {} parameter must be between {} and {}.'.format(
+            name, min_value, max_value))
+    return value
+
+
+class Request(object):
+    def __init__(self, method, target, version, headers):
+        self.method = method
+        self.version = version
+        self.headers = headers
+
+        url = urlsplit(target)
+        self.path = url.path
+        self.query = parse_qs(url.query)
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.1':
+            return connection != 'close'
+        else:
+            return connection == 'keep-alive'
+
+
+async def read_request(reader):
+    """
+    Reads a request from a connection, discarding any body.
+
+    Returns None if the connection was closed before a request was received.
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+
+    try:
+        method, target, version = request_line.decode('latin-1').rstrip('\r\n').split(' ')
+    except ValueError:
+        raise BadRequest('Invalid request line.')
+
+    if version not in ('HTTP/1.0', 'HTTP/1.1'):
+        raise BadRequest('Unsupported HTTP version.')
+
+    headers = {}
+    while True:
+        header_line = await reader.readline()
+        if header_line in (b'\r\n', b'\n'):
+            break
+        if not header_line:
+            raise BadRequest('Connection closed while reading headers.')
+        if len(headers) >= MAX_HEADERS:
+            raise BadRequest('Too many headers.')
+
+        name, sep, value = header_line.decode('latin-1').partition(':')
+        if not sep:
+            raise BadRequest('Invalid header line.')
+        headers[name.strip().lower()] = value.strip()
+
+    if 'transfer-encoding' in headers:
+        raise BadRequest('Chunked request bodies are not supported.')
+    if 'content-length' in headers:
+        try:
+            await reader.readexactly(int(headers['content-length']))
+        except ValueError:
+            raise BadRequest('Invalid content length.')
+
+    return Request(method, target, version, headers)
+
+
+def format_head(version, status, headers):
+    status = HTTPStatus(status)
+    lines = ['{} {} {}'.format(version, status.value, status.phrase)]
+    lines.extend('{}: {}'.format(name, value) for name, value in headers)
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Returns whether an If-None-Match header matches an ETag, using weak
+    comparison.
+    """
+    if if_none_match.strip() == '*':
+        return True
+
+    def opaque_tag(tag):
+        tag = tag.strip()
+        return tag[2:] if tag.startswith('W/') else tag
+
+    return any(opaque_tag(tag) == opaque_tag(etag) for tag in if_none_match.split(','))
+
+
+class MetricsServer(object):
+    """
+    An asyncio based HTTP server for the metrics endpoint.
+
+    Connections are handled concurrently by a single event loop, with
+    keep-alive support. Metrics are collected (which may block on requests to
+    Elasticsearch) in a thread pool, and written to the connection as each
+    chunk of the exposition is generated, rather than being buffered in full.
+
+    Metrics are exposed in the Prometheus text, OpenMetrics or protobuf
+    format, depending on the formats the client accepts. Responses are
+    compressed if the client accepts it, with compressed output from snapshot
+    collectors cached until their data changes.
+
+    The full registry is served on all paths, apart from /metrics/<name> paths,
+    which serve the registry with that name in collector_registries.
+    Registries can also be selected with collect[]=<name> parameters, in which
+    case only the selected registries' collectors are run.
+
+    If a prober is given, /probe?target=<target> serves metrics collected from
+    the target cluster by the prober. Targets the prober doesn't allow get a
+    400 response.
+
+    Responses for registries containing only snapshot collectors get an ETag
+    based on the collectors' generations, and conditional requests for an
+    unchanged snapshot get a 304 response without the metrics being generated.
+
+    If debug is set, profiling endpoints are served on /debug paths (see
+    handle_debug_request()).
+    """
+
+    def __init__(self, registry=REGISTRY, collector_registries=None, prober=None, debug=False,
+                 write_timeout=WRITE_TIMEOUT_SECS):
+        self.registry = registry
+        self.collector_registries = collector_registries or {}
+        self.prober = prober
+        self.debug = debug
+        self.memory_profiler = MemoryProfiler()
+        self.cpu_profiler = CpuProfiler()
+        # Generations start from zero again if the exporter restarts, so the
+        # ETags of each run of the exporter must be distinguished.
+        self.etag_prefix = os.urandom(8).hex()
+        self.cache = CompressedCache()
+        self.sockets = []
+        self.write_timeout = write_timeout
+        self.executor = concurrent.futures.ThreadPoolExecutor(GENERATE_THREADS)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request = await asyncio.wait_for(read_request(reader),
+                                                     KEEP_ALIVE_TIMEOUT_SECS)
+                except BadRequest as e:
+                    await self.send_response(None, writer, 400, body=str(e).encode('utf-8'))
+                    break
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                    await self.send_response(None, writer, 400)
+                    break
+
+                if request is None:
+                    break
+
+                keep_alive = await self.handle_request(request, writer)
+
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception:
+            log.exception('Error while handling connection.')
+        finally:
+            writer.close()
+
+    async def handle_request(self, request, writer):
+        """
+        Handles a request, writing the response to the connection.
+
+        Returns whether the connection can be used for further requests.
+        """
+        is_debug_request = request.path.startswith(DEBUG_PATH + '/') and self.debug
+        if request.method not in ('GET', 'HEAD') and \
+           not (is_debug_request and request.method == 'POST'):
+            return await self.send_response(request, writer, 405,
+                                            headers=[('Allow', 'GET, HEAD')])
+
+        if request.path == '/favicon.ico':
+            return await self.send_response(request, writer, 200)
+
+        if request.path == PROBE_PATH and self.prober is not None:
+            targets = request.query.get('target')
+            if not targets:
+                return await self.send_response(request, writer, 400,
+                                                body=b'Missing target parameter.')
+
+            try:
+                registry = self.prober.registry(targets[0])
+            except ProbeTargetError as e:
+                return await self.send_response(request, writer, 400, body=str(e).encode('utf-8'))
+            except Exception:
+                log.exception('Error while setting up probe of %(target)s.', {'target': targets[0]})
+                return await self.send_response(request, writer, 500,
+                                                body=b'Error while setting up probe.')
+
+            return await self.send_metrics(request, writer, registry,
+                                           executor=self.prober.executor)
+
+        if is_debug_request:
+            try:
+                return await self.handle_debug_request(request, writer)
+            except BadRequest as e:
+                return await self.send_response(request, writer, 400, body=str(e).encode('utf-8'))
+            except ProfilingError as e:
+                return await self.send_response(request, writer, 409, body=str(e).encode('utf-8'))
+
+        if request.path.startswith(METRICS_PATH + '/'):
+            name = request.path[len(METRICS_PATH) + 1:]
+            if name not in self.collector_registries:
+                return await self.send_response(request, writer, 404)
+            return await self.send_metrics(request, writer, self.collector_registries[name])
+
+        names = request.query.get('collect[]')
+        if names:
+            unknown_names = [name for name in names if name not in self.collector_registries]
+            if unknown_names:
+                body = 'Unknown collectors: {}'.format(', '.join(unknown_names))
+                return await self.send_response(request, writer, 400, body=body.encode('utf-8'))
+
+            registry = combine_registries(self.collector_registries[name] for name in names)
+            return await self.send_metrics(request, writer, registry)
+
+        # Metrics are served on all other paths, as with prometheus_client's server.
+        return await self.send_metrics(request, writer, self.registry)
+
+    async def handle_debug_request(self, request, writer):
+        """
+        Handles a request to a debug endpoint:
+
+        * POST /debug/memory/start?frames=N starts tracing memory allocations,
+          keeping N frames of traceback for each (1 by default).
+        * /debug/memory/snapshot?limit=N returns the N allocation sites whose
+          allocated memory has grown the most since tracing started (20 by
+          default).
+        * POST /debug/memory/stop stops tracing memory allocations.
+        * /debug/cpu?seconds=N&limit=M samples the stacks of all threads for N
+          seconds (10 by default), and returns the M functions they were
+          running most often (20 by default). Threads waiting for work are left
+          out, unless idle=true is given.
+
+        The other endpoints only accept GET (and HEAD) requests.
+
+        Profiling may block, so it's done in a worker thread.
+        """
+        if request.path in DEBUG_POST_PATHS:
+            if request.method != 'POST':
+                return await self.send_response(request, writer, 405, headers=[('Allow', 'POST')])
+        elif request.method == 'POST':
+            return await self.send_response(request, writer, 405,
+                                            headers=[('Allow', 'GET, HEAD')])
+
+        loop = asyncio.get_event_loop()
+
+        if request.path == DEBUG_PATH + '/memory/start':
+            frames = int_param(request, 'frames', 1, 1, 100)
+            await loop.run_in_executor(None, self.memory_profiler.start, frames)
+            body = 'Memory profiling started.\n'
+
+        elif request.path == DEBUG_PATH + '/memory/snapshot':
+            limit = int_param(request, 'limit', 20, 1, 1000)
+            body = await loop.run_in_executor(None, self.memory_profiler.report, limit)
+
+        elif request.path == DEBUG_PATH + '/memory/stop':
+            await loop.run_in_executor(None, self.memory_profiler.stop)
+            body = 'Memory profiling stopped.\n'
+
+        elif request.path == DEBUG_PATH + '/cpu':
+            seconds = int_param(request, 'seconds', 10, 1, MAX_CPU_PROFILE_SECS)
+            limit = int_param(request, 'limit', 20, 1, 1000)
+            include_idle = request.query.get('idle', [''])[0].lower() == 'true'
+            body = await loop.run_in_executor(
+                None, functools.partial(self.cpu_profiler.report, seconds, limit,
+                                        include_idle=include_idle))
+
+        else:
+            return await self.send_response(request, writer, 404)
+
+        return await self.send_response(request, writer, 200,
+                                        headers=[('Content-Type', 'text/plain; charset=utf-8')],
+                                        body=body.encode('utf-8'))
+
+    async def send_metrics(self, request, writer, registry, executor=None):
+        fmt = choose_format(request.headers.get('accept', ''))
+        encoding = choose_encoding(request.headers.get('accept-encoding', ''))
+        headers = [('Content-Type', content_type(fmt)),
+                   ('Vary', 'Accept, Accept-Encoding')]
+
+        generations = registry_generations(registry)
+        if generations is not None:
+            # The output for a generation can vary slightly, e.g. if a snapshot
+            # changes while it's being cached, so the ETag is weak.
+            etag = 'W/"{}-{}-{}-{}"'.format(self.etag_prefix, fmt, encoding,
+                                            '.'.join(str(g) for g in generations))
+            # Caches must revalidate the metrics on every request.
+            headers.extend([('ETag', etag), ('Cache-Control', 'no-cache')])
+
+            if etag_matches(request.headers.get('if-none-match', ''), etag):
+                return await self.send_response(request, writer, 304, headers=headers)
+
+        if encoding == IDENTITY:
+            def chunks_func():
+                return buffer_chunks(generate(registry, fmt))
+        else:
+            headers.append(('Content-Encoding', encoding))
+
+            def chunks_func():
+                return buffer_chunks(generate_compressed(registry, encoding, self.cache, fmt))
+
+        return await self.send_streaming_response(request, writer, 200, chunks_func,
+                                                  headers=headers, executor=executor)
+
+    async def send_response(self, request, writer, status, headers=(), body=b''):
+        keep_alive = request is not None and request.keep_alive
+
+        headers = list(headers)
+        # Not modified responses have no body, and no length for it.
+        if status != 304:
+            headers.append(('Content-Length', str(len(body))))
+        if not keep_alive:
+            headers.append(('Connection', 'close'))
+
+        version = request.version if request is not None else 'HTTP/1.1'
+        writer.write(format_head(version, status, headers))
+        if request is None or request.method != 'HEAD':
+            writer.write(body)
+        await writer.drain()
+
+        return keep_alive
+
+    async def send_streaming_response(self, request, writer, status, chunks_func, headers=(),
+                                      executor=None):
+        """
+        Sends a response with a body generated by chunks_func.
+
+        chunks_func is called in a worker thread (from executor, or the
+        server's executor if not given), and should return an iterator of bytes
+        chunks. Chunks are written to the connection as they are generated,
+        using chunked transfer encoding for HTTP/1.1 connections. HTTP/1.0
+        connections are closed to mark the end of the body.
+
+        If the client doesn't read the response for write_timeout seconds, the
+        response is abandoned (raising asyncio.TimeoutError), so a stalled
+        client can't hold on to a worker thread.
+        """
+        chunked = request.version == 'HTTP/1.1'
+        keep_alive = chunked and request.keep_alive
+
+        headers = list(headers)
+        if chunked:
+            headers.append(('Transfer-Encoding', 'chunked'))
+        if not keep_alive:
+            headers.append(('Connection', 'close'))
+
+        if request.method == 'HEAD':
+            writer.write(format_head(request.version, status, headers))
+            await writer.drain()
+            return keep_alive
+
+        loop = asyncio.get_event_loop()
+        queue = asyncio.Queue(maxsize=MAX_QUEUED_CHUNKS)
+        cancelled = threading.Event()
+
+        def put(item):
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            try:
+                future.result(self.write_timeout)
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                cancelled.set()
+
+        def produce():
+            try:
+                for chunk in chunks_func():
+                    if cancelled.is_set():
+                        return
+                    if chunk:
+                        put(chunk)
+            except Exception as e:
+                put(e)
+            else:
+                put(None)
+
+        loop.run_in_executor(executor or self.executor, produce)
+
+        head_sent = False
+        try:
+            while True:
+                item = await queue.get()
+
+                if isinstance(item, Exception):
+                    log.error('Error while generating response.', exc_info=item)
+                    if not head_sent:
+                        return await self.send_response(request, writer, 500)
+                    # The response has already started, so the only way to signal
+                    # the error is to close the connection without completing it.
+                    return False
+
+                if not head_sent:
+                    writer.write(format_head(request.version, status, headers))
+                    head_sent = True
+
+                if item is None:
+                    if chunked:
+                        writer.write(b'0\r\n\r\n')
+                    await asyncio.wait_for(writer.drain(), self.write_timeout)
+                    return keep_alive
+
+                if chunked:
+                    writer.write('{:x}\r\n'.format(len(item)).encode('latin-1'))
+                    writer.write(item)
+                    writer.write(b'\r\n')
+                else:
+                    writer.write(item)
+                await asyncio.wait_for(writer.drain(), self.write_timeout)
+
+        except BaseException:
+            # Writing to the connection failed, so stop the producer. Clear the
+            # queue so it isn't left blocked waiting to add a chunk.
+            cancelled.set()
+            while not queue.empty():
+                queue.get_nowait()
+            raise
+
+
+def start_http_server(port, addr='0.0.0.0', registry=REGISTRY, collector_registries=None,
+                      prober=None, debug=False, write_timeout=WRITE_TIMEOUT_SECS):
+    """
+    Starts an asyncio metrics server in a daemon thread.
+
+    collector_registries is an optional dict of name -> registry, with each
+    registry served on /metrics/<name>. prober is an optional Prober, used to
+    serve /probe. If debug is set, profiling endpoints are served on /debug
+    paths. Responses that clients don't read for write_timeout seconds are
+    abandoned.
+
+    Returns the MetricsServer instance once the server is listening. Any error
+    starting the server (e.g. the port being in use) is raised.
+    """
+    metrics_server = MetricsServer(registry, collector_registries, prober, debug, write_timeout)
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    start_errors = []
+
+    def run():
+        asyncio.set_event_loop(loop)
+        try:
+            server = loop.run_until_complete(
+                asyncio.start_server(metrics_server.handle_connection, addr, port))
+            metrics_server.sockets = server.sockets
+        except Exception as e:
+            start_errors.append(e)
+            return
+        finally:
+            started.set()
+
+        loop.run_forever()
+
+    thread = threading.Thread(target=run, name='MetricsServer', daemon=True)
+    thread.start()
+    started.wait()
+
+    if start_errors:
+        raise start_errors[0]
+
+    return metrics_server
@@ -0,0 +1,213 @@
+import concurrent.futures
+import functools
+import threading
+import time
+
+from elasticsearch import Transport
+
+from .connection import last_response_size, set_last_response_size
+from .hedging import HEDGED_REQUESTS_WON, HEDGES_THROTTLED, Hedger, is_read_only
+from .request_budget import request_priority
+from .serializer import raw_responses, raw_responses_requested
+
+_local = threading.local()
+
+# The default number of connections kept open to each node.
+DEFAULT_MAXSIZE = 10
+
+
+class ExporterTransport(Transport):
+    """
+    Transport that makes its requests through a circuit breaker and within a
+    request budget, if they're given.
+
+    Retries of a request are made within the breaker and the budget, so a
+    request counts as a single outcome and a single request, however many
+    times it's retried.
+
+    If hedge_percentile is set, read-only requests that take longer than that
+    percentile of recent requests to the same endpoint are hedged: a
+    duplicate request is sent to another node, and whichever responds first
+    is used (see Hedger for the hedging budget). Hedged requests count as a
+    single outcome, but each of their attempts is made within the request
+    budget, and requests are only hedged if the budget has room for the
+    hedge straight away. The hedge only gets the time left before the
+    original request times out.
+    """
+
+    def __init__(self, hosts, circuit_breaker=None, request_budget=None,
+                 hedge_percentile=None, hedge_max_extra=0.05, **kwargs):
+        super().__init__(hosts, **kwargs)
+        self.circuit_breaker = circuit_breaker
+        self.request_budget = request_budget
+
+        self.hedger = None
+        if hedge_percentile is not None:
+            self.hedger = Hedger(percentile=hedge_percentile, max_extra=hedge_max_extra)
+
+            # Attempts of hedged requests are made in a shared pool of
+            # threads, sized so each request that can use a connection at
+            # once can have both its attempts in flight.
+            max_attempts = 2 * kwargs.get('maxsize', DEFAULT_MAXSIZE)
+            self.attempt_slots = threading.BoundedSemaphore(max_attempts)
+            self.attempt_executor = concurrent.futures.ThreadPoolExecutor(max_attempts)
+
+    def close(self):
+        super().close()
+        if self.hedger is not None:
+            self.attempt_executor.shutdown(wait=False)
+
+    def choose_connection(self, used_connections=None):
+        """
+        Chooses a connection, preferring connections not in used_connections
+        (if given), and adding the chosen connection to it.
+        """
+        connection = super().get_connection()
+
+        if used_connections is not None:
+            for _ in range(len(self.connection_pool.connections) - 1):
+                if connection not in used_connections:
+                    break
+                connection = super().get_connection()
+            used_connections.add(connection)
+
+        return connection
+
+    def get_connection(self):
+        # Attempts of hedged requests are made in their own threads, so their
+        # first connection is chosen beforehand, in the requesting thread.
+        # Otherwise they'd all start from the same node, as the connection
+        # pool's round robin is per thread.
+        connection = getattr(_local, 'next_connection', None)
+        if connection is not None:
+            _local.next_connection = None
+            return connection
+
+        # Retries prefer nodes the request's other attempts aren't using.
+        return self.choose_connection(getattr(_local, 'used_connections', None))
+
+    def perform_request(self, method, url, headers=None, params=None, body=None):
+        if self.hedger is not None and is_read_only(method, url) and \
+           len(self.connection_pool.connections) > 1:
+            # Each attempt of a hedged request is made within the budget.
+            request = functools.partial(self.perform_hedged_request, method, url,
+                                        headers=headers, params=params, body=body)
+        else:
+            request = functools.partial(super().perform_request, method, url,
+                                        headers=headers, params=params, body=body)
+            if self.request_budget is not None:
+                request = functools.partial(self.request_budget.call, request,
+                                            priority=request_priority(url))
+        # The breaker is checked first, so requests it rejects don't wait for
+        # the budget.
+        if self.circuit_breaker is not None:
+            request = functools.partial(self.circuit_breaker.call, request)
+
+        return request()
+
+    def perform_hedged_request(self, method, url, headers=None, params=None, body=None):
+        endpoint = (method, url)
+        priority = request_priority(url)
+        used_connections = set()
+
+        # The transport pops the timeout from the params, so each attempt
+        # gets its own copy of them.
+        params = dict(params or {})
+        timeout = params.pop('request_timeout', None)
+        # Attempts are decoded in their own threads, so must be told if the
+        # requesting thread wants raw responses.
+        raw = raw_responses_requested()
+
+        def attempt(attempt_timeout):
+            attempt_params = dict(params)
+            if attempt_timeout is not None:
+                attempt_params['request_timeout'] = attempt_timeout
+
+            start_time = time.monotonic()
+            result = super(ExporterTransport, self).perform_request(
+                method, url, headers=headers, params=attempt_params, body=body)
+            self.hedger.record(endpoint, time.monotonic() - start_time)
+            return result, last_response_size()
+
+        def start_attempt(connection, attempt_timeout):
+            # An attempt slot and the budget for the attempt have already been
+            # acquired, and are released once the attempt finishes.
+            def run():
+                _local.used_connections = used_connections
+                _local.next_connection = connection
+                try:
+                    if raw:
+                        with raw_responses():
+                            return attempt(attempt_timeout)
+                    return attempt(attempt_timeout)
+                finally:
+                    # Executor threads are reused by other requests.
+                    _local.used_connections = None
+                    _local.next_connection = None
+                    if self.request_budget is not None:
+                        self.request_budget.release()
+                    self.attempt_slots.release()
+
+            return self.attempt_executor.submit(run)
+
+        def result(future, timeout=None):
+            # The response size is recorded in the attempt's thread, so it's
+            # passed on to the requesting thread with the response.
+            response, response_size = future.result(timeout=timeout)
+            set_last_response_size(response_size)
+            return response
+
+        delay = self.hedger.delay(endpoint)
+        # Requests that won't be hedged, or can't be as all the attempt
+        # threads are busy, are made in the requesting thread.
+        if delay is None or not self.attempt_slots.acquire(blocking=False):
+            if self.request_budget is not None:
+                return self.request_budget.call(attempt, timeout, priority=priority)[0]
+            return attempt(timeout)[0]
+
+        if self.request_budget is not None:
+            self.request_budget.acquire(priority)
+        start_time = time.monotonic()
+        connection = self.choose_connection(used_connections)
+        original = start_attempt(connection, timeout)
+        try:
+            return result(original, timeout=delay)
+        except concurrent.futures.TimeoutError:
+            pass
+
+        # The hedge only gets the time the original request has left, so the
+        # request as a whole still times out on time.
+        if timeout is None:
+            timeout = connection.timeout
+        hedge_timeout = timeout - (time.monotonic() - start_time)
+        if hedge_timeout <= 0 or not self.attempt_slots.acquire(blocking=False):
+            return result(original)
+
+        # The hedge is only sent if the budget has room for it now. Waiting
+        # for the budget would defeat the point of hedging, and add to the
+        # load while the cluster is busy.
+        if self.request_budget is not None and not self.request_budget.try_acquire(priority):
+            self.attempt_slots.release()
+            HEDGES_THROTTLED.inc()
+            return result(original)
+
+        if not self.hedger.spend():
+            if self.request_budget is not None:
+                self.request_budget.release(refund=True)
+            self.attempt_slots.release()
+            return result(original)
+
+        hedge = start_attempt(self.choose_connection(used_connections), hedge_timeout)
+        # The first successful response is used. The other request can't be
+        # cancelled, so it's left to finish in the background.
+        pending = {original, hedge}
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        HEDGED_REQUESTS_WON.inc()
+                    return result(future)
+
+        return result(original)
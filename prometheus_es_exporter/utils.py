@@ -2,6 +2,7 @@ import functools
 import logging
 import signal
 import sys
+import threading
 
 from collections import OrderedDict
 
@@ -25,6 +26,27 @@ def merge_dicts_ordered(*dict_args, **extra_entries):
     return res
 
 
+class Generation(object):
+    """
+    A thread safe counter, incremented whenever the data it tracks changes.
+
+    Comparing generations is a cheap way to tell if data has changed since
+    it was last seen.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+
+    def increment(self):
+        with self._lock:
+            self._value += 1
+
+    @property
+    def value(self):
+        return self._value
+
+
 def log_exceptions(exit_on_exception=False):
     """
     Logs any exceptions raised.
@@ -0,0 +1,132 @@
+import concurrent.futures
+import functools
+import logging
+import multiprocessing
+import sys
+import traceback
+
+from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import ConnectionError, TransportError
+
+from .request_budget import NORMAL_PRIORITY
+from .serializer import json_decoder
+
+log = logging.getLogger(__name__)
+
+# The Elasticsearch client of a worker process, created on its first call.
+_worker_es_client = None
+
+
+class WorkerError(Exception):
+    """
+    An error raised in a worker process.
+
+    Carries the formatted traceback of the original error, as the error itself
+    may not be possible to send back to the main process.
+    """
+    pass
+
+
+def _call_with_client(client_config, func, args, kwargs):
+    global _worker_es_client
+    if _worker_es_client is None:
+        hosts, client_kwargs = client_config
+        _worker_es_client = Elasticsearch(hosts, **client_kwargs)
+
+    try:
+        return func(_worker_es_client, *args, **kwargs)
+    except ConnectionError as e:
+        # Exceptions are pickled to send them back to the main process, and
+        # the underlying urllib3 error can't be, so only keep its description.
+        raise type(e)(e.status_code, str(e), Exception(str(e.info))) from None
+    except TransportError:
+        raise
+    except Exception:
+        raise WorkerError(traceback.format_exc()) from None
+
+
+def process_pool_executor(processes):
+    # Worker processes are started on demand, by which time the main process
+    # is running other threads, so they are spawned rather than forked (where
+    # supported).
+    executor_kwargs = {}
+    if sys.version_info >= (3, 7):
+        executor_kwargs['mp_context'] = multiprocessing.get_context('spawn')
+    return concurrent.futures.ProcessPoolExecutor(processes, **executor_kwargs)
+
+
+def _parse_raw_response(collector, raw_response, decoder):
+    try:
+        return collector.parse_metric_dict(json_decoder(decoder)(raw_response))
+    except Exception:
+        raise WorkerError(traceback.format_exc()) from None
+
+
+class WorkerPool(object):
+    """
+    A pool of worker processes for making Elasticsearch requests and parsing
+    the responses, so parsing can use more than one CPU core.
+
+    Each worker process creates its own Elasticsearch client from hosts and
+    client_kwargs. Functions called in the pool (and their arguments and
+    results) must be picklable.
+
+    If a circuit breaker or request budget is given, calls are made through
+    them in the main process, so they cover the requests of all the worker
+    processes. Each call counts as a single request.
+    """
+
+    def __init__(self, processes, hosts, client_kwargs, circuit_breaker=None,
+                 request_budget=None):
+        self.client_config = (hosts, client_kwargs)
+        self.circuit_breaker = circuit_breaker
+        self.request_budget = request_budget
+        self.executor = process_pool_executor(processes)
+
+    def call(self, func, *args, priority=NORMAL_PRIORITY, **kwargs):
+        """
+        Calls func in a worker process, with the process's Elasticsearch client
+        as the first argument, and waits for the result.
+
+        priority is the priority of the call's requests in the request budget.
+
+        Elasticsearch transport errors (including ConnectionTimeout errors)
+        are re-raised as they are. Other errors are raised as WorkerErrors.
+        """
+        call = functools.partial(self.submit, func, args, kwargs)
+        if self.request_budget is not None:
+            call = functools.partial(self.request_budget.call, call, priority=priority)
+        if self.circuit_breaker is not None:
+            call = functools.partial(self.circuit_breaker.call, call)
+        return call()
+
+    def submit(self, func, args, kwargs):
+        future = self.executor.submit(_call_with_client, self.client_config, func, args, kwargs)
+        return future.result()
+
+
+class ParsePool(object):
+    """
+    A pool of worker processes for decoding and parsing raw responses.
+
+    Responses are fetched in the calling thread, but decoding and parsing
+    them (the CPU heavy part for large responses) is done in another process,
+    so it doesn't hold up the main process's other threads.
+
+    Responses are decoded with the named JSON decoder (see json_decoder()).
+    """
+
+    def __init__(self, processes, decoder='auto'):
+        self.decoder = decoder
+        self.executor = process_pool_executor(processes)
+
+    def parse(self, collector, raw_response):
+        """
+        Decodes a raw JSON response and parses it with a collector in a worker
+        process, returning the collector's metric dict.
+
+        Errors are raised as WorkerErrors.
+        """
+        future = self.executor.submit(_parse_raw_response, collector, raw_response,
+                                      self.decoder)
+        return future.result()
@@ -29,7 +29,7 @@ setup(
         'Programming Language :: Python :: 3.8',
     ],
     keywords='monitoring prometheus exporter elasticsearch',
-    packages=find_packages(exclude=['tests']),
+    packages=find_packages(exclude=['benchmarks', 'tests']),
     python_requires='>=3.5',
     install_requires=[
         'click',
@@ -37,10 +37,18 @@ setup(
         'elasticsearch',
         'jog',
         'prometheus-client >= 0.6.0',
+        # The connection pool metrics read urllib3 internals.
+        'urllib3 >= 1.21.1, < 2',
     ],
+    extras_require={
+        'orjson': ['orjson'],
+        'snappy': ['python-snappy'],
+        'zstd': ['zstandard'],
+    },
     entry_points={
         'console_scripts': [
             'prometheus-es-exporter=prometheus_es_exporter:main',
+            'prometheus-es-replay=prometheus_es_exporter.replay:main',
         ],
     },
 )
@@ -0,0 +1,130 @@
+import unittest
+
+from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import ConnectionError, NotFoundError, TransportError
+from prometheus_client import CollectorRegistry
+
+from prometheus_es_exporter import ClusterHealthCollector
+from prometheus_es_exporter.circuit_breaker import (CLOSED, OPEN, HALF_OPEN,
+                                                    CircuitBreaker, CircuitOpenError)
+from prometheus_es_exporter.transport import ExporterTransport
+
+
+HEALTH_RESPONSE = {'status': 'green', 'timed_out': False, 'number_of_nodes': 3}
+
+
+def succeed():
+    return 'ok'
+
+
+def fail(error):
+    raise error
+
+
+class FakeCluster(object):
+    def __init__(self, circuit_breaker):
+        self.circuit_breaker = circuit_breaker
+        self.error = None
+
+    def health(self, level, request_timeout):
+        if self.error is not None:
+            return self.circuit_breaker.call(fail, self.error)
+        return self.circuit_breaker.call(dict, HEALTH_RESPONSE)
+
+
+class FakeClient(object):
+    def __init__(self, circuit_breaker):
+        self.cluster = FakeCluster(circuit_breaker)
+
+
+class Test(unittest.TestCase):
+    def test_open(self):
+        breaker = CircuitBreaker(failure_rate=0.4, min_requests=4, open_duration=60)
+        connection_error = ConnectionError('N/A', 'Refused.', OSError('Refused.'))
+
+        breaker.call(succeed)
+        breaker.call(succeed)
+        # Errors that don't indicate an overloaded cluster aren't failures, and
+        # errors that don't come from a request aren't counted at all.
+        with self.assertRaises(NotFoundError):
+            breaker.call(fail, NotFoundError(404, 'Not found.', {}))
+        with self.assertRaises(ValueError):
+            breaker.call(fail, ValueError('Bad value.'))
+        self.assertEqual(CLOSED, breaker.state)
+
+        with self.assertRaises(ConnectionError):
+            breaker.call(fail, connection_error)
+        # 1 of 4 requests has failed.
+        self.assertEqual(CLOSED, breaker.state)
+        with self.assertRaises(TransportError):
+            breaker.call(fail, TransportError(503, 'Unavailable.', {}))
+        # 2 of 5 requests have failed.
+        self.assertEqual(OPEN, breaker.state)
+
+        with self.assertRaises(CircuitOpenError):
+            breaker.call(succeed)
+
+    def test_half_open(self):
+        breaker = CircuitBreaker(failure_rate=1, min_requests=1, open_duration=0)
+        too_many_requests = TransportError(429, 'Too many requests.', {})
+
+        with self.assertRaises(TransportError):
+            breaker.call(fail, too_many_requests)
+        self.assertEqual(OPEN, breaker.state)
+
+        # Only one probe is let through at a time.
+        self.assertTrue(breaker.before_request())
+        self.assertEqual(HALF_OPEN, breaker.state)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+
+        # A failed probe opens the breaker again.
+        breaker.after_request(True, True)
+        self.assertEqual(OPEN, breaker.state)
+
+        # A successful probe closes it.
+        self.assertEqual('ok', breaker.call(succeed))
+        self.assertEqual(CLOSED, breaker.state)
+        self.assertEqual('ok', breaker.call(succeed))
+
+    def test_transport(self):
+        breaker = CircuitBreaker(failure_rate=1, min_requests=2, open_duration=60)
+        # Nothing should be listening on this port.
+        es_client = Elasticsearch(['localhost:1'], transport_class=ExporterTransport,
+                                  circuit_breaker=breaker, max_retries=2)
+
+        # Retries of a request count as a single failure.
+        with self.assertRaises(ConnectionError):
+            es_client.cluster.health()
+        self.assertEqual(CLOSED, breaker.state)
+        with self.assertRaises(ConnectionError):
+            es_client.cluster.health()
+        self.assertEqual(OPEN, breaker.state)
+
+        with self.assertRaises(CircuitOpenError):
+            es_client.cluster.health()
+
+    def test_serve_stale(self):
+        breaker = CircuitBreaker(failure_rate=0.25, min_requests=1, open_duration=60)
+        client = FakeClient(breaker)
+        registry = CollectorRegistry()
+        registry.register(ClusterHealthCollector(client, 10, 'cluster', serve_stale=True))
+
+        self.assertEqual(3, registry.get_sample_value('es_cluster_health_number_of_nodes'))
+        self.assertEqual(1, registry.get_sample_value('es_cluster_health_up'))
+        last_success = registry.get_sample_value('es_cluster_health_last_success_timestamp_seconds')
+        self.assertIsNotNone(last_success)
+
+        client.cluster.error = ConnectionError('N/A', 'Refused.', OSError('Refused.'))
+        self.assertIsNone(registry.get_sample_value('es_cluster_health_number_of_nodes'))
+        self.assertEqual(OPEN, breaker.state)
+
+        # The last metrics are served while the breaker is open.
+        self.assertEqual(3, registry.get_sample_value('es_cluster_health_number_of_nodes'))
+        self.assertEqual(0, registry.get_sample_value('es_cluster_health_up'))
+        self.assertEqual(last_success,
+                         registry.get_sample_value('es_cluster_health_last_success_timestamp_seconds'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -163,6 +163,71 @@ class Test(unittest.TestCase):
         result = convert_result(parse_response(response))
         self.assertEqual(expected, result)
 
+    def test_endpoint_aggregate_shards(self):
+        # Endpoint: /_cluster/health?pretty&level=shards
+        response = {
+            'cluster_name': 'elasticsearch',
+            'status': 'red',
+            'timed_out': False,
+            'number_of_nodes': 1,
+            'active_primary_shards': 2,
+            'active_shards': 3,
+            'unassigned_shards': 3,
+            'indices': {
+                'foo': {
+                    'status': 'red',
+                    'number_of_shards': 3,
+                    'active_primary_shards': 2,
+                    'active_shards': 3,
+                    'unassigned_shards': 3,
+                    'shards': {
+                        '0': {
+                            'status': 'green',
+                            'primary_active': True,
+                            'active_shards': 2,
+                            'unassigned_shards': 0
+                        },
+                        '1': {
+                            'status': 'yellow',
+                            'primary_active': True,
+                            'active_shards': 1,
+                            'unassigned_shards': 1
+                        },
+                        '2': {
+                            'status': 'red',
+                            'primary_active': False,
+                            'active_shards': 0,
+                            'unassigned_shards': 2
+                        }
+                    }
+                }
+            }
+        }
+
+        expected = {
+            'status': 2,
+            'status_green': 0,
+            'status_yellow': 0,
+            'status_red': 1,
+            'number_of_nodes': 1,
+            'active_primary_shards': 2,
+            'active_shards': 3,
+            'unassigned_shards': 3,
+            'indices_status{index="foo"}': 2,
+            'indices_status_green{index="foo"}': 0,
+            'indices_status_yellow{index="foo"}': 0,
+            'indices_status_red{index="foo"}': 1,
+            'indices_number_of_shards{index="foo"}': 3,
+            'indices_active_primary_shards{index="foo"}': 2,
+            'indices_active_shards{index="foo"}': 3,
+            'indices_unassigned_shards{index="foo"}': 3,
+            'indices_shards_status_count{index="foo",status="green"}': 1,
+            'indices_shards_status_count{index="foo",status="yellow"}': 1,
+            'indices_shards_status_count{index="foo",status="red"}': 1,
+        }
+        result = convert_result(parse_response(response, aggregate_shards=True))
+        self.assertEqual(expected, result)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,85 @@
+import gzip
+import io
+import unittest
+import zlib
+
+from prometheus_es_exporter.compression import (CompressedCache, Encoder, GZIP, IDENTITY, ZSTD,
+                                                choose_encoding, compress_segment, crc32_combine,
+                                                zstandard)
+
+
+class Test(unittest.TestCase):
+    maxDiff = None
+
+    def test_crc32_combine(self):
+        data1 = b'foo bar baz' * 100
+        data2 = b'qux' * 1000
+
+        expected = zlib.crc32(data1 + data2)
+        result = crc32_combine(zlib.crc32(data1), zlib.crc32(data2), len(data2))
+        self.assertEqual(expected, result)
+
+    def test_choose_encoding(self):
+        self.assertEqual(GZIP, choose_encoding('gzip'))
+        self.assertEqual(GZIP, choose_encoding('deflate, gzip;q=0.5'))
+        self.assertEqual(IDENTITY, choose_encoding('gzip;q=0'))
+        self.assertEqual(IDENTITY, choose_encoding(''))
+
+    def test_gzip_segments(self):
+        cached = compress_segment([b'cached ', b'data '], GZIP)
+
+        encoder = Encoder(GZIP)
+        compressed = b''.join([
+            encoder.start(),
+            encoder.compress(b'live data '),
+            encoder.add_segment(cached),
+            encoder.compress(b'more live data'),
+            encoder.finish(),
+        ])
+
+        expected = b'live data cached data more live data'
+        self.assertEqual(expected, gzip.decompress(compressed))
+        # The segments are joined into a single gzip member.
+        self.assertEqual(expected, zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(compressed))
+
+    def test_gzip_empty(self):
+        encoder = Encoder(GZIP)
+        compressed = encoder.start() + encoder.finish()
+        self.assertEqual(b'', gzip.decompress(compressed))
+
+    @unittest.skipIf(zstandard is None, 'zstandard not installed')
+    def test_zstd_segments(self):
+        cached = compress_segment([b'cached ', b'data '], ZSTD)
+
+        encoder = Encoder(ZSTD)
+        compressed = b''.join([
+            encoder.start(),
+            encoder.compress(b'live data '),
+            encoder.add_segment(cached),
+            encoder.finish(),
+        ])
+
+        # Each segment is a separate frame, which are read as a single stream.
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(compressed),
+                                                            read_across_frames=True)
+        self.assertEqual(b'live data cached data ', reader.read())
+
+    def test_cache(self):
+        cache = CompressedCache()
+        calls = []
+
+        def chunks_func():
+            calls.append(1)
+            return [b'data']
+
+        first = cache.get('key', GZIP, 1, chunks_func)
+        second = cache.get('key', GZIP, 1, chunks_func)
+        self.assertIs(first, second)
+        self.assertEqual(1, len(calls))
+
+        cache.get('key', GZIP, 2, chunks_func)
+        self.assertEqual(2, len(calls))
+
+
+if __name__ == '__main__':
+    unittest.main()
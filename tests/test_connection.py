@@ -0,0 +1,76 @@
+import gzip
+import http.server
+import json
+import threading
+import unittest
+
+from elasticsearch import Elasticsearch
+from prometheus_client import CollectorRegistry
+
+from prometheus_es_exporter.connection import (CONNECTION_METRICS, ExporterConnection,
+                                               last_response_size)
+
+# Non-ASCII, so its size in bytes and characters differ.
+RESPONSE = json.dumps({'value': '\u00e9' * 10000}, ensure_ascii=False).encode('utf-8')
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(RESPONSE)
+        else:
+            body = RESPONSE
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if body is not RESPONSE:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.host = '127.0.0.1:{}'.format(self.server.server_port)
+
+        self.registry = CollectorRegistry()
+        for metric in CONNECTION_METRICS:
+            self.registry.register(metric)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def response_bytes(self):
+        labels = {'node': 'http://' + self.host}
+        return (self.registry.get_sample_value('es_client_response_bytes_received_total', labels) or 0,
+                self.registry.get_sample_value('es_client_response_bytes_decoded_total', labels) or 0)
+
+    def test_uncompressed(self):
+        es_client = Elasticsearch([self.host], connection_class=ExporterConnection)
+        received, decoded = self.response_bytes()
+
+        self.assertEqual('\u00e9' * 10000, es_client.transport.perform_request('GET', '/')['value'])
+        self.assertEqual((received + len(RESPONSE), decoded + len(RESPONSE)), self.response_bytes())
+        self.assertEqual(len(RESPONSE), last_response_size())
+
+    def test_compressed(self):
+        es_client = Elasticsearch([self.host], connection_class=ExporterConnection,
+                                  http_compress=True)
+        received, decoded = self.response_bytes()
+
+        self.assertEqual('\u00e9' * 10000, es_client.transport.perform_request('GET', '/')['value'])
+        self.assertEqual(len(RESPONSE), last_response_size())
+        new_received, new_decoded = self.response_bytes()
+        self.assertEqual(decoded + len(RESPONSE), new_decoded)
+        self.assertEqual(received + len(gzip.compress(RESPONSE)), new_received)
+
+
+if __name__ == '__main__':
+    unittest.main()
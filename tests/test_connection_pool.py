@@ -0,0 +1,68 @@
+import queue
+import unittest
+
+from elasticsearch import Elasticsearch
+from prometheus_client import CollectorRegistry
+
+from prometheus_es_exporter import ConnectionPoolCollector
+
+
+class FakePool(object):
+    """
+    A connection pool without urllib3's usage stats.
+    """
+
+    def __init__(self):
+        self.pool = queue.LifoQueue(4)
+
+
+class FakeConnection(object):
+    def __init__(self, host):
+        self.host = host
+        self.pool = FakePool()
+
+
+class Test(unittest.TestCase):
+    def test_collect(self):
+        es_client = Elasticsearch(['localhost:9200', 'localhost:9201'], maxsize=4)
+        pool = next(connection.pool
+                    for connection in es_client.transport.connection_pool.connections
+                    if connection.host == 'http://localhost:9200')
+
+        # Take a connection from the pool, without connecting it.
+        conn = pool._get_conn()
+        pool.num_requests += 1
+
+        registry = CollectorRegistry()
+        registry.register(ConnectionPoolCollector(es_client))
+
+        labels = {'node': 'http://localhost:9200'}
+        self.assertEqual(4, registry.get_sample_value('es_client_pool_maxsize', labels))
+        self.assertEqual(1, registry.get_sample_value('es_client_pool_connections_in_use', labels))
+        self.assertEqual(0, registry.get_sample_value('es_client_pool_connections_idle', labels))
+        self.assertEqual(1, registry.get_sample_value('es_client_pool_connections_opened_total', labels))
+        self.assertEqual(1, registry.get_sample_value('es_client_pool_requests_total', labels))
+
+        pool._put_conn(conn)
+        self.assertEqual(0, registry.get_sample_value('es_client_pool_connections_in_use', labels))
+        self.assertEqual(1, registry.get_sample_value('es_client_pool_connections_idle', labels))
+
+        labels = {'node': 'http://localhost:9201'}
+        self.assertEqual(0, registry.get_sample_value('es_client_pool_connections_in_use', labels))
+
+    def test_missing_stats(self):
+        es_client = Elasticsearch(['localhost:9200', 'localhost:9201'])
+        es_client.transport.connection_pool.connections.append(FakeConnection('http://localhost:9202'))
+
+        registry = CollectorRegistry()
+        registry.register(ConnectionPoolCollector(es_client))
+
+        # The pool without stats is skipped.
+        self.assertEqual(10, registry.get_sample_value('es_client_pool_maxsize',
+                                                       {'node': 'http://localhost:9200'}))
+        self.assertIsNone(registry.get_sample_value('es_client_pool_maxsize',
+                                                    {'node': 'http://localhost:9202'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
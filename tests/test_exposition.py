@@ -0,0 +1,149 @@
+import unittest
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.openmetrics import exposition as openmetrics
+
+from prometheus_es_exporter.exposition import (
+    OPENMETRICS, PROTOBUF, TEXT, buffer_chunks, choose_format, generate, generate_text
+)
+from prometheus_es_exporter.metrics import gauge_generator
+from tests.utils import decode_delimited, decode_message
+
+
+class MetricDictCollector(object):
+    def __init__(self, metric_dict):
+        self.metric_dict = metric_dict
+
+    def collect(self):
+        yield from gauge_generator(self.metric_dict)
+
+
+class GaugeFamilyCollector(object):
+    def __init__(self, metric_dict):
+        self.metric_dict = metric_dict
+
+    def collect(self):
+        for metric_name, (metric_doc, label_keys, value_dict) in self.metric_dict.items():
+            gauge = GaugeMetricFamily(metric_name, metric_doc, labels=label_keys)
+            for label_values, value in sorted(value_dict.items()):
+                gauge.add_metric(label_values, value)
+            yield gauge
+
+
+METRIC_DICT = {
+    'es_foo': ('A "foo" metric.', ('z', 'a'), {
+        ('1', 'x\ny'): 1,
+        ('2', 'b'): 2.5,
+    }),
+    'es_bar': ('A bar metric.', (), {(): 3}),
+}
+
+
+class Test(unittest.TestCase):
+    maxDiff = None
+
+    def test_generate_text(self):
+        registry = CollectorRegistry()
+        gauge = Gauge('foo', 'A gauge\nwith "special" \\ chars.', ['bar'], registry=registry)
+        gauge.labels('a\nb"c\\d').set(1.5)
+        gauge.labels('e').set(float('inf'))
+        counter = Counter('baz', 'A counter.', registry=registry)
+        counter.inc(3)
+        histogram = Histogram('qux_seconds', 'A histogram.', ['bar'], registry=registry)
+        histogram.labels('a').observe(0.3)
+
+        expected = generate_latest(registry)
+        result = b''.join(generate_text(registry))
+        self.assertEqual(expected, result)
+
+    def test_generate_metric_dict_text(self):
+        expected = generate_latest(GaugeFamilyCollector(METRIC_DICT))
+        result = b''.join(generate(MetricDictCollector(METRIC_DICT), TEXT))
+        self.assertEqual(expected, result)
+
+    def test_generate_openmetrics(self):
+        registry = CollectorRegistry()
+        gauge = Gauge('foo', 'A gauge\nwith "special" \\ chars.', ['bar'], registry=registry)
+        gauge.labels('a\nb"c\\d').set(1.5)
+        counter = Counter('baz', 'A counter.', registry=registry)
+        counter.inc(3)
+        histogram = Histogram('qux_seconds', 'A histogram.', ['bar'], unit='seconds',
+                              registry=registry)
+        histogram.labels('a').observe(0.3)
+
+        expected = openmetrics.generate_latest(registry)
+        result = b''.join(generate(registry, OPENMETRICS))
+        self.assertEqual(expected, result)
+
+        expected = openmetrics.generate_latest(GaugeFamilyCollector(METRIC_DICT))
+        result = b''.join(generate(MetricDictCollector(METRIC_DICT), OPENMETRICS))
+        self.assertEqual(expected, result)
+
+    def test_generate_protobuf_metric_dict(self):
+        result = b''.join(generate(MetricDictCollector(METRIC_DICT), PROTOBUF))
+        families = decode_delimited(result)
+
+        self.assertEqual([[b'es_foo'], [b'es_bar']], [family[1] for family in families])
+        self.assertEqual([b'A "foo" metric.'], families[0][2])
+        # Gauge type.
+        self.assertEqual([1], families[0][3])
+
+        metrics = [decode_message(metric) for metric in families[0][4]]
+        self.assertEqual(2, len(metrics))
+        labels = [decode_message(label) for label in metrics[0][1]]
+        self.assertEqual([{1: [b'a'], 2: [b'x\ny']}, {1: [b'z'], 2: [b'1']}], labels)
+        self.assertEqual({1: [1.0]}, decode_message(metrics[0][2][0]))
+        self.assertEqual({1: [2.5]}, decode_message(metrics[1][2][0]))
+
+        metrics = [decode_message(metric) for metric in families[1][4]]
+        self.assertEqual(1, len(metrics))
+        self.assertEqual([2], list(metrics[0].keys()))
+        self.assertEqual({1: [3.0]}, decode_message(metrics[0][2][0]))
+
+    def test_generate_protobuf_histogram(self):
+        registry = CollectorRegistry()
+        histogram = Histogram('qux_seconds', 'A histogram.', ['bar'],
+                              buckets=(0.1, 1.0), registry=registry)
+        histogram.labels('a').observe(0.3)
+        histogram.labels('a').observe(3)
+
+        families = decode_delimited(b''.join(generate(registry, PROTOBUF)))
+        # Histogram type, with the OpenMetrics created sample as an untyped family.
+        self.assertEqual([([b'qux_seconds'], [4]), ([b'qux_seconds_created'], [3])],
+                         [(family[1], family[3]) for family in families])
+
+        metric = decode_message(families[0][4][0])
+        self.assertEqual([{1: [b'bar'], 2: [b'a']}], [decode_message(label) for label in metric[1]])
+        histogram = decode_message(metric[7][0])
+        self.assertEqual([2], histogram[1])
+        self.assertEqual([3.3], histogram[2])
+        self.assertEqual([{1: [0], 2: [0.1]}, {1: [1], 2: [1.0]}],
+                         [decode_message(bucket) for bucket in histogram[3]])
+
+    def test_choose_format(self):
+        self.assertEqual(TEXT, choose_format(''))
+        self.assertEqual(TEXT, choose_format('text/plain;version=0.0.4;q=0.5,*/*;q=0.1'))
+        self.assertEqual(OPENMETRICS, choose_format(
+            'application/openmetrics-text;version=1.0.0,text/plain;version=0.0.4;q=0.5'))
+        self.assertEqual(PROTOBUF, choose_format(
+            'application/vnd.google.protobuf;proto=io.prometheus.client.MetricFamily;'
+            'encoding=delimited;q=0.7,text/plain;version=0.0.4;q=0.3,*/*;q=0.1'))
+        # Text is preferred if the client prefers it.
+        self.assertEqual(TEXT, choose_format(
+            'application/vnd.google.protobuf;proto=io.prometheus.client.MetricFamily;'
+            'encoding=delimited;q=0.2,text/plain'))
+        # Unsupported protobuf encodings aren't used.
+        self.assertEqual(TEXT, choose_format(
+            'application/vnd.google.protobuf;proto=io.prometheus.client.MetricFamily;encoding=text'))
+
+    def test_buffer_chunks(self):
+        chunks = [b'a', b'bc', b'def', b'g']
+
+        expected = [b'abc', b'def', b'g']
+        result = list(buffer_chunks(chunks, buffer_size=3))
+        self.assertEqual(expected, result)
+
+
+if __name__ == '__main__':
+    unittest.main()
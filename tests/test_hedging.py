@@ -0,0 +1,188 @@
+import http.server
+import json
+import socketserver
+import threading
+import time
+import unittest
+
+from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import ConnectionTimeout
+from prometheus_client import CollectorRegistry
+
+from prometheus_es_exporter.hedging import HEDGING_METRICS, Hedger, is_read_only
+from prometheus_es_exporter.request_budget import RequestBudget
+from prometheus_es_exporter.serializer import ExporterSerializer, raw_responses
+from prometheus_es_exporter.transport import ExporterTransport
+
+
+class Node(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, delay):
+        super().__init__(('127.0.0.1', 0), NodeHandler)
+        self.delay = delay
+        self.requests = 0
+
+
+class NodeHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests += 1
+        time.sleep(self.server.delay)
+
+        body = json.dumps({'status': 'green', 'port': self.server.server_port}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Test(unittest.TestCase):
+    def test_is_read_only(self):
+        self.assertTrue(is_read_only('GET', '/_cluster/health'))
+        self.assertTrue(is_read_only('POST', '/foo/_search'))
+        self.assertFalse(is_read_only('POST', '/foo/_doc'))
+        self.assertFalse(is_read_only('PUT', '/foo'))
+
+    def test_hedger(self):
+        hedger = Hedger(percentile=90, max_extra=0.5, min_samples=10)
+        endpoint = ('GET', '/_cluster/health')
+
+        for i in range(9):
+            hedger.record(endpoint, i / 100)
+        self.assertIsNone(hedger.delay(endpoint))
+        hedger.record(endpoint, 0.09)
+        self.assertEqual(0.09, hedger.delay(endpoint))
+        self.assertIsNone(hedger.delay(('GET', '/_nodes/stats')))
+
+        # 3 requests have earned 1.5 hedges.
+        self.assertTrue(hedger.spend())
+        self.assertFalse(hedger.spend())
+
+    def test_transport(self):
+        slow_node = Node(1)
+        fast_node = Node(0)
+        for node in (slow_node, fast_node):
+            threading.Thread(target=node.serve_forever, daemon=True).start()
+
+        try:
+            es_client = Elasticsearch(['127.0.0.1:{}'.format(slow_node.server_port),
+                                       '127.0.0.1:{}'.format(fast_node.server_port)],
+                                      transport_class=ExporterTransport,
+                                      hedge_percentile=50, hedge_max_extra=1)
+            hedger = es_client.transport.hedger
+            for _ in range(hedger.min_samples):
+                hedger.record(('GET', '/_cluster/health'), 0.05)
+
+            # Requests to the slow node are hedged to the fast node.
+            for _ in range(4):
+                start_time = time.monotonic()
+                response = es_client.cluster.health()
+                self.assertLess(time.monotonic() - start_time, 0.5)
+                self.assertEqual(fast_node.server_port, response['port'])
+
+            self.assertEqual(4, fast_node.requests)
+            self.assertGreater(slow_node.requests, 0)
+
+        finally:
+            for node in (slow_node, fast_node):
+                node.shutdown()
+                node.server_close()
+
+    def test_raw_responses(self):
+        nodes = [Node(0), Node(0)]
+        for node in nodes:
+            threading.Thread(target=node.serve_forever, daemon=True).start()
+
+        try:
+            es_client = Elasticsearch(['127.0.0.1:{}'.format(node.server_port) for node in nodes],
+                                      transport_class=ExporterTransport,
+                                      serializer=ExporterSerializer(),
+                                      hedge_percentile=0, hedge_max_extra=1)
+            hedger = es_client.transport.hedger
+            for _ in range(hedger.min_samples):
+                hedger.record(('GET', '/_cluster/health'), 0)
+
+            # Hedged attempts are made in other threads, but still leave the
+            # response undecoded.
+            with raw_responses():
+                response = es_client.cluster.health()
+            self.assertIsInstance(response, str)
+            self.assertEqual('green', json.loads(response)['status'])
+            self.assertIsInstance(es_client.cluster.health(), dict)
+
+        finally:
+            for node in nodes:
+                node.shutdown()
+                node.server_close()
+
+    def test_timeout(self):
+        nodes = [Node(1), Node(1)]
+        for node in nodes:
+            threading.Thread(target=node.serve_forever, daemon=True).start()
+
+        try:
+            es_client = Elasticsearch(['127.0.0.1:{}'.format(node.server_port) for node in nodes],
+                                      transport_class=ExporterTransport,
+                                      hedge_percentile=50, hedge_max_extra=1)
+            hedger = es_client.transport.hedger
+            for _ in range(hedger.min_samples):
+                hedger.record(('GET', '/_cluster/health'), 0.3)
+
+            # The hedge is sent after 0.3s, and times out with the original
+            # request, rather than getting a timeout of its own.
+            start_time = time.monotonic()
+            with self.assertRaises(ConnectionTimeout):
+                es_client.cluster.health(request_timeout=0.5)
+            self.assertLess(time.monotonic() - start_time, 0.7)
+            self.assertEqual(2, sum(node.requests for node in nodes))
+
+        finally:
+            for node in nodes:
+                node.shutdown()
+                node.server_close()
+
+    def test_request_budget(self):
+        slow_node = Node(0.5)
+        fast_node = Node(0)
+        for node in (slow_node, fast_node):
+            threading.Thread(target=node.serve_forever, daemon=True).start()
+
+        registry = CollectorRegistry()
+        for metric in HEDGING_METRICS:
+            registry.register(metric)
+        throttled = registry.get_sample_value('es_client_hedges_throttled_total')
+
+        try:
+            budget = RequestBudget(max_in_flight=1)
+            es_client = Elasticsearch(['127.0.0.1:{}'.format(slow_node.server_port),
+                                       '127.0.0.1:{}'.format(fast_node.server_port)],
+                                      transport_class=ExporterTransport, request_budget=budget,
+                                      hedge_percentile=50, hedge_max_extra=1)
+            hedger = es_client.transport.hedger
+            for _ in range(hedger.min_samples):
+                hedger.record(('GET', '/_cluster/health'), 0.05)
+
+            # The original request to the slow node uses up the budget, so
+            # it isn't hedged.
+            for _ in range(2):
+                response = es_client.cluster.health()
+                if response['port'] == slow_node.server_port:
+                    break
+            self.assertEqual(slow_node.server_port, response['port'])
+            self.assertEqual(throttled + 1, registry.get_sample_value('es_client_hedges_throttled_total'))
+            self.assertEqual(0, budget.in_flight)
+
+        finally:
+            for node in (slow_node, fast_node):
+                node.shutdown()
+                node.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+
+from prometheus_es_exporter.indices_cat_parser import column_paths, parse_response
+from tests.utils import convert_result
+
+
+class Test(unittest.TestCase):
+    maxDiff = None
+
+    columns = column_paths(['docs', 'store', 'search'])
+
+    # Endpoint: /_cat/indices?format=json&bytes=b&time=ms&pri=true&h=index,docs.count,...
+    # (truncated to a few columns)
+    response = [
+        {
+            'index': 'foo',
+            'docs.count': '3',
+            'docs.deleted': '0',
+            'store.size': '25380',
+            'pri.store.size': '12690',
+            'search.query_total': '12',
+            'pri.search.query_total': '6',
+            'search.query_time': '40',
+            'pri.search.query_time': '20',
+        },
+        {
+            'index': 'bar',
+            'docs.count': '5',
+            'docs.deleted': '1',
+            'store.size': '10000',
+            'pri.store.size': '5000',
+            'search.query_total': '2',
+            'pri.search.query_total': '1',
+            'search.query_time': '4',
+            'pri.search.query_time': '2',
+        },
+        # Closed indices have no stats.
+        {
+            'index': 'closed',
+            'docs.count': None,
+            'docs.deleted': None,
+            'store.size': None,
+            'pri.store.size': None,
+        },
+    ]
+
+    def test_columns(self):
+        self.assertEqual(['primaries', 'docs', 'count'], self.columns['docs.count'])
+        self.assertEqual(['total', 'store', 'size_in_bytes'], self.columns['store.size'])
+        self.assertEqual(['primaries', 'store', 'size_in_bytes'], self.columns['pri.store.size'])
+        self.assertNotIn('indexing.index_total', self.columns)
+        self.assertNotIn('pri.docs.count', self.columns)
+
+        self.assertIn('indexing.index_total', column_paths())
+
+    def test_cluster(self):
+        expected = {
+            'primaries_docs_count{index="_all"}': 8,
+            'primaries_docs_deleted{index="_all"}': 1,
+            'total_store_size_in_bytes{index="_all"}': 35380,
+            'primaries_store_size_in_bytes{index="_all"}': 17690,
+            'total_search_query_total{index="_all"}': 14,
+            'primaries_search_query_total{index="_all"}': 7,
+            'total_search_query_time_in_millis{index="_all"}': 44,
+            'primaries_search_query_time_in_millis{index="_all"}': 22,
+        }
+        result = convert_result(parse_response(self.response, self.columns))
+        self.assertEqual(expected, result)
+
+    def test_indices(self):
+        expected = {
+            'primaries_docs_count{index="foo"}': 3,
+            'primaries_docs_deleted{index="foo"}': 0,
+            'total_store_size_in_bytes{index="foo"}': 25380,
+            'primaries_store_size_in_bytes{index="foo"}': 12690,
+            'total_search_query_total{index="foo"}': 12,
+            'primaries_search_query_total{index="foo"}': 6,
+            'total_search_query_time_in_millis{index="foo"}': 40,
+            'primaries_search_query_time_in_millis{index="foo"}': 20,
+            'primaries_docs_count{index="bar"}': 5,
+            'primaries_docs_deleted{index="bar"}': 1,
+            'total_store_size_in_bytes{index="bar"}': 10000,
+            'primaries_store_size_in_bytes{index="bar"}': 5000,
+            'total_search_query_total{index="bar"}': 2,
+            'primaries_search_query_total{index="bar"}': 1,
+            'total_search_query_time_in_millis{index="bar"}': 4,
+            'primaries_search_query_time_in_millis{index="bar"}': 2,
+        }
+        result = convert_result(parse_response(self.response, self.columns, parse_indices=True))
+        self.assertEqual(expected, result)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,6 @@
 import unittest
 
-from prometheus_es_exporter.metrics import merge_metric_dicts
+from prometheus_es_exporter.metrics import merge_metric_dicts, add_metric_dicts, subtract_metric_dicts
 from tests.utils import convert_metric_dict
 
 
@@ -149,6 +149,48 @@ class Test(unittest.TestCase):
         result = convert_metric_dict(merge_metric_dicts(old_dict, new_dict, zero_missing=True))
         self.assertEqual(expected, result)
 
+    def test_add(self):
+        old_dict = {
+            'foo': ('test docstring', ('bar', 'baz'), {('a', 'b'): 1, ('a', 'c'): 2}),
+            'took': ('took docstring', (), {(): 5}),
+        }
+        new_dict = {
+            'foo': ('test docstring', ('bar', 'baz'), {('a', 'b'): 3, ('a', 'd'): 4}),
+            'other': ('other docstring', (), {(): 2}),
+            'took': ('took docstring', (), {(): 3}),
+        }
+
+        expected = {
+            'foo{bar="a",baz="b"}': 4,
+            'foo{bar="a",baz="c"}': 2,
+            'foo{bar="a",baz="d"}': 4,
+            'other': 2,
+            'took': 3,
+        }
+        result = convert_metric_dict(add_metric_dicts(old_dict, new_dict,
+                                                      replace_metric_names=('took',)))
+        self.assertEqual(expected, result)
+
+    def test_subtract(self):
+        old_dict = {
+            'foo': ('test docstring', ('bar', 'baz'), {('a', 'b'): 4, ('a', 'c'): 2}),
+            'took': ('took docstring', (), {(): 5}),
+        }
+        new_dict = {
+            'foo': ('test docstring', ('bar', 'baz'), {('a', 'b'): 3, ('a', 'd'): 4}),
+            'other': ('other docstring', (), {(): 2}),
+            'took': ('took docstring', (), {(): 3}),
+        }
+
+        expected = {
+            'foo{bar="a",baz="b"}': 1,
+            'foo{bar="a",baz="c"}': 2,
+            'took': 5,
+        }
+        result = convert_metric_dict(subtract_metric_dicts(old_dict, new_dict,
+                                                           keep_metric_names=('took',)))
+        self.assertEqual(expected, result)
+
 
 if __name__ == '__main__':
     unittest.main()
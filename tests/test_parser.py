@@ -1,6 +1,8 @@
 import unittest
 
-from prometheus_es_exporter.parser import parse_response
+from prometheus_es_exporter.parser import (parse_response, add_range_filter, composite_after_keys,
+                                           composite_next_page_query, relative_range_fields, remove_sliding_window,
+                                           set_composite_page_size)
 from tests.utils import convert_result
 
 
@@ -1013,6 +1015,188 @@ class Test(unittest.TestCase):
         result = convert_result(parse_response(response))
         self.assertEqual(expected, result)
 
+    def test_composite_paging(self):
+        query = {
+            "size": 0,
+            "query": {
+                "match_all": {}
+            },
+            "aggs": {
+                "group_comp": {
+                    "composite": {
+                        "sources": [
+                            {"group1": {"terms": {"field": "group1"}}}
+                        ]
+                    }
+                },
+                "val_sum": {
+                    "sum": {"field": "val"}
+                }
+            }
+        }
+        query = set_composite_page_size(query, 2)
+        response = {
+            "aggregations": {
+                "group_comp": {
+                    "after_key": {
+                        "group1": "b"
+                    },
+                    "buckets": [
+                        {
+                            "doc_count": 2,
+                            "key": {
+                                "group1": "a"
+                            }
+                        },
+                        {
+                            "doc_count": 1,
+                            "key": {
+                                "group1": "b"
+                            }
+                        }
+                    ]
+                },
+                "val_sum": {
+                    "value": 6.0
+                }
+            },
+            "timed_out": False
+        }
+
+        after_keys = composite_after_keys(query, response)
+        self.assertEqual({'group_comp': {'group1': 'b'}}, after_keys)
+
+        expected = {
+            "size": 0,
+            "query": {
+                "match_all": {}
+            },
+            "aggs": {
+                "group_comp": {
+                    "composite": {
+                        "size": 2,
+                        "after": {"group1": "b"},
+                        "sources": [
+                            {"group1": {"terms": {"field": "group1"}}}
+                        ]
+                    }
+                }
+            }
+        }
+        self.assertEqual(expected, composite_next_page_query(query, after_keys))
+
+    # A page with fewer buckets than the page size is the last page,
+    # even if it has an `after_key`.
+    def test_composite_paging_last_page(self):
+        query = {
+            "size": 0,
+            "aggs": {
+                "group_comp": {
+                    "composite": {
+                        "size": 2,
+                        "sources": [
+                            {"group1": {"terms": {"field": "group1"}}}
+                        ]
+                    }
+                }
+            }
+        }
+        response = {
+            "aggregations": {
+                "group_comp": {
+                    "after_key": {
+                        "group1": "c"
+                    },
+                    "buckets": [
+                        {
+                            "doc_count": 1,
+                            "key": {
+                                "group1": "c"
+                            }
+                        }
+                    ]
+                }
+            },
+            "timed_out": False
+        }
+
+        self.assertEqual({}, composite_after_keys(query, response))
+
+    def test_add_range_filter(self):
+        query = {
+            "size": 0,
+            "query": {
+                "term": {"group1": "a"}
+            }
+        }
+
+        expected = {
+            "size": 0,
+            "query": {
+                "bool": {
+                    "must": [{"term": {"group1": "a"}}],
+                    "filter": [{"range": {"@timestamp": {
+                        "format": "epoch_millis",
+                        "gte": 1000,
+                        "lt": 2000
+                    }}}]
+                }
+            }
+        }
+        self.assertEqual(expected, add_range_filter(query, '@timestamp', gte=1000, lt=2000))
+        # The original query is unchanged.
+        self.assertEqual({"term": {"group1": "a"}}, query['query'])
+
+    def test_relative_range_fields(self):
+        query = {
+            "size": 0,
+            "query": {
+                "bool": {
+                    "filter": [
+                        {"range": {"@timestamp": {"gte": "now-1d/d"}}},
+                        {"range": {"created": {"gte": "2020-01-01", "lt": "2020-02-01"}}},
+                        {"range": {"val": {"gt": 10}}}
+                    ]
+                }
+            },
+            "aggs": {
+                "recent": {
+                    "filter": {"range": {"updated": {"from": "now-1h", "to": None}}}
+                }
+            }
+        }
+        self.assertEqual({'@timestamp', 'updated'}, relative_range_fields(query))
+        self.assertEqual(set(), relative_range_fields({"size": 0, "query": {"match_all": {}}}))
+
+    def test_remove_sliding_window(self):
+        query = {
+            "size": 0,
+            "query": {
+                "bool": {
+                    "must": {"term": {"group1": "a"}},
+                    "filter": [{"range": {"@timestamp": {"gte": "now-2h", "lt": "now"}}}]
+                }
+            }
+        }
+        expected = {
+            "size": 0,
+            "query": {
+                "bool": {
+                    "must": {"term": {"group1": "a"}},
+                    "filter": [{"match_all": {}}]
+                }
+            }
+        }
+        self.assertEqual((expected, 2 * 60 * 60 * 1000), remove_sliding_window(query, '@timestamp'))
+        # The original query is unchanged.
+        self.assertEqual({"gte": "now-2h", "lt": "now"}, query['query']['bool']['filter'][0]['range']['@timestamp'])
+
+        for bounds in ({"gte": "now-2h", "lt": "now-1h"}, {"gt": "now-2h"}, {"gte": "now-1d/d"}):
+            query = {"query": {"range": {"@timestamp": bounds}}}
+            self.assertEqual((query, None), remove_sliding_window(query, '@timestamp'))
+        query = {"query": {"range": {"updated": {"gte": "now-2h"}}}}
+        self.assertEqual((query, None), remove_sliding_window(query, '@timestamp'))
+
 
 if __name__ == '__main__':
     unittest.main()
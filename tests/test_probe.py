@@ -0,0 +1,99 @@
+import http.client
+import unittest
+
+from prometheus_client import CollectorRegistry
+from prometheus_client.core import GaugeMetricFamily
+
+from prometheus_es_exporter.probe import Prober, ProbeTargetError
+from prometheus_es_exporter.server import start_http_server
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClient(object):
+    def __init__(self, target):
+        self.target = target
+        self.transport = FakeTransport()
+
+
+class TargetCollector(object):
+    def __init__(self, es_client):
+        self.es_client = es_client
+
+    def collect(self):
+        yield GaugeMetricFamily('target_' + self.es_client.target, 'The target.', value=1)
+
+
+class Test(unittest.TestCase):
+    def test_client_cache(self):
+        prober = Prober(FakeClient, lambda es_client: [], ['a', 'b', 'c'], max_clients=2)
+
+        a = prober.client('a')
+        b = prober.client('b')
+        self.assertIs(a, prober.client('a'))
+
+        # b is the least recently used client, so is closed when c is added.
+        c = prober.client('c')
+        self.assertTrue(b.transport.closed)
+        self.assertFalse(a.transport.closed)
+        self.assertFalse(c.transport.closed)
+        self.assertIsNot(b, prober.client('b'))
+
+    def test_registry(self):
+        prober = Prober(FakeClient, lambda es_client: [TargetCollector(es_client)], ['a'])
+
+        registry = prober.registry('a')
+        self.assertEqual(1, registry.get_sample_value('target_a'))
+        self.assertIsNone(registry.get_sample_value('target_b'))
+
+    def test_target_not_allowed(self):
+        clients = []
+
+        def client(target):
+            clients.append(target)
+            return FakeClient(target)
+
+        prober = Prober(client, lambda es_client: [], ['a'])
+        with self.assertRaises(ProbeTargetError):
+            prober.registry('http://169.254.169.254')
+        # No client was created for the target.
+        self.assertEqual([], clients)
+
+    def test_endpoint(self):
+        def client(target):
+            if target == 'broken':
+                raise ValueError('Broken target.')
+            return FakeClient(target)
+
+        prober = Prober(client, lambda es_client: [TargetCollector(es_client)], ['a', 'broken'])
+        server = start_http_server(0, addr='127.0.0.1', registry=CollectorRegistry(), prober=prober)
+        port = server.sockets[0].getsockname()[1]
+
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+
+        def get(path):
+            conn.request('GET', path)
+            response = conn.getresponse()
+            return response.status, response.read().decode('utf-8')
+
+        status, body = get('/probe?target=a')
+        self.assertEqual(200, status)
+        self.assertIn('target_a 1.0', body)
+
+        status, body = get('/probe?target=b')
+        self.assertEqual(400, status)
+        self.assertEqual('Target not allowed: b', body)
+
+        self.assertEqual(400, get('/probe')[0])
+        self.assertEqual(500, get('/probe?target=broken')[0])
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
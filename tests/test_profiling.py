@@ -0,0 +1,125 @@
+import http.client
+import threading
+import time
+import tracemalloc
+import unittest
+
+from prometheus_client import CollectorRegistry
+
+from prometheus_es_exporter.profiling import MemoryProfiler, ProfilingError, sample_cpu
+from prometheus_es_exporter.server import start_http_server
+
+
+def busy(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class Test(unittest.TestCase):
+    def test_memory_profiler(self):
+        profiler = MemoryProfiler()
+        with self.assertRaises(ProfilingError):
+            profiler.report()
+
+        profiler.start()
+        try:
+            with self.assertRaises(ProfilingError):
+                profiler.start()
+
+            allocated = [str(n) * 100 for n in range(10000)]
+            report = profiler.report(limit=5)
+            self.assertIn(__file__, report)
+            del allocated
+        finally:
+            profiler.stop()
+
+        self.assertFalse(tracemalloc.is_tracing())
+        with self.assertRaises(ProfilingError):
+            profiler.stop()
+
+    def test_sample_cpu(self):
+        stop = threading.Event()
+        thread = threading.Thread(target=busy, args=(stop,), daemon=True)
+        thread.start()
+        try:
+            samples, self_counts, total_counts = sample_cpu(0.2)
+        finally:
+            stop.set()
+            thread.join()
+
+        self.assertGreater(samples, 0)
+        busy_key = (__file__, busy.__code__.co_firstlineno, 'busy')
+        self.assertIn(busy_key, total_counts)
+        # Idle threads (e.g. the ones waiting in join() and sample_cpu()'s
+        # sleep) aren't sampled.
+        self.assertEqual(samples, total_counts[busy_key])
+
+    def test_endpoints(self):
+        registry = CollectorRegistry()
+        server = start_http_server(0, addr='127.0.0.1', registry=registry, debug=True)
+        port = server.sockets[0].getsockname()[1]
+
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+
+        def request(method, path):
+            conn.request(method, path)
+            response = conn.getresponse()
+            return response.status, response.read().decode('utf-8'), response.getheader('Allow')
+
+        def get(path):
+            return request('GET', path)[:2]
+
+        def post(path):
+            return request('POST', path)[:2]
+
+        # Starting and stopping memory profiling requires POST.
+        self.assertEqual((405, '', 'POST'), request('GET', '/debug/memory/start'))
+        self.assertEqual((405, '', 'POST'), request('GET', '/debug/memory/stop'))
+        self.assertFalse(tracemalloc.is_tracing())
+
+        status, body = post('/debug/memory/start?frames=5')
+        self.assertEqual(200, status)
+        try:
+            self.assertEqual(409, post('/debug/memory/start')[0])
+            status, body = get('/debug/memory/snapshot?limit=3')
+            self.assertEqual(200, status)
+            self.assertIn('allocation sites', body)
+            self.assertEqual((405, '', 'GET, HEAD'), request('POST', '/debug/memory/snapshot'))
+        finally:
+            self.assertEqual(200, post('/debug/memory/stop')[0])
+        self.assertEqual(409, get('/debug/memory/snapshot')[0])
+
+        start_time = time.monotonic()
+        status, body = get('/debug/cpu?seconds=1&idle=true')
+        self.assertEqual(200, status)
+        self.assertGreaterEqual(time.monotonic() - start_time, 1)
+        self.assertIn('functions', body)
+
+        self.assertEqual(400, get('/debug/cpu?seconds=0')[0])
+        self.assertEqual(400, get('/debug/cpu?seconds=foo')[0])
+        self.assertEqual(404, get('/debug/missing')[0])
+        conn.close()
+
+    def test_endpoints_disabled(self):
+        registry = CollectorRegistry()
+        server = start_http_server(0, addr='127.0.0.1', registry=registry)
+        port = server.sockets[0].getsockname()[1]
+
+        # Metrics are served instead.
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+        conn.request('GET', '/debug/memory/snapshot')
+        response = conn.getresponse()
+        self.assertEqual(200, response.status)
+        self.assertTrue(response.getheader('Content-Type').startswith('text/plain; version='))
+        response.read()
+
+        conn.request('POST', '/debug/memory/start')
+        response = conn.getresponse()
+        self.assertEqual(405, response.status)
+        response.read()
+        conn.close()
+        self.assertFalse(tracemalloc.is_tracing())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import configparser
+import sched
+import threading
+import unittest
+
+from prometheus_es_exporter import (CONFIGPARSER_CONVERTERS, ConfigError, create_pool_executors,
+                                    parse_pools, parse_queries, schedule_queries)
+
+
+def load_config(config_str):
+    config = configparser.ConfigParser(converters=CONFIGPARSER_CONVERTERS)
+    config.read_string(config_str)
+    return config
+
+
+class Test(unittest.TestCase):
+    def test_pools(self):
+        config = load_config('''
+[pool_slow]
+PoolThreads = 3
+
+[pool_other]
+''')
+        self.assertEqual({'default': 4, 'slow': 3, 'other': 1}, parse_pools(config, 4))
+
+        # A pool_default section overrides the default pool size.
+        config = load_config('''
+[pool_default]
+PoolThreads = 2
+''')
+        self.assertEqual({'default': 2}, parse_pools(config, 4))
+
+        config = load_config('''
+[pool_slow]
+PoolThreads = 0
+''')
+        with self.assertRaises(ConfigError):
+            parse_pools(config, 1)
+
+    def test_query_pool(self):
+        config = load_config('''
+[pool_slow]
+PoolThreads = 1
+
+[query_fast]
+QueryJson = {"size": 0}
+
+[query_slow]
+QueryPool = slow
+QueryJson = {"size": 0}
+''')
+        pool_sizes = parse_pools(config, 1)
+        queries = parse_queries(config, pool_sizes)
+        self.assertEqual('default', queries['fast'][1])
+        self.assertEqual('slow', queries['slow'][1])
+
+        executors = create_pool_executors(pool_sizes)
+        default_thread_id = executors['default'].submit(threading.get_ident).result()
+        slow_thread_id = executors['slow'].submit(threading.get_ident).result()
+
+        query_threads = {}
+        done = threading.Event()
+
+        def run_query(es_client, query_name, *args, **kwargs):
+            query_threads[query_name] = threading.get_ident()
+            if len(query_threads) == 2:
+                done.set()
+
+        scheduler = sched.scheduler()
+        schedule_queries(scheduler, executors, queries, None, run_func=run_query)
+        scheduler.run(blocking=False)
+        self.assertTrue(done.wait(5))
+
+        # Each pool runs its queries in its own threads, so the slow pool's
+        # queries can't hold up the default pool's, or vice versa.
+        self.assertEqual(default_thread_id, query_threads['fast'])
+        self.assertEqual(slow_thread_id, query_threads['slow'])
+        self.assertNotEqual(threading.get_ident(), query_threads['fast'])
+        for executor in executors.values():
+            executor.shutdown()
+
+        # Without other pools, a single threaded default pool runs queries in
+        # the scheduler thread.
+        self.assertEqual({'default': None}, create_pool_executors({'default': 1}))
+
+    def test_unknown_pool(self):
+        config = load_config('''
+[query_foo]
+QueryPool = missing
+QueryJson = {"size": 0}
+''')
+        with self.assertRaisesRegex(ConfigError, 'Query foo uses unknown pool missing'):
+            parse_queries(config, parse_pools(config, 1))
+
+    def test_incremental_relative_range(self):
+        config = load_config('''
+[query_fixed]
+QueryIncrementalField = @timestamp
+QueryJson = {"query": {"range": {"@timestamp": {"gte": "2020-01-01"}}}}
+
+[query_relative]
+QueryJson = {"query": {"range": {"@timestamp": {"gte": "now-1d"}}}}
+''')
+        # Relative ranges are fine for queries that aren't incremental.
+        self.assertEqual(['fixed', 'relative'], list(parse_queries(config, parse_pools(config, 1))))
+
+        # A sliding window on the incremental field is removed from the query,
+        # and searched with fixed bounds by each run.
+        config = load_config('''
+[query_sliding]
+QueryIncrementalField = @timestamp
+QueryJson = {"query": {"bool": {"filter": [{"term": {"a": 1}}, {"range": {"@timestamp": {"gte": "now-1d"}}}]}}}
+''')
+        queries = parse_queries(config, parse_pools(config, 1))
+        query, query_options = queries['sliding'][4], queries['sliding'][7]
+        self.assertEqual({'bool': {'filter': [{'term': {'a': 1}}, {'match_all': {}}]}}, query['query'])
+        self.assertEqual(24 * 60 * 60 * 1000, query_options['incremental_window_size'])
+
+        # Other relative ranges are rejected.
+        for query_json in ('{"query": {"range": {"updated": {"gte": "now-1d"}}}}',
+                           '{"query": {"range": {"@timestamp": {"gte": "now-1d/d"}}}}',
+                           '{"query": {"range": {"@timestamp": {"gte": "now-1M"}}}}',
+                           '{"query": {"bool": {"must_not": {"range": {"@timestamp": {"gte": "now-1d"}}}}}}'):
+            config = load_config('''
+[query_relative]
+QueryIncrementalField = @timestamp
+QueryJson = {}
+'''.format(query_json))
+            with self.assertRaisesRegex(ConfigError, 'Query relative is incremental'):
+                parse_queries(config, parse_pools(config, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import http.server
+import threading
+import unittest
+
+import snappy
+from prometheus_client import CollectorRegistry, Gauge
+
+from prometheus_es_exporter.remote_write import RemoteWriter
+from tests.utils import decode_message
+
+
+class Receiver(http.server.HTTPServer):
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), ReceiverHandler)
+        self.requests = []
+        # Status codes to respond with, before responding with 204.
+        self.statuses = []
+
+
+class ReceiverHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((dict(self.headers), body))
+
+        status = self.server.statuses.pop(0) if self.server.statuses else 204
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def decode_write_request(body):
+    """
+    Decodes a WriteRequest into a dict of series labels tuple -> (value, timestamp).
+    """
+    series = {}
+    for timeseries in decode_message(snappy.uncompress(body))[1]:
+        fields = decode_message(timeseries)
+        labels = tuple((label[1][0].decode('utf-8'), label[2][0].decode('utf-8'))
+                       for label in map(decode_message, fields[1]))
+        sample = decode_message(fields[2][0])
+        series[labels] = (sample[1][0], sample[2][0])
+    return series
+
+
+class Test(unittest.TestCase):
+    maxDiff = None
+
+    def setUp(self):
+        self.receiver = Receiver()
+        threading.Thread(target=self.receiver.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/api/v1/write'.format(self.receiver.server_port)
+
+        self.registry = CollectorRegistry()
+        gauge = Gauge('foo', 'A gauge.', ['bar'], registry=self.registry)
+        gauge.labels('a').set(1)
+        gauge.labels('b').set(2)
+        Gauge('baz', 'Another gauge.', registry=self.registry).set(3)
+
+    def tearDown(self):
+        self.receiver.shutdown()
+        self.receiver.server_close()
+
+    def test_push(self):
+        writer = RemoteWriter(self.url, self.registry, batch_size=2,
+                              headers={'Authorization': 'Bearer token'})
+        writer.collect()
+        self.assertEqual(2, writer.queue.qsize())
+        while not writer.queue.empty():
+            self.assertTrue(writer.send(writer.queue.get()))
+
+        self.assertEqual(2, len(self.receiver.requests))
+        headers, _ = self.receiver.requests[0]
+        self.assertEqual('snappy', headers['Content-Encoding'])
+        self.assertEqual('application/x-protobuf', headers['Content-Type'])
+        self.assertEqual('0.1.0', headers['X-Prometheus-Remote-Write-Version'])
+        self.assertEqual('Bearer token', headers['Authorization'])
+
+        series = {}
+        for _, body in self.receiver.requests:
+            series.update(decode_write_request(body))
+
+        timestamps = set(timestamp for _, timestamp in series.values())
+        self.assertEqual(1, len(timestamps))
+        values = {labels: value for labels, (value, _) in series.items()}
+        self.assertEqual({
+            (('__name__', 'foo'), ('bar', 'a')): 1.0,
+            (('__name__', 'foo'), ('bar', 'b')): 2.0,
+            (('__name__', 'baz'),): 3.0,
+        }, values)
+
+    def test_retries(self):
+        self.receiver.statuses = [503, 429]
+        writer = RemoteWriter(self.url, self.registry, min_backoff=0)
+        writer.collect()
+        self.assertTrue(writer.send(writer.queue.get()))
+        self.assertEqual(3, len(self.receiver.requests))
+
+        # Client errors aren't retried.
+        self.receiver.statuses = [400]
+        writer.collect()
+        self.assertFalse(writer.send(writer.queue.get()))
+        self.assertEqual(4, len(self.receiver.requests))
+
+        # Retries are limited.
+        self.receiver.statuses = [500, 500, 500]
+        writer = RemoteWriter(self.url, self.registry, max_retries=2, min_backoff=0)
+        writer.collect()
+        self.assertFalse(writer.send(writer.queue.get()))
+        self.assertEqual(7, len(self.receiver.requests))
+
+    def test_queue_full(self):
+        writer = RemoteWriter(self.url, self.registry, batch_size=1, queue_size=2)
+        writer.collect()
+
+        # The oldest batches are dropped.
+        self.assertEqual(2, writer.queue.qsize())
+        for _ in range(2):
+            writer.send(writer.queue.get())
+        series = {}
+        for _, body in self.receiver.requests:
+            series.update(decode_write_request(body))
+        self.assertEqual({(('__name__', 'foo'), ('bar', 'b')), (('__name__', 'baz'),)},
+                         set(series))
+
+
+if __name__ == '__main__':
+    unittest.main()
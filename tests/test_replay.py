@@ -0,0 +1,84 @@
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+
+from elasticsearch import Elasticsearch
+
+from prometheus_es_exporter.connection import ExporterConnection
+from prometheus_es_exporter.recording import load_recordings, record_response
+from prometheus_es_exporter.replay import ReplayServer, scale_response
+
+
+HEALTH_RESPONSE = {'status': 'green', 'timed_out': False, 'number_of_nodes': 1}
+SEARCH_RESPONSE = {'took': 1, 'timed_out': False, 'aggregations': {}}
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.record_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.record_dir)
+
+    def test_record_and_replay(self):
+        record_response(self.record_dir, 'GET', '/_cluster/health', {'level': b'indices'}, None,
+                        200, json.dumps(HEALTH_RESPONSE))
+        record_response(self.record_dir, 'POST', '/foo/_search', {}, b'{"size": 0, "query": {}}',
+                        200, json.dumps(SEARCH_RESPONSE))
+
+        server = ReplayServer(('127.0.0.1', 0), self.record_dir)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            # Responses are recorded by the exporter's connections.
+            record_dir = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, record_dir)
+            es_client = Elasticsearch(['127.0.0.1:{}'.format(server.server_port)],
+                                      connection_class=ExporterConnection,
+                                      record_dir=record_dir)
+
+            self.assertEqual(HEALTH_RESPONSE, es_client.cluster.health(level='indices'))
+            # Equivalent bodies match.
+            self.assertEqual(SEARCH_RESPONSE,
+                             es_client.search(index='foo', body={'query': {}, 'size': 0}))
+            # Unmatched requests fall back to a recording for the same path.
+            self.assertEqual(SEARCH_RESPONSE, es_client.search(index='foo', body={'size': 1}))
+
+            recordings = list(load_recordings(record_dir))
+            self.assertEqual(3, len(recordings))
+            health_recording = next(recording for recording in recordings
+                                    if recording['path'] == '/_cluster/health')
+            self.assertEqual({'level': 'indices'}, health_recording['params'])
+            self.assertEqual(HEALTH_RESPONSE, json.loads(health_recording['response']))
+
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_scale(self):
+        nodes_stats = {'nodes': {'a': {'name': 'node-a', 'jvm': {}}}}
+        scaled = scale_response('/_nodes/stats', nodes_stats, nodes=3)
+        self.assertEqual(['a', 'a-0', 'a-1'], list(scaled['nodes']))
+        self.assertEqual('a-1', scaled['nodes']['a-1']['name'])
+
+        indices_stats = {'_all': {}, 'indices': {'foo': {}, 'bar': {}}}
+        scaled = scale_response('/_stats', indices_stats, indices=4)
+        self.assertEqual(['foo', 'bar', 'foo-0', 'bar-1'], list(scaled['indices']))
+
+        mappings = {'foo': {'mappings': {}}}
+        self.assertEqual(['foo', 'foo-0'], list(scale_response('/_mapping', mappings, indices=2)))
+
+        cat_indices = [{'index': 'foo', 'docs.count': '1'}]
+        scaled = scale_response('/_cat/indices', cat_indices, indices=2)
+        self.assertEqual(['foo', 'foo-0'], [row['index'] for row in scaled])
+        self.assertEqual([], scale_response('/_cat/indices', [], indices=2))
+        self.assertEqual({'indices': {}}, scale_response('/_stats', {'indices': {}}, indices=2))
+
+        # Responses without indices or nodes are left as they are.
+        self.assertEqual(SEARCH_RESPONSE,
+                         scale_response('/foo/_search', SEARCH_RESPONSE, indices=10, nodes=10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import threading
+import time
+import unittest
+
+from prometheus_es_exporter.request_budget import (HIGH_PRIORITY, NORMAL_PRIORITY,
+                                                   RequestBudget, request_priority)
+
+
+class Test(unittest.TestCase):
+    def test_rate(self):
+        budget = RequestBudget(rate=20, burst=2)
+
+        start_time = time.monotonic()
+        for _ in range(4):
+            budget.call(lambda: None)
+        # The first 2 requests are a burst, then each waits for a token.
+        self.assertGreaterEqual(time.monotonic() - start_time, 0.09)
+
+    def test_max_in_flight(self):
+        budget = RequestBudget(max_in_flight=2)
+        release = threading.Event()
+        max_in_flight = []
+
+        def request():
+            max_in_flight.append(budget.in_flight)
+            release.wait()
+
+        threads = [threading.Thread(target=budget.call, args=(request,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        self.assertEqual(2, len(max_in_flight))
+
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(4, len(max_in_flight))
+        self.assertEqual(2, max(max_in_flight))
+        self.assertEqual(0, budget.in_flight)
+
+    def test_try_acquire(self):
+        budget = RequestBudget(rate=1, burst=2, max_in_flight=1)
+
+        self.assertTrue(budget.try_acquire())
+        self.assertFalse(budget.try_acquire())
+        budget.release()
+
+        # A refunded request's token can be used again.
+        self.assertTrue(budget.try_acquire())
+        budget.release(refund=True)
+        self.assertTrue(budget.try_acquire())
+        budget.release()
+        self.assertFalse(budget.try_acquire())
+        self.assertEqual(0, budget.in_flight)
+
+    def test_priority(self):
+        budget = RequestBudget(max_in_flight=1)
+        order = []
+
+        budget.acquire()
+        normal = threading.Thread(target=budget.call, args=(order.append, 'normal'))
+        normal.start()
+        time.sleep(0.05)
+        high = threading.Thread(target=budget.call, args=(order.append, 'high'),
+                                kwargs={'priority': HIGH_PRIORITY})
+        high.start()
+        time.sleep(0.05)
+
+        # The high priority request is made first, despite waiting less.
+        budget.release()
+        normal.join()
+        high.join()
+        self.assertEqual(['high', 'normal'], order)
+
+    def test_request_priority(self):
+        self.assertEqual(HIGH_PRIORITY, request_priority('/_cluster/health'))
+        self.assertEqual(NORMAL_PRIORITY, request_priority('/_nodes/stats'))
+        self.assertEqual(NORMAL_PRIORITY, request_priority('/foo/_search'))
+
+
+if __name__ == '__main__':
+    unittest.main()
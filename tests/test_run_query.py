@@ -0,0 +1,262 @@
+import http.server
+import json
+import threading
+import unittest
+
+from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import ConnectionTimeout, TransportError
+from prometheus_client import CollectorRegistry
+
+from prometheus_es_exporter import METRICS_BY_QUERY, QueryMetricCollector, run_query
+from prometheus_es_exporter.connection import ExporterConnection
+from prometheus_es_exporter.query_stats import QUERY_STATS_METRICS
+
+
+class FakeClient(object):
+    """
+    Records the searches made, responding with the given responses in turn.
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.bodies = []
+
+    def search(self, index, body, request_timeout):
+        self.bodies.append(body)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def search_response(hits=1, took=5, timed_out=False):
+    return {'took': took, 'timed_out': timed_out, 'hits': {'total': hits}}
+
+
+# Non-ASCII, so its size in bytes and characters differ.
+SEARCH_RESPONSE = json.dumps(dict(search_response(), name='\u00e9' * 1000),
+                             ensure_ascii=False).encode('utf-8')
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(SEARCH_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(SEARCH_RESPONSE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.registry = CollectorRegistry()
+        for metric in QUERY_STATS_METRICS:
+            self.registry.register(metric)
+
+    def sample(self, name, query_name):
+        return self.registry.get_sample_value(name, {'query': query_name}) or 0
+
+    def test_query_range_unchanged(self):
+        query = {'size': 0, 'query': {'range': {'@timestamp': {'gte': 'now-1d'}}}}
+        es_client = FakeClient(search_response())
+
+        run_query(es_client, 'range_unchanged', 'foo', query, 10, 'drop', 'drop')
+        self.assertEqual([query], es_client.bodies)
+
+    def test_incremental(self):
+        query = {'size': 0, 'query': {'match_all': {}}}
+        es_client = FakeClient(search_response(hits=10), search_response(hits=2))
+
+        run_query(es_client, 'incremental', 'foo', query, 10, 'drop', 'drop',
+                  incremental_field='@timestamp')
+        run_query(es_client, 'incremental', 'foo', query, 10, 'drop', 'drop',
+                  incremental_field='@timestamp')
+
+        # The first, full, run covers everything up to the end of the window.
+        full_range = es_client.bodies[0]['query']['bool']['filter'][0]['range']['@timestamp']
+        self.assertEqual({'format', 'lt'}, set(full_range))
+        # The next run covers the window since then, and its results are added.
+        window_range = es_client.bodies[1]['query']['bool']['filter'][0]['range']['@timestamp']
+        self.assertEqual(full_range['lt'], window_range['gte'])
+        self.assertEqual(12, METRICS_BY_QUERY['incremental']['incremental_hits'][2][()])
+
+    def test_incremental_sliding_window(self):
+        query = {'size': 0, 'query': {'match_all': {}}}
+        es_client = FakeClient(search_response(hits=10, took=5),
+                               search_response(hits=3, took=2), search_response(hits=2, took=1))
+        window_size = 24 * 60 * 60 * 1000
+
+        run_query(es_client, 'sliding', 'foo', query, 10, 'drop', 'drop',
+                  incremental_field='@timestamp', incremental_window_size=window_size)
+        run_query(es_client, 'sliding', 'foo', query, 10, 'drop', 'drop',
+                  incremental_field='@timestamp', incremental_window_size=window_size)
+
+        def body_range(body):
+            return body['query']['bool']['filter'][0]['range']['@timestamp']
+
+        # The first, full, run covers the sliding window.
+        full_range = body_range(es_client.bodies[0])
+        self.assertEqual(full_range['lt'] - window_size, full_range['gte'])
+        # The next run adds the results for the window since then, and
+        # subtracts those that have left the sliding window.
+        window_range = body_range(es_client.bodies[1])
+        self.assertEqual(full_range['lt'], window_range['gte'])
+        expired_range = body_range(es_client.bodies[2])
+        self.assertEqual(full_range['gte'], expired_range['gte'])
+        self.assertEqual(window_range['lt'] - window_size, expired_range['lt'])
+
+        metric_dict = METRICS_BY_QUERY['sliding']
+        self.assertEqual(11, metric_dict['sliding_hits'][2][()])
+        self.assertEqual(3, metric_dict['sliding_took_milliseconds'][2][()])
+        self.assertEqual(2, self.sample('es_query_took_seconds_count', 'sliding'))
+
+    def test_generation(self):
+        query = {'size': 0, 'query': {'match_all': {}}}
+        es_client = FakeClient(search_response(hits=1), search_response(hits=1),
+                               search_response(hits=2), search_response(hits=3))
+        collector = QueryMetricCollector('generation')
+        all_collector = QueryMetricCollector()
+
+        run_query(es_client, 'generation', 'foo', query, 10, 'drop', 'drop')
+        generation = collector.generation()
+        all_generation = all_collector.generation()
+
+        # The generation only changes when the query's metrics change.
+        run_query(es_client, 'generation', 'foo', query, 10, 'drop', 'drop')
+        self.assertEqual(generation, collector.generation())
+        self.assertEqual(all_generation, all_collector.generation())
+
+        run_query(es_client, 'generation', 'foo', query, 10, 'drop', 'drop')
+        self.assertNotEqual(generation, collector.generation())
+        self.assertNotEqual(all_generation, all_collector.generation())
+
+        # Other queries' runs don't change it.
+        generation = collector.generation()
+        run_query(es_client, 'other_generation', 'foo', query, 10, 'drop', 'drop')
+        self.assertEqual(generation, collector.generation())
+
+    def test_composite_pages(self):
+        query = {
+            'size': 0,
+            'query': {'match_all': {}},
+            'aggs': {
+                'hosts': {'composite': {'size': 2, 'sources': [{'host': {'terms': {'field': 'host'}}}]}},
+                'levels': {'terms': {'field': 'level'}},
+            },
+        }
+
+        def page(hosts, after_key, took, levels=True):
+            aggs = {'hosts': {'after_key': after_key,
+                              'buckets': [{'key': {'host': host}, 'doc_count': 1} for host in hosts]}}
+            if levels:
+                aggs['levels'] = {'buckets': [{'key': 'error', 'doc_count': 4}]}
+            return dict(search_response(hits=4, took=took), aggregations=aggs)
+
+        es_client = FakeClient(page(['a', 'b'], {'host': 'b'}, 10),
+                               page(['c', 'd'], {'host': 'd'}, 20, levels=False),
+                               page(['e'], {'host': 'e'}, 30, levels=False))
+
+        run_query(es_client, 'composite', 'foo', query, 10, 'drop', 'drop', composite_max_pages=3)
+
+        # Later pages only fetch the remaining composite buckets, following the after key.
+        self.assertEqual(3, len(es_client.bodies))
+        self.assertNotIn('after', es_client.bodies[0]['aggs']['hosts']['composite'])
+        for body, after in zip(es_client.bodies[1:], ({'host': 'b'}, {'host': 'd'})):
+            self.assertEqual(0, body['size'])
+            self.assertEqual({'hosts'}, set(body['aggs']))
+            self.assertEqual(after, body['aggs']['hosts']['composite']['after'])
+
+        # The pages are merged, and took is the total for all pages.
+        metric_dict = METRICS_BY_QUERY['composite']
+        self.assertEqual({('a',): 1, ('b',): 1, ('c',): 1, ('d',): 1, ('e',): 1},
+                         metric_dict['composite_hosts_doc_count'][2])
+        self.assertEqual({('error',): 4}, metric_dict['composite_levels_doc_count'][2])
+        self.assertEqual({(): 60}, metric_dict['composite_took_milliseconds'][2])
+        self.assertEqual(0.06, self.sample('es_query_took_seconds_sum', 'composite'))
+
+    def test_composite_max_pages(self):
+        query = {
+            'size': 0,
+            'query': {'match_all': {}},
+            'aggs': {'hosts': {'composite': {'size': 1, 'sources': [{'host': {'terms': {'field': 'host'}}}]}}},
+        }
+
+        def page(host):
+            aggs = {'hosts': {'after_key': {'host': host},
+                              'buckets': [{'key': {'host': host}, 'doc_count': 1}]}}
+            return dict(search_response(), aggregations=aggs)
+
+        es_client = FakeClient(page('a'), page('b'), page('c'))
+
+        with self.assertLogs('prometheus_es_exporter', 'WARNING') as logs:
+            run_query(es_client, 'composite_max_pages', 'foo', query, 10, 'drop', 'drop',
+                      composite_max_pages=2)
+
+        self.assertEqual(2, len(es_client.bodies))
+        self.assertIn('more than 2 pages', logs.output[0])
+        self.assertEqual({('a',): 1, ('b',): 1},
+                         METRICS_BY_QUERY['composite_max_pages']['composite_max_pages_hosts_doc_count'][2])
+
+    def test_stats(self):
+        query = {'size': 0, 'query': {'match_all': {}}}
+        es_client = FakeClient(search_response(hits=3, took=250))
+
+        run_query(es_client, 'stats', 'foo', query, 10, 'drop', 'drop')
+        self.assertEqual(1, self.sample('es_query_took_seconds_count', 'stats'))
+        self.assertEqual(0.25, self.sample('es_query_took_seconds_sum', 'stats'))
+        self.assertEqual(1, self.sample('es_query_duration_seconds_count', 'stats'))
+        self.assertEqual(1, self.sample('es_query_parse_duration_seconds_count', 'stats'))
+        # The hits and took metrics.
+        self.assertEqual(2, self.sample('es_query_series_sum', 'stats'))
+        self.assertEqual(0, self.sample('es_query_timeouts_total', 'stats'))
+        self.assertEqual(0, self.sample('es_query_errors_total', 'stats'))
+        self.assertGreater(self.sample('es_query_last_success_timestamp_seconds', 'stats'), 0)
+
+    def test_response_size(self):
+        server = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            es_client = Elasticsearch(['127.0.0.1:{}'.format(server.server_port)],
+                                      connection_class=ExporterConnection)
+            query = {'size': 0, 'query': {'match_all': {}}}
+            run_query(es_client, 'response_size', 'foo', query, 10, 'drop', 'drop')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(1, self.sample('es_query_response_size_bytes_count', 'response_size'))
+        self.assertEqual(len(SEARCH_RESPONSE),
+                         self.sample('es_query_response_size_bytes_sum', 'response_size'))
+
+    def test_timeouts(self):
+        query = {'size': 0, 'query': {'match_all': {}}}
+        es_client = FakeClient(search_response(timed_out=True),
+                               ConnectionTimeout('TIMEOUT', 'timed out', None))
+
+        run_query(es_client, 'timeouts', 'foo', query, 10, 'drop', 'drop')
+        self.assertEqual(1, self.sample('es_query_timeouts_total', 'timeouts'))
+        # Partial results of a timed out search are still a response.
+        self.assertEqual(1, self.sample('es_query_took_seconds_count', 'timeouts'))
+
+        run_query(es_client, 'timeouts', 'foo', query, 10, 'drop', 'drop')
+        self.assertEqual(2, self.sample('es_query_timeouts_total', 'timeouts'))
+        self.assertEqual(0, self.sample('es_query_errors_total', 'timeouts'))
+        self.assertEqual(1, self.sample('es_query_took_seconds_count', 'timeouts'))
+
+    def test_errors(self):
+        query = {'size': 0, 'query': {'match_all': {}}}
+        es_client = FakeClient(TransportError(500, 'error', None))
+
+        run_query(es_client, 'errors', 'foo', query, 10, 'drop', 'drop')
+        self.assertEqual(1, self.sample('es_query_errors_total', 'errors'))
+        self.assertEqual(0, self.sample('es_query_timeouts_total', 'errors'))
+        self.assertEqual(0, self.sample('es_query_took_seconds_count', 'errors'))
+        self.assertEqual(0, self.sample('es_query_last_success_timestamp_seconds', 'errors'))
+
+
+if __name__ == '__main__':
+    unittest.main()
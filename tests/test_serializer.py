@@ -0,0 +1,40 @@
+import pickle
+import unittest
+
+from elasticsearch.exceptions import SerializationError
+
+from prometheus_es_exporter.serializer import ExporterSerializer, JSON_DECODERS, json_decoder
+
+
+RESPONSE = '{"a": 1, "b": [1.5, "c", null, true], "d": {"e": 18446744073709551616}}'
+DECODED = {'a': 1, 'b': [1.5, 'c', None, True], 'd': {'e': 18446744073709551616}}
+
+
+class Test(unittest.TestCase):
+    def test_decoders(self):
+        # Integers beyond 64 bits aren't supported by all decoders, so must be
+        # handled by the fallback.
+        for name in JSON_DECODERS:
+            with self.subTest(decoder=name):
+                serializer = ExporterSerializer(name)
+                self.assertEqual(DECODED, serializer.loads(RESPONSE))
+
+                with self.assertRaises(SerializationError):
+                    serializer.loads('{"invalid')
+
+    def test_auto(self):
+        self.assertIs(next(iter(JSON_DECODERS.values())), json_decoder('auto'))
+
+    def test_not_installed(self):
+        with self.assertRaises(ValueError):
+            json_decoder('unknown')
+
+    def test_pickle(self):
+        serializer = ExporterSerializer('json')
+        unpickled = pickle.loads(pickle.dumps(serializer))
+        self.assertEqual('json', unpickled.decoder)
+        self.assertEqual(DECODED, unpickled.loads(RESPONSE))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+import http.client
+import socket
+import time
+import unittest
+
+from prometheus_client import CollectorRegistry, Gauge, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+from prometheus_es_exporter.registry import ExporterRegistry
+from prometheus_es_exporter.server import start_http_server
+
+
+class SnapshotCollector(object):
+    def __init__(self):
+        self.value = 0
+
+    def generation(self):
+        return self.value
+
+    def collect(self):
+        yield GaugeMetricFamily('snapshot', 'A snapshot.', value=self.value)
+
+
+class LargeCollector(object):
+    """
+    Collects enough metrics to fill the connection's socket buffers.
+    """
+
+    def collect(self):
+        for n in range(100):
+            family = GaugeMetricFamily('large_{}'.format(n), 'A large gauge.', labels=['label'])
+            for m in range(2000):
+                family.add_metric(['{:0100d}'.format(m)], m)
+            yield family
+
+
+class Test(unittest.TestCase):
+    maxDiff = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.registry = CollectorRegistry()
+        gauge = Gauge('foo', 'A gauge.', ['bar'], registry=cls.registry)
+        for n in range(1000):
+            gauge.labels(str(n)).set(n)
+
+        cls.sub_registry = CollectorRegistry()
+        Gauge('baz', 'Another gauge.', registry=cls.sub_registry).set(1)
+
+        cls.snapshot_collector = SnapshotCollector()
+        snapshot_registry = ExporterRegistry()
+        snapshot_registry.register(cls.snapshot_collector)
+
+        server = start_http_server(0, addr='127.0.0.1', registry=cls.registry,
+                                   collector_registries={'baz': cls.sub_registry,
+                                                         'snapshot': snapshot_registry})
+        cls.port = server.sockets[0].getsockname()[1]
+
+    def test_keep_alive(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        expected = generate_latest(self.registry)
+
+        for _ in range(2):
+            conn.request('GET', '/metrics')
+            response = conn.getresponse()
+            self.assertEqual(200, response.status)
+            self.assertEqual('chunked', response.getheader('Transfer-Encoding'))
+            self.assertEqual(expected, response.read())
+
+        conn.close()
+
+    def test_collector_registry(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        conn.request('GET', '/metrics/baz')
+        response = conn.getresponse()
+        self.assertEqual(200, response.status)
+        self.assertEqual(generate_latest(self.sub_registry), response.read())
+
+        conn.request('GET', '/metrics/missing')
+        response = conn.getresponse()
+        self.assertEqual(404, response.status)
+        response.read()
+        conn.close()
+
+    def test_collect_params(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        conn.request('GET', '/metrics?collect[]=baz&collect[]=baz')
+        response = conn.getresponse()
+        self.assertEqual(200, response.status)
+        self.assertEqual(generate_latest(self.sub_registry), response.read())
+
+        conn.request('GET', '/metrics?collect[]=baz&collect[]=missing')
+        response = conn.getresponse()
+        self.assertEqual(400, response.status)
+        self.assertEqual(b'Unknown collectors: missing', response.read())
+        conn.close()
+
+    def test_etag(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        conn.request('GET', '/metrics/snapshot')
+        response = conn.getresponse()
+        self.assertEqual(200, response.status)
+        self.assertIn(b'snapshot 0.0', response.read())
+        etag = response.getheader('ETag')
+        self.assertIsNotNone(etag)
+
+        conn.request('GET', '/metrics/snapshot', headers={'If-None-Match': etag})
+        response = conn.getresponse()
+        self.assertEqual(304, response.status)
+        self.assertEqual(etag, response.getheader('ETag'))
+        self.assertEqual(b'', response.read())
+
+        # A different encoding has a different ETag.
+        conn.request('GET', '/metrics/snapshot',
+                     headers={'If-None-Match': etag, 'Accept-Encoding': 'gzip'})
+        response = conn.getresponse()
+        self.assertEqual(200, response.status)
+        response.read()
+
+        self.snapshot_collector.value = 1
+        conn.request('GET', '/metrics/snapshot', headers={'If-None-Match': etag})
+        response = conn.getresponse()
+        self.assertEqual(200, response.status)
+        self.assertIn(b'snapshot 1.0', response.read())
+        self.assertNotEqual(etag, response.getheader('ETag'))
+
+        # Registries with collectors that aren't snapshots have no ETag.
+        conn.request('GET', '/metrics/baz')
+        response = conn.getresponse()
+        self.assertIsNone(response.getheader('ETag'))
+        response.read()
+        conn.close()
+
+    def test_head(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        conn.request('HEAD', '/metrics')
+        response = conn.getresponse()
+        self.assertEqual(200, response.status)
+        self.assertEqual(b'', response.read())
+        conn.close()
+
+    def test_method_not_allowed(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        conn.request('POST', '/metrics', body=b'foo')
+        response = conn.getresponse()
+        self.assertEqual(405, response.status)
+        response.read()
+        conn.close()
+
+    def test_write_timeout(self):
+        registry = ExporterRegistry()
+        registry.register(LargeCollector())
+        server = start_http_server(0, addr='127.0.0.1', registry=registry, write_timeout=0.5)
+        port = server.sockets[0].getsockname()[1]
+
+        # A client that stops reading the response.
+        stalled = socket.socket()
+        stalled.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        stalled.connect(('127.0.0.1', port))
+        stalled.sendall(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        time.sleep(2)
+
+        # The stalled response is abandoned, and the connection closed before
+        # the end of the response.
+        stalled.settimeout(5)
+        received = []
+        while True:
+            data = stalled.recv(65536)
+            if not data:
+                break
+            received.append(data)
+        stalled.close()
+        self.assertFalse(b''.join(received).endswith(b'0\r\n\r\n'))
+
+        # Other clients still get the full response.
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        conn.request('GET', '/metrics')
+        response = conn.getresponse()
+        self.assertEqual(200, response.status)
+        self.assertIn(b'large_99{', response.read())
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
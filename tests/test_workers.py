@@ -0,0 +1,79 @@
+import json
+import pickle
+import unittest
+
+from elasticsearch.exceptions import ConnectionTimeout
+
+from prometheus_es_exporter import ClusterHealthCollector, fetch_collector_metric_dict
+from prometheus_es_exporter.serializer import ExporterSerializer, raw_responses
+from prometheus_es_exporter.workers import ParsePool, WorkerError, WorkerPool
+
+
+HEALTH_RESPONSE = {'status': 'green', 'timed_out': False, 'number_of_nodes': 3}
+
+
+class FakeCluster(object):
+    def health(self, level, request_timeout):
+        # Decode the response like a real client would.
+        return ExporterSerializer().loads(json.dumps(HEALTH_RESPONSE))
+
+
+class FakeClient(object):
+    cluster = FakeCluster()
+
+
+def client_type(es_client, suffix):
+    return type(es_client).__name__ + suffix
+
+
+def raise_error(es_client, error):
+    raise error
+
+
+class Test(unittest.TestCase):
+    def test_collector_pickle(self):
+        collector = ClusterHealthCollector(FakeClient(), 10, 'cluster', worker_pool=object())
+        unpickled = pickle.loads(pickle.dumps(collector))
+        self.assertIsNone(unpickled.es_client)
+        self.assertIsNone(unpickled.worker_pool)
+        self.assertEqual('cluster', unpickled.level)
+
+        metric_dict = fetch_collector_metric_dict(FakeClient(), unpickled)
+        self.assertEqual({(): 3}, metric_dict['es_cluster_health_number_of_nodes'][2])
+
+    def test_worker_pool(self):
+        worker_pool = WorkerPool(1, ['localhost:9200'], {})
+        try:
+            self.assertEqual('Elasticsearch!', worker_pool.call(client_type, '!'))
+
+            with self.assertRaises(ConnectionTimeout):
+                worker_pool.call(raise_error,
+                                 ConnectionTimeout('TIMEOUT', 'Timed out.', OSError('Timed out.')))
+
+            with self.assertRaises(WorkerError) as context:
+                worker_pool.call(raise_error, ValueError('Bad value.'))
+            self.assertIn('ValueError: Bad value.', str(context.exception))
+        finally:
+            worker_pool.executor.shutdown()
+
+    def test_parse_pool(self):
+        parse_pool = ParsePool(1)
+        try:
+            collector = ClusterHealthCollector(FakeClient(), 10, 'cluster', parse_pool=parse_pool)
+            metric_dict = collector.fetch_metric_dict()
+            self.assertEqual({(): 3}, metric_dict['es_cluster_health_number_of_nodes'][2])
+
+            with self.assertRaises(WorkerError):
+                parse_pool.parse(collector, '{"invalid')
+        finally:
+            parse_pool.executor.shutdown()
+
+    def test_raw_responses(self):
+        serializer = ExporterSerializer()
+        with raw_responses():
+            self.assertEqual('{"a": 1}', serializer.loads('{"a": 1}'))
+        self.assertEqual({'a': 1}, serializer.loads('{"a": 1}'))
+
+
+if __name__ == '__main__':
+    unittest.main()
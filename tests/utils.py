@@ -1,3 +1,6 @@
+import struct
+
+from prometheus_es_exporter import protobuf
 from prometheus_es_exporter.metrics import group_metrics
 
 
@@ -39,3 +42,35 @@ def convert_metric_dict(metric_dict):
 def convert_result(result):
     metric_dict = group_metrics(result)
     return convert_metric_dict(metric_dict)
+
+
+def decode_message(data):
+    """
+    Decodes a protobuf message into a dict of field number -> list of values.
+    """
+    fields = {}
+    pos = 0
+    while pos < len(data):
+        key, pos = protobuf.decode_varint(data, pos)
+        field_number, wire_type = key >> 3, key & 0x7
+        if wire_type == protobuf.VARINT:
+            value, pos = protobuf.decode_varint(data, pos)
+        elif wire_type == protobuf.FIXED64:
+            value, = struct.unpack('<d', data[pos:pos + 8])
+            pos += 8
+        else:
+            length, pos = protobuf.decode_varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        fields.setdefault(field_number, []).append(value)
+    return fields
+
+
+def decode_delimited(data):
+    messages = []
+    pos = 0
+    while pos < len(data):
+        length, pos = protobuf.decode_varint(data, pos)
+        messages.append(decode_message(data[pos:pos + length]))
+        pos += length
+    return messages